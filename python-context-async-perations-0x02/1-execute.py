@@ -1,31 +1,156 @@
 import sqlite3
+import threading
+
+from columnar import fetch_columns
+from query_pool import PROGRESS_STEPS, StatementLimit, get_pool
+
+DEFAULT_ARRAYSIZE = 1000
+
+
+class RowIterator:
+    """
+    Lazy iterator over the rows of an executed cursor.
+    Rows are fetched arraysize at a time with fetchmany(), so only one
+    batch is held in memory however large the result is.
+    """
+
+    def __init__(self, cursor, arraysize=DEFAULT_ARRAYSIZE):
+        self.cursor = cursor
+        self.cursor.arraysize = arraysize
+        self._rows = iter(())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        for row in self._rows:
+            return row
+        rows = self.cursor.fetchmany()
+        if not rows:
+            raise StopIteration
+        self._rows = iter(rows)
+        return next(self._rows)
+
+    def batches(self):
+        """Yield the remaining rows as lists of up to arraysize rows."""
+        rows = list(self._rows)
+        self._rows = iter(())
+        if rows:
+            yield rows
+        while True:
+            rows = self.cursor.fetchmany()
+            if not rows:
+                return
+            yield rows
+
 
 class ExecuteQuery:
     """
     Custom context manager for executing SQL queries.
     Manages connection setup and teardown, and returns results.
+
+    By default the query's rows are returned as a list. Options:
+
+    - stream=True: return a RowIterator that fetches arraysize rows at a
+      time instead, for results too large to hold in memory; it is valid
+      until the with block ends
+    - many=True: run the query once per parameter tuple in params (any
+      iterable, consumed lazily) with executemany(); the rowcount is
+      returned and the batch is committed when the block ends, or rolled
+      back if it raises
+    - columnar=True: return a dict of column name -> values instead of
+      rows, built arraysize rows at a time: numeric columns as NumPy
+      arrays (array.array if NumPy is missing, or with columnar='array'),
+      other columns as lists. NULLs in a numeric column read as 0 (NaN
+      in float columns) and are flagged in the result's nulls masks
+    - pool: borrow the connection instead of opening one. True uses the
+      shared pool for db_path (see query_pool); any object with acquire()
+      and release() may be passed too. Pooled connections keep their
+      prepared statement cache, so repeated queries skip re-parsing.
+    - timeout: seconds the block's statements may run, counted from
+      __enter__; a statement still running then is interrupted and
+      query_pool.QueryTimeout is raised. cancel() interrupts the running
+      statement from another thread (QueryCancelled), and leaving the
+      block early stops a streamed query where it is.
     """
 
-    def __init__(self, db_path, query, params=None):
+    def __init__(self, db_path, query, params=None, stream=False,
+                 arraysize=DEFAULT_ARRAYSIZE, pool=None, many=False, columnar=False,
+                 timeout=None):
+        if sum(map(bool, (stream, many, columnar))) > 1:
+            raise ValueError("stream, many and columnar cannot be combined")
+        if columnar not in (False, True, 'array', 'numpy'):
+            raise ValueError("columnar must be True, 'array' or 'numpy'")
         self.db_path = db_path
         self.query = query
         self.params = params if params is not None else ()
+        self.stream = stream
+        self.arraysize = arraysize
+        self.pool = get_pool(db_path) if pool is True else pool
+        self.many = many
+        self.columnar = columnar
+        self.timeout = timeout
+        self.limit = None
+        self._lock = threading.Lock()
         self.conn = None
         self.cursor = None
         self.result = None
 
     def __enter__(self):
-        self.conn = sqlite3.connect(self.db_path)
-        self.cursor = self.conn.cursor()
-        self.cursor.execute(self.query, self.params)
-        self.result = self.cursor.fetchall()
+        if self.pool is not None:
+            self.conn = self.pool.acquire()
+        else:
+            self.conn = sqlite3.connect(self.db_path)
+        self.limit = StatementLimit(self.timeout)
+        if self.timeout is not None:
+            self.conn.set_progress_handler(self.limit, PROGRESS_STEPS)
+        try:
+            self.cursor = self.conn.cursor()
+            if self.many:
+                self.cursor.executemany(self.query, self.params)
+                self.result = self.cursor.rowcount
+            else:
+                self.cursor.execute(self.query, self.params)
+                if self.stream:
+                    self.result = RowIterator(self.cursor, self.arraysize)
+                elif self.columnar:
+                    use_numpy = {True: None, 'array': False, 'numpy': True}[self.columnar]
+                    self.result = fetch_columns(self.cursor, self.arraysize, use_numpy)
+                else:
+                    self.result = self.cursor.fetchall()
+        except BaseException as e:
+            self.__exit__(type(e), e, e.__traceback__)
+            raise
         return self.result
 
+    def cancel(self):
+        """Interrupt the statement running inside the block; safe to call from any thread."""
+        with self._lock:
+            if self.conn is not None:
+                self.limit.cancel()
+                self.conn.interrupt()
+
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.cursor:
-            self.cursor.close()
-        if self.conn:
-            self.conn.close()
+        try:
+            if self.many and self.conn.in_transaction:
+                if exc_type is None:
+                    self.conn.commit()
+                else:
+                    self.conn.rollback()
+        finally:
+            with self._lock:
+                if self.cursor:
+                    self.cursor.close()
+                if self.timeout is not None:
+                    self.conn.set_progress_handler(None, 0)
+                if self.pool is not None:
+                    self.pool.release(self.conn)
+                elif self.conn:
+                    self.conn.close()
+                self.cursor = self.conn = None
+        translated = self.limit.translate(exc_val)
+        if translated is not None:
+            raise translated from exc_val
 
 if __name__ == "__main__":
     db_path = "my_database.db"
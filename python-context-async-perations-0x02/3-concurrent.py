@@ -1,25 +1,30 @@
 import asyncio
-import aiosqlite
+
+from async_pool import close_pools, gather_bounded, get_pool
 
 DB_PATH = "my_database.db"
 
 async def async_fetch_users():
-    async with aiosqlite.connect(DB_PATH) as db:
+    # Borrow a pooled connection instead of starting a connection (and its thread) per query
+    async with get_pool(DB_PATH).connection() as db:
         async with db.execute("SELECT * FROM users") as cursor:
             users = await cursor.fetchall()
     return users
 
 async def async_fetch_older_users():
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with get_pool(DB_PATH).connection() as db:
         async with db.execute("SELECT * FROM users WHERE age > ?", (40,)) as cursor:
             users = await cursor.fetchall()
     return users
 
 async def fetch_concurrently():
-    users_all, users_older = await asyncio.gather(
-        async_fetch_users(),
-        async_fetch_older_users()
-    )
+    try:
+        users_all, users_older = await gather_bounded([
+            async_fetch_users(),
+            async_fetch_older_users()
+        ])
+    finally:
+        await close_pools()
     print("All users:", users_all)
     print("Users older than 40:", users_older)
 
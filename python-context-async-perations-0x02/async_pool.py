@@ -0,0 +1,224 @@
+import asyncio
+import sqlite3
+import weakref
+from contextlib import aclosing, asynccontextmanager
+
+import aiosqlite
+
+from query_pool import PROGRESS_STEPS, StatementLimit
+
+#### bounded aiosqlite connection pool, a gather with limited concurrency and streaming reads
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be borrowed within the wait timeout."""
+
+
+class _ProgressSlot:
+    # Progress handler installed once per connection; connection() swaps the
+    # limit it defers to without a round trip to aiosqlite's thread.
+    __slots__ = ('limit',)
+
+    def __init__(self):
+        self.limit = None
+
+    def __call__(self):
+        limit = self.limit
+        return limit() if limit is not None else 0
+
+
+class AsyncConnectionPool:
+    """
+    Bounded pool of aiosqlite connections to one SQLite file.
+
+    Every aiosqlite connection runs on its own thread, so max_size also
+    caps the number of database threads. Coroutines beyond that wait (up
+    to timeout seconds) for a connection to be released. A pool belongs
+    to the event loop it is first used on.
+
+    While a connection is checked out, its statements stop (with an
+    "interrupted" error) as soon as the borrowing task is cancelled, and
+    with query_timeout set, once they have run that many seconds after the
+    checkout, raising query_pool.QueryTimeout. iter_batches() gives each
+    of its fetches the full query_timeout instead, so a slow consumer does
+    not make the stream time out. Either way a runaway query no longer
+    keeps its thread busy and the connection out of the pool.
+    """
+
+    def __init__(self, db_path, max_size=5, timeout=10.0, query_timeout=None):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.query_timeout = query_timeout
+        self._idle = []
+        self._size = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        async with self._cond:
+            try:
+                await asyncio.wait_for(
+                    self._cond.wait_for(lambda: self._idle or self._size < self.max_size),
+                    timeout)
+            except asyncio.TimeoutError:
+                raise PoolTimeout(f"no connection to '{self.db_path}' available "
+                                  f"after {timeout}s (max_size={self.max_size})") from None
+            if self._idle:
+                return self._idle.pop()
+            self._size += 1
+        try:
+            conn = await aiosqlite.connect(self.db_path)
+            conn.progress_slot = _ProgressSlot()
+            await conn.set_progress_handler(conn.progress_slot, PROGRESS_STEPS)
+            return conn
+        except BaseException:
+            async with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    async def release(self, conn):
+        try:
+            if conn.in_transaction:
+                await conn.rollback()
+        except Exception:
+            await self._discard(conn)
+            return
+        async with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    async def _discard(self, conn):
+        try:
+            await conn.close()
+        finally:
+            async with self._cond:
+                self._size -= 1
+                self._cond.notify()
+
+    @asynccontextmanager
+    async def connection(self, timeout=None):
+        conn = await self.acquire(timeout)
+        limit = conn.progress_slot.limit = StatementLimit(self.query_timeout,
+                                                          asyncio.current_task())
+        try:
+            yield conn
+        except sqlite3.OperationalError as e:
+            translated = limit.translate(e)
+            if translated is None:
+                raise
+            raise translated from e
+        except asyncio.CancelledError:
+            limit.cancel()
+            await conn.interrupt()
+            # Queued behind the interrupted statement: returns once it has stopped,
+            # so the connection is never handed out while it is still running.
+            await conn.set_progress_handler(conn.progress_slot, PROGRESS_STEPS)
+            raise
+        finally:
+            conn.progress_slot.limit = None
+            await self.release(conn)
+
+    async def close(self):
+        """Close the idle connections; their threads end with them."""
+        async with self._cond:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            await self._discard(conn)
+
+
+_pools = weakref.WeakKeyDictionary()  # event loop -> {db_path: AsyncConnectionPool}
+
+
+def get_pool(db_path, max_size=5, query_timeout=None):
+    """Return the running loop's shared pool for db_path, creating it on first use."""
+    pools = _pools.setdefault(asyncio.get_running_loop(), {})
+    pool = pools.get(db_path)
+    if pool is None:
+        pool = pools[db_path] = AsyncConnectionPool(db_path, max_size,
+                                                    query_timeout=query_timeout)
+    return pool
+
+
+async def close_pools():
+    """Close the running loop's pools; call it before the loop ends."""
+    pools = _pools.pop(asyncio.get_running_loop(), {})
+    for pool in pools.values():
+        await pool.close()
+
+
+async def gather_bounded(aws, limit=10):
+    """
+    Like asyncio.gather(), but with at most limit of the awaitables running
+    at once; results come back in the order the awaitables were given.
+    Items may also be zero-argument callables returning an awaitable, so
+    that nothing is even created before its turn.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw):
+        async with semaphore:
+            return await (aw() if callable(aw) else aw)
+
+    return await asyncio.gather(*(run(aw) for aw in aws))
+
+
+async def _prefetch(conn, cursor, queue, arraysize, seconds, task):
+    # Runs ahead of the consumer until the queue is full; an empty batch marks the end.
+    # Each fetch gets a limit of its own, so time spent waiting on the consumer
+    # does not count against query_timeout.
+    try:
+        while True:
+            limit = conn.progress_slot.limit = StatementLimit(seconds, task)
+            rows = await cursor.fetchmany(arraysize)
+            await queue.put(rows)
+            if not rows:
+                return
+    except Exception as e:
+        translated = limit.translate(e)
+        if translated is not None:
+            translated.__cause__ = e
+        await queue.put(translated or e)
+
+
+async def iter_batches(db_path, query, params=(), arraysize=500, prefetch=2, pool=None):
+    """
+    Async generator over a query's rows in lists of up to arraysize rows.
+
+    A pooled connection is held while the generator runs. Batches are
+    fetched ahead of the consumer, but at most prefetch of them wait in
+    memory; past that fetching pauses until the consumer catches up. When
+    the generator ends, is closed or its consumer is cancelled, the cursor
+    is closed and the connection goes back to the pool. If the consumer may
+    stop early or be cancelled between batches, iterate inside
+    contextlib.aclosing() so that happens right away instead of when the
+    generator is finalized.
+    """
+    pool = pool or get_pool(db_path)
+    async with pool.connection() as conn:
+        cursor = await conn.execute(query, params)
+        queue = asyncio.Queue(prefetch)
+        producer = asyncio.create_task(_prefetch(conn, cursor, queue, arraysize,
+                                                 pool.query_timeout, asyncio.current_task()))
+        try:
+            while True:
+                batch = await queue.get()
+                if isinstance(batch, Exception):
+                    raise batch
+                if not batch:
+                    return
+                yield batch
+        finally:
+            producer.cancel()
+            # wait() rather than await, so the producer's cancellation is not raised here.
+            await asyncio.wait([producer])
+            await cursor.close()
+
+
+async def iter_rows(db_path, query, params=(), arraysize=500, prefetch=2, pool=None):
+    """Async generator over a query's rows, one at a time; see iter_batches()."""
+    async with aclosing(iter_batches(db_path, query, params, arraysize, prefetch, pool)) as batches:
+        async for batch in batches:
+            for row in batch:
+                yield row
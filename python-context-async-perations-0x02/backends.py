@@ -0,0 +1,108 @@
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from async_pool import AsyncConnectionPool
+
+#### interchangeable ways of running SQLite queries from asyncio, behind one API
+
+
+class AiosqliteBackend:
+    """Queries on a bounded pool of aiosqlite connections (one thread each)."""
+
+    name = 'aiosqlite'
+
+    def __init__(self, db_path, workers=5):
+        self.pool = AsyncConnectionPool(db_path, max_size=workers)
+
+    async def fetchall(self, query, params=()):
+        async with self.pool.connection() as conn:
+            async with conn.execute(query, params) as cursor:
+                return await cursor.fetchall()
+
+    async def close(self):
+        await self.pool.close()
+
+
+_thread_local = threading.local()
+
+
+def _thread_fetchall(db_path, query, params):
+    conn = getattr(_thread_local, 'conn', None)
+    if conn is None:
+        conn = _thread_local.conn = sqlite3.connect(db_path)
+    return conn.execute(query, params).fetchall()
+
+
+class ThreadPoolBackend:
+    """
+    Queries on a shared ThreadPoolExecutor whose threads each keep their own
+    sqlite3 connection. SQLite releases the GIL while it works, so threads
+    overlap for I/O and for the C part of a query.
+    """
+
+    name = 'threads'
+
+    def __init__(self, db_path, workers=5):
+        self.db_path = db_path
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='sqlite')
+
+    async def fetchall(self, query, params=()):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, _thread_fetchall, self.db_path, query, tuple(params))
+
+    async def close(self):
+        self.executor.shutdown(wait=True)
+
+
+_process_conn = None
+
+
+def _process_init(db_path):
+    global _process_conn
+    _process_conn = sqlite3.connect(db_path)
+
+
+def _process_fetchall(query, params):
+    return _process_conn.execute(query, params).fetchall()
+
+
+class ProcessPoolBackend:
+    """
+    Queries on a ProcessPoolExecutor, one connection per worker process.
+    Each call pays for pickling the query and its rows across processes,
+    but CPU-heavy queries (and the Python work of building their rows) run
+    truly in parallel, free of this process's GIL.
+    """
+
+    name = 'processes'
+
+    def __init__(self, db_path, workers=5):
+        self.executor = ProcessPoolExecutor(workers, initializer=_process_init,
+                                            initargs=(db_path,))
+
+    async def fetchall(self, query, params=()):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, _process_fetchall, query, tuple(params))
+
+    async def close(self):
+        self.executor.shutdown(wait=True)
+
+
+BACKENDS = {cls.name: cls for cls in (AiosqliteBackend, ThreadPoolBackend, ProcessPoolBackend)}
+
+
+def open_backend(name, db_path, workers=5):
+    """
+    Create the back end called name ('aiosqlite', 'threads' or 'processes').
+    All of them offer `await backend.fetchall(query, params)` and
+    `await backend.close()`, so callers can switch by configuration; see
+    bench_backends.py for how they compare on a given workload.
+    """
+    try:
+        cls = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"unknown back end {name!r}; choose from {', '.join(BACKENDS)}") from None
+    return cls(db_path, workers)
@@ -0,0 +1,65 @@
+import sys
+import time
+import asyncio
+import threading
+
+import aiosqlite
+
+from async_pool import AsyncConnectionPool, gather_bounded
+
+#### benchmark: N concurrent queries with a connection each vs through a bounded pool
+#### usage: python bench_async_pool.py [db_path] [pool size]
+
+QUERY = "SELECT * FROM users WHERE id = ?"
+
+
+async def sample_threads(peak, stop):
+    while not stop.is_set():
+        peak[0] = max(peak[0], threading.active_count())
+        await asyncio.sleep(0.001)
+
+
+async def measure(run):
+    peak, stop = [threading.active_count()], asyncio.Event()
+    sampler = asyncio.create_task(sample_threads(peak, stop))
+    start = time.perf_counter()
+    await run()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await sampler
+    return elapsed, peak[0]
+
+
+async def unpooled(db_path, n):
+    async def one(user_id):
+        async with aiosqlite.connect(db_path) as db:
+            async with db.execute(QUERY, (user_id,)) as cursor:
+                return await cursor.fetchall()
+    await asyncio.gather(*(one(i + 1) for i in range(n)))
+
+
+async def pooled(db_path, n, size):
+    pool = AsyncConnectionPool(db_path, max_size=size)
+
+    async def one(user_id):
+        async with pool.connection() as db:
+            async with db.execute(QUERY, (user_id,)) as cursor:
+                return await cursor.fetchall()
+    try:
+        await gather_bounded((one(i + 1) for i in range(n)), limit=size)
+    finally:
+        await pool.close()
+
+
+async def main(db_path, size):
+    for n in (10, 100, 1000):
+        for label, run in (("connect each", lambda: unpooled(db_path, n)),
+                           (f"pool of {size}", lambda: pooled(db_path, n, size))):
+            elapsed, threads = await measure(run)
+            print(f"n={n:5} {label:13} {n / elapsed:9.0f} queries/s  peak threads {threads}")
+
+
+if __name__ == "__main__":
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'my_database.db'
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    asyncio.run(main(db_path, size))
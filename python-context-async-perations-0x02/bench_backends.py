@@ -0,0 +1,69 @@
+import sys
+import time
+import random
+import asyncio
+
+from async_pool import gather_bounded
+from backends import BACKENDS, open_backend
+
+#### benchmark: throughput and p99 latency of each query back end by query mix and concurrency
+#### usage: python bench_backends.py [db_path] [queries per run] [workers]
+
+POINT = ("SELECT * FROM users WHERE id = ?", lambda rng: (rng.randint(1, 1000),))
+SCAN = ("SELECT age, COUNT(*), AVG(LENGTH(email)) FROM users WHERE name LIKE ? GROUP BY age",
+        lambda rng: (f"%{rng.randint(0, 9)}%",))
+MIXES = {
+    'point': [(POINT, 1.0)],
+    'scan': [(SCAN, 1.0)],
+    'mixed': [(POINT, 0.9), (SCAN, 0.1)],
+}
+CONCURRENCY = (1, 10, 100)
+
+
+def workload(mix, n, seed=1):
+    rng = random.Random(seed)
+    kinds, weights = zip(*MIXES[mix])
+    return [(query, make_params(rng))
+            for query, make_params in rng.choices(kinds, weights, k=n)]
+
+
+async def run(backend, queries, concurrency):
+    latencies = []
+
+    async def one(query, params):
+        start = time.perf_counter()
+        await backend.fetchall(query, params)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await gather_bounded((lambda q=q, p=p: one(q, p) for q, p in queries), limit=concurrency)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return len(queries) / elapsed, latencies[max(0, int(len(latencies) * 0.99) - 1)]
+
+
+async def main(db_path, n, workers):
+    print(f"{n} queries per run, {workers} workers per back end")
+    print(f"{'mix':6} {'concurrency':>11} " + " ".join(f"{name:>24}" for name in BACKENDS))
+    backends = [open_backend(name, db_path, workers) for name in BACKENDS]
+    try:
+        for backend in backends:
+            await backend.fetchall("SELECT 1")  # start workers before timing
+        for mix in MIXES:
+            queries = workload(mix, n)
+            for concurrency in CONCURRENCY:
+                cells = []
+                for backend in backends:
+                    qps, p99 = await run(backend, queries, concurrency)
+                    cells.append(f"{qps:8.0f} q/s p99 {p99 * 1000:7.2f}ms")
+                print(f"{mix:6} {concurrency:>11} " + " ".join(f"{c:>24}" for c in cells))
+    finally:
+        for backend in backends:
+            await backend.close()
+
+
+if __name__ == "__main__":
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'my_database.db'
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    asyncio.run(main(db_path, n, workers))
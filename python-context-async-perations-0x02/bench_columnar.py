@@ -0,0 +1,69 @@
+import sys
+import time
+import sqlite3
+import importlib
+import tracemalloc
+
+from columnar import numpy
+
+ExecuteQuery = importlib.import_module('1-execute').ExecuteQuery
+
+#### benchmark: memory and aggregation time of row tuples vs columnar results
+#### usage: python bench_columnar.py [rows]
+
+DB_PATH = 'bench_columnar.db'
+QUERY = "SELECT id, age, score, name FROM people"
+
+
+def build(rows):
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute("DROP TABLE IF EXISTS people")
+    conn.execute("CREATE TABLE people (id INTEGER PRIMARY KEY, age INTEGER, score REAL, name TEXT)")
+    conn.executemany("INSERT INTO people (age, score, name) VALUES (?, ?, ?)",
+                     ((18 + i % 70, (i % 1000) / 10, f"user{i}") for i in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+def measure(label, columnar, aggregate):
+    start = time.perf_counter()
+    with ExecuteQuery(DB_PATH, QUERY, columnar=columnar) as result:
+        fetched = time.perf_counter() - start
+        start = time.perf_counter()
+        value = aggregate(result)
+        aggregated = time.perf_counter() - start
+    del result
+    # Memory is measured in a second, traced run so tracing does not skew the timings;
+    # ExecuteQuery keeps its result alive until the block ends.
+    tracemalloc.start()
+    with ExecuteQuery(DB_PATH, QUERY, columnar=columnar):
+        held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:12} fetch {fetched * 1000:7.1f}ms  held {held / 2**20:6.1f}MiB  "
+          f"peak {peak / 2**20:6.1f}MiB  mean(age)+mean(score) {aggregated * 1000:7.2f}ms"
+          f"  ({value:.3f})")
+
+
+def rows_mean(rows):
+    return sum(r[1] for r in rows) / len(rows) + sum(r[2] for r in rows) / len(rows)
+
+
+def columns_mean(columns):
+    age, score = columns['age'], columns['score']
+    return sum(age) / len(age) + sum(score) / len(score)
+
+
+def numpy_mean(columns):
+    return float(columns['age'].mean() + columns['score'].mean())
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    build(rows)
+    print(f"{rows} rows, 4 columns")
+    measure("row tuples", False, rows_mean)
+    measure("array.array", 'array', columns_mean)
+    if numpy is None:
+        print("numpy         not installed")
+    else:
+        measure("numpy", 'numpy', numpy_mean)
@@ -0,0 +1,152 @@
+import math
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#### column-oriented query results: one packed array per numeric column instead of a tuple per row
+
+_NUMPY_TYPES = {'q': 'int64', 'd': 'float64'}
+
+
+class Columns(dict):
+    """
+    Column name -> values, as returned by fetch_columns().
+
+    nulls maps every numeric column that held NULLs to its null mask, one
+    entry per row that is true where the value was NULL: a bytearray, or a
+    bool NumPy array sharing its memory when the columns are NumPy arrays
+    (so numpy.ma.masked_array(columns[name], columns.nulls[name]) works).
+    """
+
+    def __init__(self, columns=(), nulls=None):
+        super().__init__(columns)
+        self.nulls = nulls if nulls is not None else {}
+
+
+class _Column:
+    """
+    Values of one column, packed as tightly as they allow: array('q') while
+    they are all integers, array('d') once a float turns up, and a plain
+    list as soon as anything else (text, blobs) does.
+
+    NULLs do not turn a numeric column into a list: they are stored as 0
+    (NaN in float columns) and flagged in mask.
+    """
+
+    def __init__(self):
+        self.data = None
+        self.mask = None  # bytearray, 1 where the row is NULL; None until a NULL is seen
+        self.nulls = 0  # leading NULLs seen before the type was known
+
+    @staticmethod
+    def _start(values):
+        for value in values:
+            if value is None:
+                continue
+            if isinstance(value, int):
+                return array('q')
+            if isinstance(value, float):
+                return array('d')
+            return []
+        return None
+
+    @staticmethod
+    def _fill(values, fill):
+        return [fill if v is None else v for v in values]
+
+    def _null_rows(self):
+        return [i for i, flag in enumerate(self.mask) if flag] if self.mask is not None else []
+
+    def _flag(self, values, has_nulls):
+        # Called once values are in data, so the mask stays the same length.
+        if has_nulls:
+            if self.mask is None:
+                self.mask = bytearray(len(self.data) - len(values))
+            self.mask += bytes(v is None for v in values)
+        elif self.mask is not None:
+            self.mask += bytes(len(values))
+
+    def extend(self, values):
+        if self.data is None:
+            self.data = self._start(values)
+            if self.data is None:
+                self.nulls += len(values)
+                return
+            if self.nulls:
+                # Write the leading NULLs out as a batch of their own.
+                self.extend((None,) * self.nulls)
+        if isinstance(self.data, list):
+            self.data.extend(values)
+            return
+        has_nulls = None in values
+        size = len(self.data)
+        try:
+            if has_nulls:
+                self.data.extend(self._fill(values, 0 if self.data.typecode == 'q' else math.nan))
+            else:
+                self.data.extend(values)
+            self._flag(values, has_nulls)
+            return
+        except (TypeError, OverflowError):
+            del self.data[size:]
+        if self.data.typecode == 'q' and all(v is None or isinstance(v, (int, float)) for v in values):
+            widened = array('d', self.data)
+            try:
+                widened.extend(self._fill(values, math.nan))
+            except OverflowError:
+                pass
+            else:
+                for i in self._null_rows():
+                    widened[i] = math.nan
+                self.data = widened
+                self._flag(values, has_nulls)
+                return
+        data = self.data.tolist()
+        for i in self._null_rows():
+            data[i] = None
+        self.data, self.mask = data, None
+        self.data.extend(values)
+
+    def finish(self, use_numpy):
+        """Return (values, null mask or None)."""
+        if self.data is None:
+            return [None] * self.nulls, None
+        if use_numpy and isinstance(self.data, array):
+            return (numpy.frombuffer(self.data, dtype=_NUMPY_TYPES[self.data.typecode]),
+                    None if self.mask is None else numpy.frombuffer(self.mask, dtype=bool))
+        return self.data, self.mask
+
+
+def fetch_columns(cursor, arraysize=1000, use_numpy=None):
+    """
+    Fetch the rest of cursor's result arraysize rows at a time into a
+    Columns dict of column name -> values, so no row tuples outlive their
+    batch.
+
+    Numeric columns become array.array (int64 or float64), or NumPy arrays
+    sharing the same memory when use_numpy is true (the default when NumPy
+    is installed); other columns become lists. A numeric column with NULLs
+    stays an array: NULLs read as 0, or NaN in float columns, and are
+    flagged in the result's nulls masks.
+    """
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    elif use_numpy and numpy is None:
+        raise ImportError("use_numpy=True requires NumPy")
+    names = [d[0] for d in cursor.description or ()]
+    columns = [_Column() for _ in names]
+    while True:
+        rows = cursor.fetchmany(arraysize)
+        if not rows:
+            break
+        for column, values in zip(columns, zip(*rows)):
+            column.extend(values)
+    result = Columns()
+    for name, column in zip(names, columns):
+        result[name], mask = column.finish(use_numpy)
+        if mask is not None:
+            result.nulls[name] = mask
+    return result
@@ -0,0 +1,153 @@
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+#### shared SQLite connection pools for ExecuteQuery, one per database file, and statement deadlines
+
+# SQLite VM instructions between two checks of a StatementLimit.
+PROGRESS_STEPS = 1000
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be borrowed within the wait timeout."""
+
+
+class QueryTimeout(TimeoutError):
+    """A statement was interrupted because it ran past its deadline."""
+
+
+class QueryCancelled(Exception):
+    """A statement was interrupted because it was cancelled."""
+
+
+class StatementLimit:
+    """
+    Progress handler that stops a connection's statements once a deadline
+    passes (seconds=None: no deadline), once cancel() is called, or once
+    the given asyncio task is cancelled. SQLite calls it every
+    PROGRESS_STEPS instructions and aborts the running statement with an
+    "interrupted" OperationalError when it returns non-zero; translate()
+    turns that error into QueryTimeout or QueryCancelled.
+    """
+
+    def __init__(self, seconds=None, task=None):
+        self.deadline = time.monotonic() + seconds if seconds is not None else None
+        self.task = task
+        self.expired = False
+        self.cancelled = False
+
+    def __call__(self):
+        if self.cancelled:
+            return 1
+        if self.task is not None and self.task.cancelling():
+            self.cancelled = True
+            return 1
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.expired = True
+            return 1
+        return 0
+
+    def cancel(self):
+        self.cancelled = True
+
+    def translate(self, exc):
+        """The QueryTimeout / QueryCancelled exc stands for, or None."""
+        if not isinstance(exc, sqlite3.OperationalError) or 'interrupted' not in str(exc):
+            return None
+        if self.expired:
+            return QueryTimeout("statement exceeded its deadline")
+        if self.cancelled:
+            return QueryCancelled("statement cancelled")
+        return None
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of connections to one SQLite file.
+
+    Connections are opened lazily up to max_size and kept open between
+    uses, so their prepared statement caches survive from one query to the
+    next. release() rolls back anything left uncommitted.
+    """
+
+    def __init__(self, db_path, max_size=5, timeout=5.0):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = []
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        with self._cond:
+            if not self._cond.wait_for(
+                    lambda: self._closed or self._idle or self._size < self.max_size, timeout):
+                raise PoolTimeout(f"no connection to '{self.db_path}' available after {timeout}s")
+            if self._closed:
+                raise PoolTimeout("connection pool is closed")
+            if self._idle:
+                return self._idle.pop()
+            self._size += 1
+        try:
+            return sqlite3.connect(self.db_path, check_same_thread=False)
+        except BaseException:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            healthy = True
+        except sqlite3.Error:
+            healthy = False
+        with self._cond:
+            if self._closed or not healthy:
+                self._size -= 1
+                conn.close()
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            for conn in self._idle:
+                conn.close()
+            self._size -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path, max_size=5):
+    """Return the process-wide pool for db_path, creating it on first use."""
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = _pools[db_path] = ConnectionPool(db_path, max_size)
+        return pool
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
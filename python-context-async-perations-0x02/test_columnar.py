@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Unit tests for columnar.fetch_columns: packed numeric columns, how they
+widen, and how NULLs are kept out of the arrays
+"""
+import math
+import sqlite3
+import unittest
+from array import array
+
+import columnar
+from columnar import fetch_columns
+
+
+class ColumnarTestCase(unittest.TestCase):
+    """An in-memory table t with one untyped column x."""
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, x)")
+
+    def tearDown(self):
+        self.conn.close()
+
+    def fetch(self, values, arraysize=2, use_numpy=False):
+        """Store values in x and read them back as columns, arraysize rows at a time."""
+        self.conn.executemany("INSERT INTO t (x) VALUES (?)", [(v,) for v in values])
+        cursor = self.conn.execute("SELECT x FROM t ORDER BY id")
+        return fetch_columns(cursor, arraysize, use_numpy)
+
+    def assertMask(self, columns, expected):
+        self.assertEqual([bool(flag) for flag in columns.nulls['x']], expected)
+
+
+class TestPacking(ColumnarTestCase):
+    """Columns are packed as tightly as their values allow."""
+
+    def test_integers(self):
+        """All-integer columns are int64 arrays without a null mask."""
+        columns = self.fetch([1, 2, 3])
+        self.assertEqual(columns['x'], array('q', [1, 2, 3]))
+        self.assertEqual(columns.nulls, {})
+
+    def test_widening_to_float(self):
+        """A float in a later batch turns the int64 array into float64."""
+        columns = self.fetch([1, 2, 2.5])
+        self.assertEqual(columns['x'], array('d', [1.0, 2.0, 2.5]))
+
+    def test_text_makes_a_list(self):
+        """Anything that is not a number turns the column into a list."""
+        self.assertEqual(self.fetch([1, 2, 'three'])['x'], [1, 2, 'three'])
+
+
+class TestNulls(ColumnarTestCase):
+    """NULLs keep numeric columns packed and are flagged in nulls."""
+
+    def test_null_in_int_column(self):
+        """NULL reads as 0 in an int64 column and is flagged in the mask."""
+        columns = self.fetch([1, None, 3])
+        self.assertEqual(columns['x'], array('q', [1, 0, 3]))
+        self.assertMask(columns, [False, True, False])
+
+    def test_null_in_float_column(self):
+        """NULL reads as NaN in a float64 column."""
+        columns = self.fetch([1.5, None])
+        self.assertIsInstance(columns['x'], array)
+        self.assertTrue(math.isnan(columns['x'][1]))
+        self.assertMask(columns, [False, True])
+
+    def test_leading_nulls(self):
+        """NULLs before the first value, even whole batches of them, are kept in place."""
+        columns = self.fetch([None, None, None, 4, 5])
+        self.assertEqual(columns['x'], array('q', [0, 0, 0, 4, 5]))
+        self.assertMask(columns, [True, True, True, False, False])
+
+    def test_widening_turns_nulls_into_nan(self):
+        """NULLs stored as 0 become NaN when the column widens to float64."""
+        columns = self.fetch([1, None, 2.5, None])
+        values = columns['x']
+        self.assertEqual(values.typecode, 'd')
+        self.assertEqual([values[0], values[2]], [1.0, 2.5])
+        self.assertTrue(math.isnan(values[1]) and math.isnan(values[3]))
+        self.assertMask(columns, [False, True, False, True])
+
+    def test_text_fallback_restores_none(self):
+        """A column that falls back to a list has its NULLs back as None."""
+        columns = self.fetch([1, None, 'three', None])
+        self.assertEqual(columns['x'], [1, None, 'three', None])
+        self.assertNotIn('x', columns.nulls)
+
+    def test_all_nulls(self):
+        """A column of nothing but NULLs is a list of None."""
+        columns = self.fetch([None, None, None])
+        self.assertEqual(columns['x'], [None, None, None])
+        self.assertNotIn('x', columns.nulls)
+
+
+@unittest.skipIf(columnar.numpy is None, "NumPy is not installed")
+class TestNumpy(ColumnarTestCase):
+    """With NumPy, arrays and masks share the packed memory."""
+
+    def test_masked_array(self):
+        """The mask is a bool array usable with numpy.ma."""
+        numpy = columnar.numpy
+        columns = self.fetch([1, None, 3], use_numpy=True)
+        self.assertEqual(columns['x'].dtype, numpy.int64)
+        self.assertEqual(columns.nulls['x'].dtype, numpy.bool_)
+        self.assertEqual(numpy.ma.masked_array(columns['x'], columns.nulls['x']).mean(), 2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Unit tests for ExecuteQuery's timeout= and cancel(), on its own and on
+query_pool connections
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import importlib
+import unittest
+
+from query_pool import ConnectionPool, QueryCancelled, QueryTimeout, StatementLimit
+
+ExecuteQuery = importlib.import_module('1-execute').ExecuteQuery
+
+# Counts to ? one row at a time: about half a second per million on a laptop.
+COUNT_TO = ("WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < ?) "
+            "SELECT count(*) FROM c")
+RUNAWAY = 100000000
+
+
+class ExecuteTestCase(unittest.TestCase):
+    """A temporary database file per test."""
+
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.db_path)
+
+
+class TestTimeout(ExecuteTestCase):
+    """timeout= stops statements still running that long after __enter__."""
+
+    def test_runaway_query_raises_query_timeout(self):
+        """The statement is interrupted and QueryTimeout raised from its error."""
+        start = time.monotonic()
+        with self.assertRaises(QueryTimeout) as caught:
+            with ExecuteQuery(self.db_path, COUNT_TO, (RUNAWAY,), timeout=0.05):
+                pass
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertIsInstance(caught.exception.__cause__, sqlite3.OperationalError)
+
+    def test_fast_query_returns(self):
+        """A query that finishes in time returns its rows."""
+        with ExecuteQuery(self.db_path, COUNT_TO, (1000,), timeout=5) as rows:
+            self.assertEqual(rows, [(1000,)])
+
+    def test_streamed_fetches_share_the_deadline(self):
+        """With stream=True the deadline also stops a later fetch."""
+        with self.assertRaises(QueryTimeout):
+            with ExecuteQuery(self.db_path, "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL "
+                              "SELECT x + 1 FROM c) SELECT x FROM c", stream=True,
+                              timeout=0.05) as rows:
+                for _ in rows:
+                    pass
+
+    def test_pooled_connection_is_reusable_after_timeout(self):
+        """A timed-out query hands its connection back without its deadline."""
+        pool = ConnectionPool(self.db_path, max_size=1)
+        try:
+            with self.assertRaises(QueryTimeout):
+                with ExecuteQuery(self.db_path, COUNT_TO, (RUNAWAY,), pool=pool, timeout=0.05):
+                    pass
+            self.assertEqual(len(pool._idle), 1)
+            with ExecuteQuery(self.db_path, COUNT_TO, (200000,), pool=pool) as rows:
+                self.assertEqual(rows, [(200000,)])
+        finally:
+            pool.close()
+
+
+class TestCancel(ExecuteTestCase):
+    """cancel() interrupts the running statement, and only while the block runs."""
+
+    def test_cancel_from_another_thread(self):
+        """The statement stops with QueryCancelled."""
+        query = ExecuteQuery(self.db_path, COUNT_TO, (RUNAWAY,))
+        threading.Timer(0.05, query.cancel).start()
+        with self.assertRaises(QueryCancelled):
+            with query:
+                pass
+
+    def test_late_cancel_does_nothing(self):
+        """cancel() after the block cannot reach the connection's next user."""
+        pool = ConnectionPool(self.db_path, max_size=1)
+        try:
+            query = ExecuteQuery(self.db_path, COUNT_TO, (10,), pool=pool)
+            with query:
+                pass
+            conn = pool.acquire()
+            try:
+                timer = threading.Timer(0.02, query.cancel)
+                timer.start()
+                self.assertEqual(conn.execute(COUNT_TO, (200000,)).fetchone(), (200000,))
+                timer.join()
+            finally:
+                pool.release(conn)
+        finally:
+            pool.close()
+
+
+class TestStatementLimit(unittest.TestCase):
+    """query_pool.StatementLimit on its own."""
+
+    def test_translate(self):
+        """Interruptions become QueryTimeout or QueryCancelled; other errors None."""
+        interrupted = sqlite3.OperationalError("interrupted")
+        limit = StatementLimit(0)
+        self.assertEqual(limit(), 1)
+        self.assertIsInstance(limit.translate(interrupted), QueryTimeout)
+        limit = StatementLimit()
+        self.assertEqual(limit(), 0)
+        self.assertIsNone(limit.translate(interrupted))
+        limit.cancel()
+        self.assertEqual(limit(), 1)
+        self.assertIsInstance(limit.translate(interrupted), QueryCancelled)
+        self.assertIsNone(limit.translate(sqlite3.OperationalError("no such table: x")))
+
+
+if __name__ == '__main__':
+    unittest.main()
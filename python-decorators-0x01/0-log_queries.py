@@ -1,10 +1,29 @@
+import time
 import sqlite3
 import functools
-from datetime import datetime
+
+import db_metrics
+from db_explain import plans
+from db_logging import get_query_logger, row_count
 
 #### decorator to log SQL queries
 
-def log_queries(func):
+def log_queries(func=None, *, sample_rate=None, slow_threshold=None, explain=False):
+    """
+    Log each query with its duration and row count through the shared,
+    non-blocking query logger. sample_rate and slow_threshold override the
+    logger's defaults for this function; slow queries are always logged.
+    With explain=True every call is also counted in db_explain.plans, which
+    captures the plan of each new query shape and flags full table scans.
+    Usable bare (@log_queries) or with options (@log_queries(sample_rate=0.1)).
+    """
+    if func is None:
+        return functools.partial(log_queries, sample_rate=sample_rate,
+                                 slow_threshold=slow_threshold, explain=explain)
+    query_log = get_query_logger()
+    duration = db_metrics.query_seconds.labels(func.__qualname__)
+    errors = db_metrics.query_errors.labels(func.__qualname__)
+
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
         query = None
@@ -13,8 +32,24 @@ def log_queries(func):
             query = kwargs['query']
         elif len(args) > 0:
             query = args[0]
-        print(f"[{datetime.now()}] Executing SQL Query: {query}")
-        return func(*args, **kwargs)
+        params = kwargs.get('params', args[1] if len(args) > 1 else ())
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            elapsed = time.perf_counter() - start
+            duration.observe(elapsed)
+            errors.inc()
+            query_log.record(query, elapsed, error=e, params=params,
+                             sample_rate=sample_rate, slow_threshold=slow_threshold)
+            raise
+        elapsed = time.perf_counter() - start
+        duration.observe(elapsed)
+        query_log.record(query, elapsed, row_count(result), params=params,
+                         sample_rate=sample_rate, slow_threshold=slow_threshold)
+        if explain:
+            plans.observe(query, params, elapsed)
+        return result
     return wrapper
 
 @log_queries
@@ -1,15 +1,23 @@
-import sqlite3 
+import time
 import functools
 
+import db_pool
+import db_metrics
+
 def with_db_connection(func):
+    # Transactional functions get the writer when reads and writes are split
+    write = db_pool.is_write_operation(func)
+    held = db_metrics.connection_seconds.labels(func.__qualname__)
+
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        conn = sqlite3.connect('users.db')
-        try:
-            result = func(conn, *args, **kwargs)
-        finally:
-            conn.close()
-        return result
+        # Borrow a connection from the shared pool instead of opening one per call
+        with db_pool.connection(write=write) as conn:
+            start = time.perf_counter()
+            try:
+                return func(conn, *args, **kwargs)
+            finally:
+                held.observe(time.perf_counter() - start)
     return wrapper
 
 @with_db_connection 
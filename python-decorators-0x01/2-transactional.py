@@ -1,27 +1,59 @@
-import sqlite3 
+import time
 import functools
 
+import db_pool
+import db_metrics
+import db_writer
+
 def with_db_connection(func):
+    # Transactional functions get the writer when reads and writes are split
+    write = db_pool.is_write_operation(func)
+    held = db_metrics.connection_seconds.labels(func.__qualname__)
+
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        conn = sqlite3.connect('users.db')
-        try:
-            result = func(conn, *args, **kwargs)
-        finally:
-            conn.close()
-        return result
+        # Borrow a connection from the shared pool instead of opening one per call
+        with db_pool.connection(write=write) as conn:
+            start = time.perf_counter()
+            try:
+                return func(conn, *args, **kwargs)
+            finally:
+                held.observe(time.perf_counter() - start)
     return wrapper
 
 def transactional(func):
+    name = func.__qualname__
+    committed = db_metrics.transactions.labels(name, 'commit')
+    rolled_back = db_metrics.transactions.labels(name, 'rollback')
+    duration = db_metrics.transaction_seconds.labels(name)
+
     @functools.wraps(func)
     def wrapper(conn, *args, **kwargs):
+        # Commits/rolls back at the outermost level; nested calls use a savepoint
+        start = time.perf_counter()
         try:
-            result = func(conn, *args, **kwargs)
-            conn.commit()
-            return result
-        except Exception:
-            conn.rollback()
+            with db_pool.transaction(conn):
+                result = func(conn, *args, **kwargs)
+        except BaseException:
+            rolled_back.inc()
             raise
+        finally:
+            duration.observe(time.perf_counter() - start)
+        committed.inc()
+        return result
+    wrapper.db_write = True
+    return wrapper
+
+def group_commit(func):
+    """
+    Write mode for transactional functions: instead of opening a connection
+    and committing per call, queue func(conn, ...) on the shared writer
+    thread, which commits many calls in one transaction. Returns a Future
+    that resolves to func's result once its batch has committed.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return db_writer.get_writer().submit(func, *args, **kwargs)
     return wrapper
 
 @with_db_connection 
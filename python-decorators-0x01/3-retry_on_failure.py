@@ -1,31 +1,48 @@
 import time
-import sqlite3 
 import functools
 
+import db_pool
+import db_metrics
+from db_retry import RetryStats, call_with_retry, is_retryable
+
 def with_db_connection(func):
+    # Transactional functions get the writer when reads and writes are split
+    write = db_pool.is_write_operation(func)
+    held = db_metrics.connection_seconds.labels(func.__qualname__)
+
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        conn = sqlite3.connect('users.db')
-        try:
-            result = func(conn, *args, **kwargs)
-        finally:
-            conn.close()
-        return result
+        # Borrow a connection from the shared pool instead of opening one per call
+        with db_pool.connection(write=write) as conn:
+            start = time.perf_counter()
+            try:
+                return func(conn, *args, **kwargs)
+            finally:
+                held.observe(time.perf_counter() - start)
     return wrapper
 
-def retry_on_failure(retries=3, delay=2):
+def retry_on_failure(retries=3, delay=2, max_delay=30, deadline=None, retry_if=is_retryable):
+    """
+    Retry the decorated call up to `retries` attempts in total.
+
+    Only errors accepted by retry_if (lock contention by default) are
+    retried; anything else is raised at once. The sleep before retry n is
+    drawn uniformly from [0, min(max_delay, delay * 2**n)] so that competing
+    workers spread out instead of retrying in lockstep. If deadline is set,
+    no retry is started that would sleep past `deadline` seconds after the
+    first attempt. Counters are available as wrapper.retry_stats.snapshot().
+    """
+    if retries < 1:
+        raise ValueError("retries must be at least 1")
+
     def decorator(func):
+        stats = RetryStats(func.__qualname__)
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            last_exception = None
-            for attempt in range(retries):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    last_exception = e
-                    if attempt < retries - 1:
-                        time.sleep(delay)
-            raise last_exception
+            return call_with_retry(func, args, kwargs, retries, delay, max_delay,
+                                   deadline, retry_if, stats)
+        wrapper.retry_stats = stats
         return wrapper
     return decorator
 
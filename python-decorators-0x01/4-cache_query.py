@@ -1,21 +1,34 @@
 import time
-import sqlite3 
 import functools
 
-query_cache = {}
+import db_pool
+import db_metrics
+from db_cache import default_cache
+
+#### bounded LRU cache; entries expire after ttl seconds and writes to a table drop its entries
+query_cache = default_cache
 
 def with_db_connection(func):
+    # Transactional functions get the writer when reads and writes are split
+    write = db_pool.is_write_operation(func)
+    held = db_metrics.connection_seconds.labels(func.__qualname__)
+
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        conn = sqlite3.connect('users.db')
-        try:
-            result = func(conn, *args, **kwargs)
-        finally:
-            conn.close()
-        return result
+        # Borrow a connection from the shared pool instead of opening one per call
+        with db_pool.connection(write=write) as conn:
+            start = time.perf_counter()
+            try:
+                return func(conn, *args, **kwargs)
+            finally:
+                held.observe(time.perf_counter() - start)
     return wrapper
 
 def cache_query(func):
+    hits = db_metrics.cache_requests.labels(func.__qualname__, 'hit')
+    misses = db_metrics.cache_requests.labels(func.__qualname__, 'miss')
+    name = func.__qualname__
+
     @functools.wraps(func)
     def wrapper(conn, *args, **kwargs):
         # Try to get query from keyword or positional arguments
@@ -24,10 +37,18 @@ def cache_query(func):
             # assume query is the next arg after conn
             if len(args) > 0:
                 query = args[0]
-        if query in query_cache:
-            return query_cache[query]
-        result = func(conn, *args, **kwargs)
-        query_cache[query] = result
+        # Bound parameters are part of the key: positional after the query, or params=
+        params = kwargs.get('params', args[1] if len(args) > 1 else ())
+        loaded = False
+
+        def load():
+            nonlocal loaded
+            loaded = True
+            return func(conn, *args, **kwargs)
+        # Keyed by function too: the same SQL may be post-processed differently
+        result = query_cache.get_or_load(query, (name, params), load)
+        # Callers that shared another caller's load count as hits
+        (misses if loaded else hits).inc()
         return result
     return wrapper
 
@@ -0,0 +1,70 @@
+import sys
+import json
+import random
+import itertools
+
+from db_cache import QueryCache
+
+#### simulation: LRU vs GDSF eviction on a query log, compared by hit ratio and query time saved
+#### usage: python bench_cache_policy.py [query log (JSON lines from db_logging)] [maxsize]
+#### without a log a synthetic mix of cheap point lookups and expensive aggregates is replayed
+
+
+def synthetic_workload(n=50000, seed=7):
+    """Zipf-ish popularity over 5000 cheap lookups (0.05ms, 1 row) and 200 aggregates (20ms, 50 rows)."""
+    rng = random.Random(seed)
+    lookups = [(("SELECT * FROM users WHERE id = ?", (i,)), 0.00005, 1) for i in range(5000)]
+    aggregates = [(("SELECT age, COUNT(*) FROM users WHERE age > ? GROUP BY age", (i,)), 0.02, 50)
+                  for i in range(200)]
+    cum_lookup = list(itertools.accumulate(1 / (r + 1) for r in range(len(lookups))))
+    cum_aggregate = list(itertools.accumulate(1 / (r + 1) for r in range(len(aggregates))))
+    events = []
+    for _ in range(n):
+        if rng.random() < 0.9:
+            events.append(rng.choices(lookups, cum_weights=cum_lookup)[0])
+        else:
+            events.append(rng.choices(aggregates, cum_weights=cum_aggregate)[0])
+    return events
+
+
+def load_log(path):
+    """
+    Replay a db_logging query log: one event per logged query, cost =
+    elapsed_ms, keyed by the query and the hash of its parameters.
+    """
+    events = []
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get('error') or not record.get('query'):
+                continue
+            params = (record['params_hash'],) if 'params_hash' in record else ()
+            events.append(((record['query'], params), record['elapsed_ms'] / 1000.0,
+                           record.get('rows') or 1))
+    return events
+
+
+def replay(events, policy, maxsize):
+    cache = QueryCache(maxsize=maxsize, ttl=None, policy=policy)
+    hits = 0
+    saved = total = 0.0
+    for (query, params), cost, rows in events:
+        key = cache.make_key(query, params)
+        total += cost
+        hit, _ = cache.get(key)
+        if hit:
+            hits += 1
+            saved += cost
+        else:
+            cache.put(key, [(0, 'x' * 16)] * rows, (), cost=cost)
+    return hits / max(len(events), 1), saved, total
+
+
+if __name__ == "__main__":
+    events = load_log(sys.argv[1]) if len(sys.argv) > 1 else synthetic_workload()
+    maxsize = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    print(f"{len(events)} queries, maxsize={maxsize}")
+    for policy in ('lru', 'gdsf'):
+        ratio, saved, total = replay(events, policy, maxsize)
+        print(f"{policy:5} hit ratio {ratio:6.1%}   query time saved {saved:8.2f}s of {total:8.2f}s"
+              f" ({saved / max(total, 1e-9):6.1%})")
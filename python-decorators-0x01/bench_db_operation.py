@@ -0,0 +1,80 @@
+import os
+import sys
+import time
+import contextlib
+import importlib.util
+
+import db_pool
+import db_logging
+from db_operation import db_operation
+
+#### microbenchmark: per-layer overhead of the stacked decorators vs the fused db_operation
+#### usage: python bench_db_operation.py [calls]   (run next to a populated users.db)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+QUERY, PARAMS = "SELECT * FROM users WHERE id = ?", (1,)
+
+
+def load(name):
+    # The task scripts run a demo query on import; keep its output out of the report.
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), os.path.join(HERE, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        spec.loader.exec_module(module)
+    return module
+
+
+def per_call_us(fn, calls, rounds=5):
+    """Best of rounds, so scheduler noise does not show up as overhead."""
+    fn(QUERY, PARAMS)
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn(QUERY, PARAMS)
+        best = min(best, time.perf_counter() - start)
+    return best / calls * 1e6
+
+
+def noop(conn, query, params=()):
+    # Runs no SQL, so only the wrappers around it are timed.
+    return ()
+
+
+if __name__ == "__main__":
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    logs = load('0-log_queries')
+    conns = load('1-with_db_connection')
+    txs = load('2-transactional')
+    retries = load('3-retry_on_failure')
+    caches = load('4-cache_query')
+    db_logging.configure(stream=open(os.devnull, 'w'))
+    # In-memory connections: checkouts cost what the pool costs, never disk I/O.
+    db_pool.configure(database=':memory:')
+    retry = retries.retry_on_failure(retries=3, delay=0.01)
+
+    # Each row adds one layer to the one above; the transaction row includes
+    # the BEGIN/COMMIT both variants send to the in-memory database.
+    layers = [
+        ('connection', conns.with_db_connection(noop),
+         db_operation(noop)),
+        ('+ retry', conns.with_db_connection(retry(noop)),
+         db_operation(noop, retries=3, delay=0.01)),
+        ('+ log', logs.log_queries(conns.with_db_connection(retry(noop))),
+         db_operation(noop, retries=3, delay=0.01, log=True)),
+        ('+ transaction', logs.log_queries(conns.with_db_connection(retry(txs.transactional(noop)))),
+         db_operation(noop, retries=3, delay=0.01, log=True, transactional=True)),
+        ('cached (hit)', logs.log_queries(conns.with_db_connection(retry(caches.cache_query(noop)))),
+         db_operation(noop, retries=3, delay=0.01, log=True, cache=True)),
+    ]
+    with db_pool.connection() as conn:
+        bare = per_call_us(lambda query, params: noop(conn, query, params), calls)
+    print(f"bare call {bare:.2f}us; overhead per call on top of it:")
+    for name, stacked, fused in layers:
+        before = per_call_us(stacked, calls) - bare
+        after = per_call_us(fused, calls) - bare
+        print(f"{name:14s} stacked {before:8.2f}us  fused {after:8.2f}us  "
+              f"saved {before - after:7.2f}us/call")
+    print("(a stacked cache hit still checks out a connection first; the fused one does not)")
+    db_logging.get_query_logger().flush()
+    db_pool.get_pool().close()
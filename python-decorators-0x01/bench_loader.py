@@ -0,0 +1,32 @@
+import sys
+import time
+
+import db_pool
+from db_loader import RowLoader
+
+#### benchmark: 200 get_user_by_id lookups one at a time vs batched through a RowLoader
+#### usage: python bench_loader.py [users.db] [ids]
+
+
+def get_user_by_id(user_id):
+    with db_pool.connection() as conn:
+        return conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+
+
+def timed(fn, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+if __name__ == "__main__":
+    database = sys.argv[1] if len(sys.argv) > 1 else 'users.db'
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    db_pool.configure(database=database)
+    ids = list(range(1, n + 1))
+    single = timed(lambda: [get_user_by_id(i) for i in ids])
+    batched = timed(lambda: RowLoader('users').load_many(ids))
+    print(f"{n} lookups")
+    print(f"one query each  {single * 1000:8.2f}ms")
+    print(f"RowLoader       {batched * 1000:8.2f}ms")
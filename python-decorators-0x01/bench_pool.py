@@ -0,0 +1,57 @@
+import sys
+import time
+import threading
+import statistics
+
+import db_pool
+
+#### benchmark: per-call latency of a get_user_by_id lookup with and without pooling
+#### usage: python bench_pool.py [users.db] [calls] [threads]
+
+
+def get_user_by_id(user_id, pooled):
+    with db_pool.connection(pooled=pooled) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+        return cursor.fetchone()
+
+
+def run(pooled, calls, threads):
+    latencies = []
+    lock = threading.Lock()
+
+    def worker():
+        local = []
+        for i in range(calls):
+            start = time.perf_counter()
+            get_user_by_id(i % 100 + 1, pooled)
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'mean_us': statistics.fmean(latencies) * 1e6,
+        'p99_us': latencies[int(len(latencies) * 0.99) - 1] * 1e6,
+        'calls_per_s': len(latencies) / elapsed,
+    }
+
+
+if __name__ == "__main__":
+    database = sys.argv[1] if len(sys.argv) > 1 else 'users.db'
+    calls = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    threads = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    db_pool.configure(database=database, max_size=threads)
+    for n in (1, threads):
+        for pooled in (False, True):
+            stats = run(pooled, calls, n)
+            label = "pooled  " if pooled else "unpooled"
+            print(f"{label} threads={n}: mean {stats['mean_us']:.1f}us  "
+                  f"p99 {stats['p99_us']:.1f}us  {stats['calls_per_s']:.0f} calls/s")
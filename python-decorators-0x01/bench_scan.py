@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+import sqlite3
+
+from db_scan import count, histogram, maximum, mean, minimum, parallel_scan, total
+
+#### benchmark: one-connection aggregate scan of users vs parallel_scan with 1, 2, 4... workers
+#### usage: python bench_scan.py [database] [rows]
+
+AGGREGATES = {
+    'n': count(),
+    'total_age': total('age'),
+    'min_age': minimum('age'),
+    'max_age': maximum('age'),
+    'mean_email': mean('LENGTH(email)'),
+    'ages': histogram('age', range(0, 101, 10)),
+}
+WHERE = "email LIKE '%@%'"
+
+
+def build(database, rows):
+    conn = sqlite3.connect(database)
+    conn.execute("CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, name TEXT, email TEXT, age INTEGER)")
+    missing = rows - conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    if missing > 0:
+        conn.executemany("INSERT INTO users (name, email, age) VALUES (?, ?, ?)",
+                         ((f"user{i}", f"user{i}@example.com", 18 + i % 70) for i in range(missing)))
+        conn.commit()
+    conn.close()
+
+
+def timed(fn, repeat=3):
+    fn()  # warm the page cache (and, for parallel_scan, the worker processes)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+if __name__ == "__main__":
+    database = sys.argv[1] if len(sys.argv) > 1 else 'bench_scan.db'
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 2_000_000
+    build(database, rows)
+    print(f"{rows} rows, {os.cpu_count()} CPUs")
+    serial, expected = timed(lambda: parallel_scan('users', AGGREGATES, WHERE,
+                                                   database=database, workers=1, partitions=1))
+    print(f"{'one connection':16} {serial * 1000:8.1f}ms")
+    workers = 2
+    while workers <= max(2, os.cpu_count() or 1):
+        elapsed, result = timed(lambda: parallel_scan('users', AGGREGATES, WHERE,
+                                                      database=database, workers=workers))
+        # Partial sums are added in a different order, so compare the mean loosely.
+        assert abs(result.pop('mean_email') - expected['mean_email']) < 1e-9
+        assert result == {k: v for k, v in expected.items() if k != 'mean_email'}
+        print(f"{f'{workers} workers':16} {elapsed * 1000:8.1f}ms  speedup {serial / elapsed:4.2f}x")
+        workers *= 2
@@ -0,0 +1,53 @@
+import os
+import sys
+import time
+
+import db_pool
+from db_cache import QueryCache
+from db_persist import PersistentStore
+
+#### benchmark: first pass over a query set with a cold cache vs after a restart with the on-disk store
+#### usage: python bench_warm_cache.py [users.db] [cache file]
+
+QUERIES = (
+    [("SELECT COUNT(*), AVG(age) FROM users WHERE age > ?", (age,)) for age in range(18, 90)]
+    + [("SELECT age, COUNT(*) FROM users WHERE email LIKE ? GROUP BY age", (f"%{d}@%",))
+       for d in range(10)]
+)
+
+
+def fetch(query, params):
+    with db_pool.connection() as conn:
+        return conn.execute(query, params).fetchall()
+
+
+def first_pass(store):
+    # A fresh QueryCache stands in for a freshly started process.
+    cache = QueryCache(maxsize=len(QUERIES), store=store)
+    start = time.perf_counter()
+    for query, params in QUERIES:
+        cache.get_or_load(query, params, lambda: fetch(query, params))
+    return time.perf_counter() - start, cache.stats()
+
+
+if __name__ == "__main__":
+    database = sys.argv[1] if len(sys.argv) > 1 else 'users.db'
+    path = sys.argv[2] if len(sys.argv) > 2 else 'query_cache.db'
+    db_pool.configure(database=database)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    no_store, _ = first_pass(None)
+    store = PersistentStore(path, database)
+    cold, _ = first_pass(store)
+    store.flush()
+    store.close()
+
+    store = PersistentStore(path, database)
+    warm, stats = first_pass(store)
+    store.close()
+    print(f"{len(QUERIES)} queries")
+    print(f"no store        {no_store * 1000:8.1f}ms")
+    print(f"cold start      {cold * 1000:8.1f}ms (populates {path})")
+    print(f"warm start      {warm * 1000:8.1f}ms ({stats['store_hits']} served from disk)")
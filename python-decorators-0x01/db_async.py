@@ -0,0 +1,296 @@
+import time
+import asyncio
+import weakref
+import functools
+import contextvars
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+import db_pool
+import db_cache
+import db_metrics
+from db_timeout import async_statement_timeout, install_progress_slot
+from db_logging import get_query_logger, row_count
+from db_retry import RetryStats, backoff_delay, is_retryable
+
+#### coroutine versions of the decorator family, for aiosqlite
+
+
+class AsyncConnectionPool:
+    """
+    Bounded pool of aiosqlite connections for one event loop.
+
+    At most max_size connections (and so at most max_size aiosqlite worker
+    threads) exist at once; callers beyond that wait up to timeout seconds
+    for one to be released. Each connection reports its writes to the query
+    caches the same way pooled sqlite3 connections do.
+    """
+
+    def __init__(self, database=None, max_size=5, timeout=5.0):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = []
+        self._size = 0
+        self._cond = asyncio.Condition()
+
+    async def _connect(self):
+        conn = await aiosqlite.connect(self.database or db_pool.get_pool().database)
+        db_metrics.connections_opened.inc()
+        await db_cache.track_writes_async(conn)
+        await install_progress_slot(conn)
+        return conn
+
+    async def acquire(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        async with self._cond:
+            if not self._idle and self._size >= self.max_size:
+                try:
+                    await asyncio.wait_for(
+                        self._cond.wait_for(lambda: self._idle or self._size < self.max_size),
+                        timeout)
+                except asyncio.TimeoutError:
+                    raise db_pool.PoolTimeout(
+                        f"no async connection available after {timeout}s "
+                        f"(max_size={self.max_size})") from None
+            if self._idle:
+                return self._idle.pop()
+            self._size += 1
+        try:
+            return await self._connect()
+        except BaseException:
+            async with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    async def release(self, conn):
+        try:
+            if conn.in_transaction:
+                await conn.rollback()
+        except Exception:
+            await self._discard(conn)
+            return
+        await conn.write_tracker.after_release_async(conn)
+        async with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    async def _discard(self, conn):
+        db_metrics.connections_closed.inc()
+        try:
+            await conn.close()
+        finally:
+            async with self._cond:
+                self._size -= 1
+                self._cond.notify()
+
+    @asynccontextmanager
+    async def connection(self, timeout=None):
+        conn = await self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            await self.release(conn)
+
+    async def close(self):
+        async with self._cond:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            await self._discard(conn)
+
+
+_pools = weakref.WeakKeyDictionary()  # event loop -> AsyncConnectionPool
+_current = contextvars.ContextVar('db_async_transaction', default=(None, 0))
+
+
+def get_pool():
+    """Return the async pool of the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = _pools[loop] = AsyncConnectionPool(max_size=db_pool.get_setting('max_size'))
+    return pool
+
+
+async def close_pool():
+    """
+    Close the running loop's pooled connections. Call it before the loop
+    ends: each aiosqlite connection owns a thread that keeps the process
+    alive until the connection is closed.
+    """
+    pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.close()
+
+
+@asynccontextmanager
+async def connection():
+    """Yield the open transaction's connection, or borrow one from the async pool."""
+    conn, _ = _current.get()
+    if conn is not None:
+        yield conn
+        return
+    # Always under a limit, so cancelling the task also stops its statement.
+    async with get_pool().connection() as conn:
+        async with async_statement_timeout(conn, db_pool.get_setting('query_timeout')):
+            yield conn
+
+
+@asynccontextmanager
+async def transaction(conn):
+    """Async counterpart of db_pool.transaction(): nested blocks become savepoints."""
+    current, depth = _current.get()
+    if depth and current is conn:
+        name = f"sp_{depth}"
+        await conn.execute(f"SAVEPOINT {name}")
+        token = _current.set((conn, depth + 1))
+        try:
+            yield conn
+        except BaseException:
+            await conn.execute(f"ROLLBACK TO {name}")
+            await conn.execute(f"RELEASE {name}")
+            raise
+        else:
+            await conn.execute(f"RELEASE {name}")
+        finally:
+            _current.reset(token)
+        return
+    if not conn.in_transaction:
+        await conn.execute("BEGIN")
+    token = _current.set((conn, 1))
+    try:
+        yield conn
+    except BaseException:
+        await conn.rollback()
+        raise
+    else:
+        await conn.commit()
+    finally:
+        _current.reset(token)
+
+
+def with_db_connection(func):
+    held = db_metrics.connection_seconds.labels(func.__qualname__)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        async with connection() as conn:
+            start = time.perf_counter()
+            try:
+                return await func(conn, *args, **kwargs)
+            finally:
+                held.observe(time.perf_counter() - start)
+    return wrapper
+
+
+def transactional(func):
+    name = func.__qualname__
+    committed = db_metrics.transactions.labels(name, 'commit')
+    rolled_back = db_metrics.transactions.labels(name, 'rollback')
+    duration = db_metrics.transaction_seconds.labels(name)
+
+    @functools.wraps(func)
+    async def wrapper(conn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            async with transaction(conn):
+                result = await func(conn, *args, **kwargs)
+        except BaseException:
+            rolled_back.inc()
+            raise
+        finally:
+            duration.observe(time.perf_counter() - start)
+        committed.inc()
+        return result
+    wrapper.db_write = True
+    return wrapper
+
+
+def retry_on_failure(retries=3, delay=2, max_delay=30, deadline=None, retry_if=is_retryable):
+    """Same policy as the sync retry_on_failure, sleeping with asyncio.sleep."""
+    if retries < 1:
+        raise ValueError("retries must be at least 1")
+
+    def decorator(func):
+        stats = RetryStats(func.__qualname__)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            stats.record_call()
+            give_up_at = time.monotonic() + deadline if deadline is not None else None
+            for attempt in range(retries):
+                try:
+                    return await func(*args, **kwargs)
+                except Exception as e:
+                    retryable = retry_if(e)
+                    if not retryable or attempt == retries - 1:
+                        stats.record_failure(retryable)
+                        raise
+                    wait = backoff_delay(attempt, delay, max_delay)
+                    if give_up_at is not None and time.monotonic() + wait > give_up_at:
+                        stats.record_failure(retryable, deadline_hit=True)
+                        raise
+                    stats.record_retry(wait)
+                    await asyncio.sleep(wait)
+        wrapper.retry_stats = stats
+        return wrapper
+    return decorator
+
+
+def cache_query(func=None, *, cache=None):
+    """Async cache_query: concurrent misses on one key share a single load."""
+    if func is None:
+        return functools.partial(cache_query, cache=cache)
+    query_cache = db_cache.default_cache if cache is None else cache
+    hits = db_metrics.cache_requests.labels(func.__qualname__, 'hit')
+    misses = db_metrics.cache_requests.labels(func.__qualname__, 'miss')
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    async def wrapper(conn, *args, **kwargs):
+        query = kwargs.get('query', args[0] if len(args) > 0 else None)
+        params = kwargs.get('params', args[1] if len(args) > 1 else ())
+        loaded = False
+
+        def load():
+            nonlocal loaded
+            loaded = True
+            return func(conn, *args, **kwargs)
+        # Keyed by function too, as in db_operation: the same SQL may be post-processed differently.
+        result = await query_cache.get_or_load_async(query, (name, params), load)
+        (misses if loaded else hits).inc()
+        return result
+    return wrapper
+
+
+def log_queries(func=None, *, sample_rate=None, slow_threshold=None):
+    """Async log_queries: records elapsed time and rows without blocking the loop."""
+    if func is None:
+        return functools.partial(log_queries, sample_rate=sample_rate,
+                                 slow_threshold=slow_threshold)
+    query_log = get_query_logger()
+    duration = db_metrics.query_seconds.labels(func.__qualname__)
+    errors = db_metrics.query_errors.labels(func.__qualname__)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        query = kwargs.get('query', args[0] if len(args) > 0 else None)
+        params = kwargs.get('params', args[1] if len(args) > 1 else ())
+        start = time.perf_counter()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            elapsed = time.perf_counter() - start
+            duration.observe(elapsed)
+            errors.inc()
+            query_log.record(query, elapsed, error=e, params=params,
+                             sample_rate=sample_rate, slow_threshold=slow_threshold)
+            raise
+        elapsed = time.perf_counter() - start
+        duration.observe(elapsed)
+        query_log.record(query, elapsed, row_count(result), params=params,
+                         sample_rate=sample_rate, slow_threshold=slow_threshold)
+        return result
+    return wrapper
@@ -0,0 +1,660 @@
+import re
+import sys
+import zlib
+import heapq
+import pickle
+import asyncio
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import db_pool
+
+#### bounded LRU + TTL cache for query results with write-aware invalidation
+
+ANY_TABLE = '*'
+
+_READ_TABLES = re.compile(r'\b(?:FROM|JOIN)\s+["`\[]?(\w+)', re.IGNORECASE)
+_WRITE_TABLE = re.compile(
+    r'^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?'
+    r'|DELETE\s+FROM|DROP\s+TABLE(?:\s+IF\s+EXISTS)?|ALTER\s+TABLE'
+    r'|CREATE\s+TABLE(?:\s+IF\s+NOT\s+EXISTS)?)\s+["`\[]?(\w+)',
+    re.IGNORECASE)
+_WRITE_VERB = re.compile(
+    r'^\s*(?:INSERT|UPDATE|DELETE|REPLACE|DROP|ALTER|CREATE|WITH)\b', re.IGNORECASE)
+
+
+@lru_cache(maxsize=1024)
+def read_tables(query):
+    """Tables a SELECT depends on; ANY_TABLE when they cannot be told apart."""
+    tables = frozenset(name.lower() for name in _READ_TABLES.findall(query or ''))
+    return tables or frozenset((ANY_TABLE,))
+
+
+@lru_cache(maxsize=1024)
+def written_tables(sql):
+    """Tables a statement writes to, ANY_TABLE if unknown, or None for reads."""
+    match = _WRITE_TABLE.match(sql)
+    if match:
+        return frozenset((match.group(1).lower(),))
+    if _WRITE_VERB.match(sql):
+        return frozenset((ANY_TABLE,))
+    return None
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class _Flight:
+    """A load in progress that concurrent callers of the same key wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+def estimate_size(value, sample=32):
+    """
+    Rough number of bytes value occupies, counting nested lists and tuples.
+    Long sequences are estimated from an even sample of their items.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)) and value:
+        count = len(value)
+        if count > sample:
+            step = count / sample
+            items = [value[int(i * step)] for i in range(sample)]
+            return size + sum(estimate_size(item, sample) for item in items) * count // sample
+        return size + sum(estimate_size(item, sample) for item in value)
+    if isinstance(value, dict):
+        return size + sum(estimate_size(k, sample) + estimate_size(v, sample)
+                          for k, v in value.items())
+    return size
+
+
+class _Packed:
+    """A cached value kept as compressed pickle bytes until it is read."""
+
+    __slots__ = ('blob',)
+
+    def __init__(self, value, level):
+        self.blob = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), level)
+
+    def unpack(self):
+        return pickle.loads(zlib.decompress(self.blob))
+
+
+def _retrieve(task):
+    # Every caller may have gone; do not report the load's error as never retrieved.
+    if not task.cancelled():
+        task.exception()
+
+
+def _unpack(value):
+    return value.unpack() if isinstance(value, _Packed) else value
+
+
+class _Entry:
+    __slots__ = ('value', 'expires_at', 'tables', 'size', 'cost', 'uses', 'priority')
+
+    def __init__(self, value, expires_at, tables, size, cost):
+        self.value = value
+        self.expires_at = expires_at
+        self.tables = tables
+        self.size = size
+        self.cost = cost
+        self.uses = 1
+        self.priority = 0.0
+
+
+class QueryCache:
+    """
+    Query result cache bounded by entry count and, optionally, by bytes.
+
+    Keys are made from the query text plus its bound parameters. Entries are
+    evicted least-recently-used first once maxsize is reached and expire ttl
+    seconds after they were stored. With max_bytes, the estimated size of
+    all stored results is kept under that budget too, evicting as many
+    least-recently-used entries as it takes to make room; a result larger
+    than the whole budget is not cached. Results estimated at
+    compress_threshold bytes or more are stored as zlib-compressed pickles
+    and decoded on each hit, trading some CPU for a much smaller footprint;
+    results that cannot be pickled are stored uncompressed instead.
+
+    With policy='gdsf' eviction is cost-aware instead (GreedyDual-Size-
+    Frequency): every entry has priority L + hits * cost / size, where cost
+    is how long its query took to run, and the lowest priority goes first;
+    L rises to each evicted priority so that entries which stop being used
+    age out. Expensive, small, frequently used results are kept longest.
+    Independently of the policy, results whose query ran faster than
+    min_cost seconds are not cached at all.
+
+    Every entry remembers the tables its query reads; invalidate() drops
+    the entries of the tables that were written. Commits made by other
+    processes are detected by polling ``PRAGMA data_version`` on a private
+    watch connection, at most once every version_check_interval seconds
+    (so they may go unseen for that long), which clears the whole cache
+    since the written tables are unknown. The watch sees commits made
+    through db_pool as well; those are told apart by the data_version of
+    the connection that committed, which does not move for its own
+    commits. When another connection may have committed in the meantime,
+    the whole cache is cleared too.
+
+    Concurrent misses on the same key are coalesced: only the first caller
+    runs the query, the others wait for its result or its exception.
+
+    With a store (see db_persist.PersistentStore) a memory miss is looked up
+    on disk before the query runs, and freshly loaded results are written
+    through to it, so a restarted process starts warm.
+    """
+
+    def __init__(self, maxsize=256, ttl=300.0, version_check_interval=1.0, store=None,
+                 max_bytes=None, compress_threshold=None, compress_level=1,
+                 policy='lru', min_cost=None):
+        if policy not in ('lru', 'gdsf'):
+            raise ValueError("policy must be 'lru' or 'gdsf'")
+        if maxsize is None and max_bytes is None:
+            raise ValueError("set maxsize, max_bytes or both")
+        if maxsize is not None and maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+        self.policy = policy
+        self.min_cost = min_cost
+        self.bytes = 0
+        self._heap = []  # (priority, seq, key), stale items skipped on pop
+        self._seq = 0
+        self._inflation = 0.0
+        self.store = store
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+        self._entries = OrderedDict()  # key -> _Entry, least recently used first
+        self._by_table = {}  # table -> set of keys
+        self._generations = {}  # table -> int, bumped on every write
+        self._epoch = 0  # bumped whenever the whole cache is cleared
+        self._lock = threading.RLock()
+        self._watch = None
+        self._watch_database = None
+        self._data_version = None
+        self._data_version_at = 0.0
+        self._next_version_check = 0.0
+        self._inflight = {}  # key -> _Flight
+        self._async_inflight = {}  # key -> asyncio.Task
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.store_hits = 0
+        self.rejected = 0
+
+    @staticmethod
+    def make_key(query, params=()):
+        return (query, _freeze(params))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key)[0]
+
+    def get(self, key):
+        """Return (hit, value) for key, dropping it first if it has expired."""
+        self.check_data_version()
+        with self._lock:
+            hit, value = self._lookup(key)
+        return hit, _unpack(value)
+
+    def _lookup(self, key):
+        # Packed values are returned as is; callers unpack them outside the lock.
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        if entry.expires_at is not None and entry.expires_at <= time.monotonic():
+            self._remove(key)
+            return False, None
+        if self.policy == 'gdsf':
+            entry.uses += 1
+            self._prioritise(key, entry)
+        else:
+            self._entries.move_to_end(key)
+        return True, entry.value
+
+    def _prioritise(self, key, entry):
+        entry.priority = self._inflation + entry.uses * entry.cost / max(entry.size, 1)
+        self._seq += 1
+        heapq.heappush(self._heap, (entry.priority, self._seq, key))
+        if len(self._heap) > 4 * len(self._entries) + 64:
+            # Too many stale items: rebuild from the live entries.
+            self._heap = [(e.priority, i, k) for i, (k, e) in enumerate(self._entries.items())]
+            heapq.heapify(self._heap)
+
+    def _evict_one(self):
+        if self.policy == 'lru':
+            self._remove(next(iter(self._entries)))
+            return
+        while self._heap:
+            priority, _, key = heapq.heappop(self._heap)
+            entry = self._entries.get(key)
+            if entry is not None and entry.priority == priority:
+                self._inflation = priority
+                self._remove(key)
+                return
+        self._remove(next(iter(self._entries)))
+
+    def snapshot(self, tables):
+        """Table generations to hand back to put() once the query has run."""
+        with self._lock:
+            return self._epoch, tuple(self._generations.get(t, 0) for t in sorted(tables))
+
+    def put(self, key, value, tables, snapshot=None, cost=None):
+        """
+        Store value for key; cost is the time its query took, in seconds,
+        or None if unknown (e.g. a result read back from the store).
+
+        If snapshot is given and any of the tables was written since it was
+        taken, the value may already be stale and is not stored.
+        """
+        if cost is None:
+            cost = self.min_cost or 0.0
+        elif self.min_cost is not None and cost < self.min_cost:
+            with self._lock:
+                self.rejected += 1
+            return False
+        size = 0
+        if (self.max_bytes is not None or self.compress_threshold is not None
+                or self.policy == 'gdsf'):
+            size = estimate_size(value)
+            if self.compress_threshold is not None and size >= self.compress_threshold:
+                try:
+                    packed = _Packed(value, self.compress_level)
+                except (pickle.PicklingError, TypeError, AttributeError, RecursionError):
+                    # Not picklable (e.g. sqlite3.Row results): keep it uncompressed.
+                    pass
+                else:
+                    value, size = packed, sys.getsizeof(packed.blob)
+            if self.max_bytes is not None and size > self.max_bytes:
+                with self._lock:
+                    self.rejected += 1
+                return False
+        with self._lock:
+            if snapshot is not None and snapshot != self.snapshot(tables):
+                return False
+            if key in self._entries:
+                self._remove(key)
+            expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+            entry = self._entries[key] = _Entry(value, expires_at, tables, size, cost)
+            self.bytes += size
+            if self.policy == 'gdsf':
+                self._prioritise(key, entry)
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+            while ((self.maxsize is not None and len(self._entries) > self.maxsize)
+                   or (self.max_bytes is not None and self.bytes > self.max_bytes)):
+                self._evict_one()
+            return key in self._entries
+
+    def get_or_load(self, query, params, loader):
+        """
+        Return the cached result of query/params, calling loader() on a miss.
+
+        If another thread is already loading the same key, wait for it and
+        share its result (or re-raise its exception) instead of loading again.
+        """
+        key = self.make_key(query, params)
+        self.check_data_version()
+        with self._lock:
+            # Look up under the lock so a flight that just finished is seen as a hit.
+            hit, value = self._lookup(key)
+            if hit:
+                self.hits += 1
+            else:
+                flight = self._inflight.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._inflight[key] = _Flight()
+                    self.misses += 1
+                else:
+                    self.coalesced += 1
+        if hit:
+            return _unpack(value)
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            tables = read_tables(query)
+            snapshot = self.snapshot(tables)
+            found, flight.value, fingerprint = self._load_stored(key)
+            cost = None
+            if not found:
+                start = time.perf_counter()
+                flight.value = loader()
+                cost = time.perf_counter() - start
+                self._store(key, flight.value, fingerprint)
+            self.put(key, flight.value, tables, snapshot, cost)
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.done.set()
+
+    async def get_or_load_async(self, query, params, loader):
+        """
+        Coroutine version of get_or_load(): loader is an async callable, and
+        concurrent tasks missing the same key await the first task's load.
+
+        The load runs in a task of its own that every caller awaits through
+        asyncio.shield(), so cancelling any caller, the first one included,
+        leaves the load and the other callers alone.
+        """
+        key = self.make_key(query, params)
+        self.check_data_version()
+        with self._lock:
+            hit, value = self._lookup(key)
+            if hit:
+                self.hits += 1
+            else:
+                flight = self._async_inflight.get(key)
+                if flight is None:
+                    flight = asyncio.get_running_loop().create_task(self._load_async(key, query, loader))
+                    flight.add_done_callback(_retrieve)
+                    self._async_inflight[key] = flight
+                    self.misses += 1
+                else:
+                    self.coalesced += 1
+        if hit:
+            return _unpack(value)
+        return await asyncio.shield(flight)
+
+    async def _load_async(self, key, query, loader):
+        try:
+            tables = read_tables(query)
+            snapshot = self.snapshot(tables)
+            found, value, fingerprint = self._load_stored(key)
+            cost = None
+            if not found:
+                start = time.perf_counter()
+                value = await loader()
+                cost = time.perf_counter() - start
+                self._store(key, value, fingerprint)
+            self.put(key, value, tables, snapshot, cost)
+            return value
+        finally:
+            with self._lock:
+                del self._async_inflight[key]
+
+    def _load_stored(self, key):
+        # Second level: a persistent store, consulted only on a memory miss.
+        if self.store is None:
+            return False, None, None
+        found, value, fingerprint = self.store.get(key)
+        if found:
+            with self._lock:
+                self.store_hits += 1
+        return found, value, fingerprint
+
+    def _store(self, key, value, fingerprint):
+        if self.store is not None:
+            self.store.put(key, value, fingerprint)
+
+    def stats(self):
+        """Hit, miss and coalesced counters plus the current number of entries."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'store_hits': self.store_hits,
+                'rejected': self.rejected,
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+        for table in entry.tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+    def invalidate(self, tables):
+        """Drop every entry that reads one of tables (ANY_TABLE drops all)."""
+        with self._lock:
+            if ANY_TABLE in tables:
+                self._clear()
+                return
+            for table in tables | {ANY_TABLE}:
+                self._generations[table] = self._generations.get(table, 0) + 1
+                for key in list(self._by_table.get(table, ())):
+                    self._remove(key)
+
+    def _clear(self):
+        self._epoch += 1
+        self._entries.clear()
+        self._by_table.clear()
+        self._heap.clear()
+        self.bytes = 0
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def _read_data_version(self):
+        database = db_pool.get_pool().database
+        if self._watch is None or self._watch_database != database:
+            if self._watch is not None:
+                self._watch.close()
+            self._watch = sqlite3.connect(database, check_same_thread=False)
+            self._watch_database = database
+            self._data_version = None
+        return self._watch.execute("PRAGMA data_version").fetchone()[0]
+
+    def check_data_version(self, force=False):
+        """
+        Clear the cache if another connection committed since the last check.
+        force=True checks now, regardless of the interval, but only once the
+        watch connection exists.
+        """
+        now = time.monotonic()
+        if now < self._next_version_check and not force:
+            return
+        with self._lock:
+            if force and self._watch is None:
+                return
+            self._next_version_check = now + self.version_check_interval
+            try:
+                version = self._read_data_version()
+            except sqlite3.Error:
+                return
+            if self._data_version is not None and version != self._data_version:
+                self._clear()
+            self._data_version, self._data_version_at = version, now
+
+    def sample_data_version(self):
+        """
+        Read data_version for a later resync_data_version(): returns
+        (version, time read), or None when the cache is not watching yet.
+        """
+        with self._lock:
+            if self._watch is None:
+                return None
+            read_at = time.monotonic()
+            try:
+                return self._read_data_version(), read_at
+            except sqlite3.Error:
+                # The next read cannot be compared with anything: start over.
+                self._clear()
+                self._data_version = None
+                return None
+
+    def resync_data_version(self, sample, quiet_since=None):
+        """
+        Take in a data_version sampled after in-process writes were
+        invalidated. It moves once however many commits landed since the
+        last read, so the move is only put down to our own commit when
+        quiet_since is given: the time from which the connection that
+        committed saw no other connection commit, up to after the sample.
+        If that does not reach back to the last read, the cache is cleared.
+        """
+        if sample is None:
+            return
+        version, read_at = sample
+        with self._lock:
+            if self._data_version is not None:
+                if read_at < self._data_version_at:
+                    # A later read has already dealt with everything up to it.
+                    return
+                if version != self._data_version and (
+                        quiet_since is None or quiet_since > self._data_version_at):
+                    self._clear()
+            self._next_version_check = time.monotonic() + self.version_check_interval
+            self._data_version, self._data_version_at = version, read_at
+
+
+def _own_data_version(conn):
+    # A connection's own data_version only moves for commits made by others.
+    try:
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+    except sqlite3.Error:
+        return None, None
+    return version, time.monotonic()
+
+
+async def _own_data_version_async(conn):
+    try:
+        async with conn.execute("PRAGMA data_version") as cursor:
+            version = (await cursor.fetchone())[0]
+    except sqlite3.Error:
+        return None, None
+    return version, time.monotonic()
+
+
+class WriteTracker:
+    """Trace callback that collects the tables a connection writes."""
+
+    def __init__(self, data_version=None, seen_at=None):
+        self.pending = set()
+        self.committed = set()
+        self.in_transaction = False
+        # The connection's own data_version and when it was read.
+        self.data_version = data_version
+        self.seen_at = seen_at
+
+    def __call__(self, sql):
+        verb = sql.lstrip()[:8].upper()
+        if verb.startswith('BEGIN'):
+            self.in_transaction = True
+        elif verb.startswith(('COMMIT', 'END')):
+            self.in_transaction = False
+            self._publish(self.pending)
+            self.pending = set()
+        elif verb.startswith('ROLLBACK') and 'TO' not in sql.upper():
+            self.in_transaction = False
+            self.pending = set()
+        else:
+            tables = written_tables(sql)
+            if tables is None:
+                return
+            if self.in_transaction:
+                self.pending |= tables
+            else:
+                self._publish(tables)
+
+    def _publish(self, tables):
+        if tables:
+            # Invalidate now, and again once the commit is visible (on release).
+            _invalidate_all(tables)
+            self.committed |= tables
+
+    def after_release(self, conn):
+        if not self.committed:
+            return
+        self._invalidate_committed()
+        # Our own data_version is read on both sides of the watch reads: if it
+        # has not moved since seen_at, nobody else committed up to the later
+        # read, so whatever the watch connections saw since then was ours.
+        before = _own_data_version(conn)
+        samples = [(cache, cache.sample_data_version()) for cache in _caches]
+        self._resync(before, samples, _own_data_version(conn))
+
+    async def after_release_async(self, conn):
+        """after_release() for an aiosqlite connection."""
+        if not self.committed:
+            return
+        self._invalidate_committed()
+        before = await _own_data_version_async(conn)
+        samples = [(cache, cache.sample_data_version()) for cache in _caches]
+        self._resync(before, samples, await _own_data_version_async(conn))
+
+    def _invalidate_committed(self):
+        tables, self.committed = self.committed, set()
+        _invalidate_all(tables)
+
+    def _resync(self, before, samples, after):
+        quiet = self.data_version is not None and after[0] == self.data_version
+        for cache, sample in samples:
+            cache.resync_data_version(sample, self.seen_at if quiet else None)
+        self.data_version, self.seen_at = before
+
+
+_caches = []
+
+
+def _invalidate_all(tables):
+    for cache in _caches:
+        cache.invalidate(tables)
+
+
+def register(cache):
+    """Have cache invalidated by writes made through db_pool connections."""
+    _caches.append(cache)
+    return cache
+
+
+def _check_watches():
+    # Read the watches after a new connection's data_version, so that its
+    # quiet period covers them (see WriteTracker.after_release).
+    for cache in _caches:
+        cache.check_data_version(force=True)
+
+
+def _track_writes(conn):
+    conn.write_tracker = WriteTracker(*_own_data_version(conn))
+    conn.set_trace_callback(conn.write_tracker)
+    _check_watches()
+
+
+async def track_writes_async(conn):
+    """Have the writes of an aiosqlite connection invalidate the caches too."""
+    conn.write_tracker = WriteTracker(*await _own_data_version_async(conn))
+    await conn.set_trace_callback(conn.write_tracker)
+    _check_watches()
+
+
+def _after_release(conn):
+    tracker = getattr(conn, 'write_tracker', None)
+    if tracker is not None:
+        tracker.after_release(conn)
+
+
+#### shared cache used by cache_query and db_operation(cache=True)
+default_cache = register(QueryCache(maxsize=256, ttl=300))
+
+db_pool.add_connect_hook(_track_writes)
+db_pool.add_release_hook(_after_release)
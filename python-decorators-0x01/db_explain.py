@@ -0,0 +1,189 @@
+import re
+import sqlite3
+import threading
+from contextlib import nullcontext
+
+import db_pool
+
+#### EXPLAIN QUERY PLAN capture per query shape, full-scan report and index advisor
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACE = re.compile(r"\s+")
+_TABLE = re.compile(r'\b(?:FROM|UPDATE|INTO)\s+["`\[]?(\w+)', re.IGNORECASE)
+_WHERE = re.compile(r'\bWHERE\b(.*?)(?:\bGROUP\s+BY\b|\bORDER\s+BY\b|\bLIMIT\b|$)',
+                    re.IGNORECASE | re.DOTALL)
+_PREDICATE = re.compile(r'["`\[]?(\w+)["`\]]?\s*(=|==|IS\b|IN\b|<=|>=|<|>|BETWEEN\b|LIKE\b)',
+                        re.IGNORECASE)
+_ORDER_BY = re.compile(r'\bORDER\s+BY\s+(.*?)(?:\bLIMIT\b|$)', re.IGNORECASE | re.DOTALL)
+_SELECT_LIST = re.compile(r'^\s*SELECT\s+(.*?)\s+FROM\b', re.IGNORECASE | re.DOTALL)
+_KEYWORDS = {'and', 'or', 'not', 'null'}
+
+
+def query_shape(query):
+    """Normalise a query so that calls differing only in literals share one plan."""
+    shape = _STRING.sub('?', query)
+    shape = _NUMBER.sub('?', shape)
+    return _SPACE.sub(' ', shape).strip()
+
+
+def full_scans(plan):
+    """Plan steps that read a whole table without any index."""
+    return [detail for detail in plan
+            if detail.startswith('SCAN ') and 'USING' not in detail
+            and not detail.startswith('SCAN CONSTANT ROW')]
+
+
+class _ShapeStats:
+    __slots__ = ('query', 'plan', 'scans', 'calls', 'total_time')
+
+    def __init__(self, query):
+        self.query = query
+        self.plan = None
+        self.scans = []
+        self.calls = 0
+        self.total_time = 0.0
+
+
+class PlanRegistry:
+    """
+    Remembers the query plan of every distinct query shape it is shown.
+
+    observe() counts calls and time per shape and runs EXPLAIN QUERY PLAN
+    only the first time a shape is seen. Shapes whose plan contains a SCAN
+    step without an index are flagged; report() lists them hottest first
+    and advise() proposes indexes for them.
+    """
+
+    def __init__(self):
+        self._shapes = {}
+        self._lock = threading.Lock()
+
+    def observe(self, query, params=(), elapsed=0.0, conn=None):
+        if not query:
+            return
+        shape = query_shape(query)
+        with self._lock:
+            stats = self._shapes.get(shape)
+            new = stats is None
+            if new:
+                stats = self._shapes[shape] = _ShapeStats(query)
+            stats.calls += 1
+            stats.total_time += elapsed
+        if new:
+            plan = self._explain(query, params, conn)
+            stats.plan = plan
+            stats.scans = full_scans(plan or [])
+
+    @staticmethod
+    def _explain(query, params, conn):
+        try:
+            if conn is not None:
+                rows = conn.execute("EXPLAIN QUERY PLAN " + query, params).fetchall()
+            else:
+                with db_pool.connection() as own:
+                    rows = own.execute("EXPLAIN QUERY PLAN " + query, params).fetchall()
+        except sqlite3.Error:
+            return None
+        return [row[-1] for row in rows]
+
+    def plan(self, query):
+        stats = self._shapes.get(query_shape(query))
+        return stats.plan if stats is not None else None
+
+    def report(self):
+        """Flagged shapes as dicts, ordered by the total time spent in them."""
+        with self._lock:
+            flagged = [(shape, s) for shape, s in self._shapes.items() if s.scans]
+        flagged.sort(key=lambda item: item[1].total_time, reverse=True)
+        return [{
+            'shape': shape,
+            'calls': s.calls,
+            'total_ms': round(s.total_time * 1000, 3),
+            'scans': list(s.scans),
+            'plan': list(s.plan or []),
+        } for shape, s in flagged]
+
+    def advise(self, top=5):
+        """
+        Suggest indexes for the `top` hottest flagged shapes.
+
+        Columns compared in the WHERE clause come first (equality before
+        range), then ORDER BY columns; when the query selects explicit
+        columns they are appended so the index also covers the query.
+        """
+        suggestions = []
+        seen = set()
+        for entry in self.report()[:top]:
+            query = self._shapes[entry['shape']].query
+            suggestion = suggest_index(query)
+            if suggestion is not None and suggestion['sql'] not in seen:
+                seen.add(suggestion['sql'])
+                suggestion['shape'] = entry['shape']
+                suggestions.append(suggestion)
+        return suggestions
+
+    def create_indexes(self, top=5, conn=None):
+        """Create the indexes advise() suggests; returns the statements run."""
+        suggestions = self.advise(top)
+        if not suggestions:
+            return []
+        with db_pool.connection(write=True) if conn is None else nullcontext(conn) as target:
+            for suggestion in suggestions:
+                target.execute(suggestion['sql'])
+            target.commit()
+        with self._lock:
+            # Plans are stale now; let the next call of each shape re-explain.
+            self._shapes.clear()
+        return [s['sql'] for s in suggestions]
+
+    def reset(self):
+        with self._lock:
+            self._shapes.clear()
+
+
+def _columns(text):
+    columns = []
+    for match in _PREDICATE.finditer(text):
+        name, op = match.group(1), match.group(2).upper()
+        if name.lower() in _KEYWORDS or name.isdigit():
+            continue
+        columns.append((0 if op in ('=', '==', 'IS', 'IN') else 1, name))
+    return columns
+
+
+def suggest_index(query):
+    """Return {'table', 'columns', 'sql'} for a covering index on query, or None."""
+    table = _TABLE.search(query)
+    where = _WHERE.search(query)
+    if table is None or where is None:
+        return None
+    table = table.group(1)
+    ordered = []
+    for _, name in sorted(_columns(where.group(1)), key=lambda c: c[0]):
+        if name not in ordered:
+            ordered.append(name)
+    if not ordered:
+        return None
+    order_by = _ORDER_BY.search(query)
+    if order_by:
+        for part in order_by.group(1).split(','):
+            name = part.strip().split(' ')[0].strip('"`[]')
+            if name and name not in ordered:
+                ordered.append(name)
+    select = _SELECT_LIST.search(query)
+    if select and select.group(1).strip() != '*':
+        for part in select.group(1).split(','):
+            name = part.strip().strip('"`[]')
+            if re.fullmatch(r'\w+', name) and name not in ordered:
+                ordered.append(name)
+    name = f"idx_{table}_{'_'.join(ordered)}"
+    return {
+        'table': table,
+        'columns': ordered,
+        'sql': f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(ordered)})",
+    }
+
+
+#### shared registry used by log_queries(explain=True) and db_operation(explain=True)
+plans = PlanRegistry()
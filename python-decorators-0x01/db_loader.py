@@ -0,0 +1,170 @@
+import sqlite3
+import asyncio
+
+import db_pool
+
+#### DataLoader-style batching: point lookups made together are answered by one IN (...) query
+
+# SQLite's default SQLITE_MAX_VARIABLE_NUMBER before 3.32; used when the
+# connection cannot report its own limit.
+DEFAULT_MAX_VARIABLES = 999
+
+
+def max_variables(conn):
+    """Bound parameters one statement on conn may use."""
+    getlimit = getattr(conn, 'getlimit', None)
+    if getlimit is None:
+        return DEFAULT_MAX_VARIABLES
+    return getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+
+
+def chunks(keys, size):
+    for i in range(0, len(keys), size):
+        yield keys[i:i + size]
+
+
+class Pending:
+    """A row that has been asked for but maybe not fetched yet."""
+
+    def __init__(self, loader, key):
+        self._loader = loader
+        self._key = key
+
+    def result(self):
+        """Return the row (None if there is none), dispatching the batch if needed."""
+        return self._loader._resolve(self._key)
+
+
+class RowLoader:
+    """
+    Batches point lookups by one column of a table.
+
+    Keys asked for with load() are queued and fetched together, with one
+    SELECT ... WHERE column IN (...) per chunk of keys (kept under SQLite's
+    bound parameter limit), when the first of their results is needed or
+    when the batch() block ends. load_async() does the same for coroutines:
+    keys requested during one pass of the event loop are fetched together
+    on the next one, through the async pool.
+
+    Every row fetched is cached for the lifetime of the loader, so create
+    one loader per request rather than sharing one: it is not thread-safe
+    and would otherwise serve stale rows.
+
+    users = RowLoader('users')
+    pending = [users.load(i) for i in ids]
+    rows = [p.result() for p in pending]  # one query for all ids
+    """
+
+    def __init__(self, table, column='id', columns='*', pooled=None):
+        self.query = f"SELECT {columns} FROM {table} WHERE {column} IN "
+        self.column = column
+        self.pooled = pooled
+        self.batches = 0
+        self._rows = {}  # key -> row, or None if there is no such row
+        self._queue = {}  # keys waiting for the next sync batch, in order
+        self._async_queue = {}  # key -> asyncio.Future waiting for the next async batch
+        self._task = None
+
+    def _key_index(self, description):
+        names = [d[0] for d in description]
+        if self.column not in names:
+            raise ValueError(f"column {self.column!r} must be among the selected columns")
+        return names.index(self.column)
+
+    def _collect(self, rows, description, found):
+        index = self._key_index(description)
+        for row in rows:
+            found[row[index]] = row
+
+    def load(self, key):
+        """Queue key for the next batch and return a Pending for its row."""
+        if key not in self._rows:
+            self._queue[key] = None
+        return Pending(self, key)
+
+    def load_many(self, keys):
+        """Return the rows for keys, in order, fetching the missing ones in one batch."""
+        pending = [self.load(key) for key in keys]
+        return [p.result() for p in pending]
+
+    def dispatch(self):
+        """Fetch every queued key now."""
+        keys, self._queue = list(self._queue), {}
+        if not keys:
+            return
+        found = {}
+        with db_pool.connection(self.pooled) as conn:
+            for chunk in chunks(keys, max_variables(conn)):
+                cursor = conn.execute(self.query + f"({','.join('?' * len(chunk))})", chunk)
+                self._collect(cursor.fetchall(), cursor.description, found)
+                self.batches += 1
+        for key in keys:
+            self._rows[key] = found.get(key)
+
+    def _resolve(self, key):
+        if key not in self._rows:
+            self.dispatch()
+        return self._rows[key]
+
+    def batch(self):
+        """Context manager that dispatches whatever is still queued when it exits."""
+        return _BatchScope(self)
+
+    async def load_async(self, key):
+        """Return the row for key, batched with the other keys asked for in this loop pass."""
+        if key in self._rows:
+            return self._rows[key]
+        future = self._async_queue.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._async_queue[key] = loop.create_future()
+            if self._task is None:
+                self._task = loop.create_task(self._dispatch_async())
+        return await future
+
+    async def load_many_async(self, keys):
+        return await asyncio.gather(*(self.load_async(key) for key in keys))
+
+    async def _dispatch_async(self):
+        import db_async  # aiosqlite is only needed by the async front end
+
+        await asyncio.sleep(0)  # let the other callers of this loop pass queue their keys
+        pending, self._async_queue = self._async_queue, {}
+        self._task = None
+        keys = list(pending)
+        found = {}
+        try:
+            async with db_async.connection() as conn:
+                for chunk in chunks(keys, DEFAULT_MAX_VARIABLES):
+                    async with conn.execute(
+                            self.query + f"({','.join('?' * len(chunk))})", chunk) as cursor:
+                        rows = await cursor.fetchall()
+                        self._collect(rows, cursor.description, found)
+                    self.batches += 1
+        except BaseException as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        for key, future in pending.items():
+            self._rows[key] = found.get(key)
+            if not future.done():
+                future.set_result(self._rows[key])
+
+    def clear(self):
+        """Forget the cached rows, e.g. after the request wrote to the table."""
+        self._rows.clear()
+
+
+class _BatchScope:
+    def __init__(self, loader):
+        self.loader = loader
+
+    def __enter__(self):
+        return self.loader
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.loader.dispatch()
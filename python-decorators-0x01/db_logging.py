@@ -0,0 +1,128 @@
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import hashlib
+import threading
+from datetime import datetime
+
+#### structured query log written by a background thread so callers never wait on I/O
+
+
+def row_count(result):
+    """Rows returned by a query function: len() of a result list, 1 for a row, else None."""
+    if result is None:
+        return 0
+    if isinstance(result, (list, tuple)) and (not result or isinstance(result[0], (tuple, list, dict))):
+        return len(result)
+    if isinstance(result, (tuple, dict)):
+        return 1
+    return None
+
+
+class QueryLogger:
+    """
+    Asynchronous, sampled query log.
+
+    record() only takes a sampling decision and enqueues a tuple; a daemon
+    thread turns queued records into one JSON line each and writes them to
+    stream. A fraction sample_rate of ordinary queries is kept, while every
+    query slower than slow_threshold seconds (and every failed one) is
+    always kept. When the queue is full new records are dropped and counted
+    rather than blocking the caller. Records the thread fails to write (a
+    closed stream, a full disk) are counted in errors, and the last
+    exception is kept in last_error.
+
+    Bound parameters are not written out, only a short hash of them
+    (params_hash), so that calls of one query with different arguments can
+    be told apart, e.g. when a log is replayed against a cache.
+    """
+
+    def __init__(self, stream=None, sample_rate=1.0, slow_threshold=0.5, max_queue=10000):
+        self.stream = stream
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+        self._queue = queue.Queue(max_queue)
+        self._thread = threading.Thread(target=self._run, name="query-logger", daemon=True)
+        self._thread.start()
+
+    def record(self, query, elapsed, rows=None, error=None, sample_rate=None, slow_threshold=None,
+               params=None):
+        slow_threshold = self.slow_threshold if slow_threshold is None else slow_threshold
+        slow = slow_threshold is not None and elapsed >= slow_threshold
+        if not slow and error is None:
+            rate = self.sample_rate if sample_rate is None else sample_rate
+            if rate < 1.0 and random.random() >= rate:
+                return
+        try:
+            self._queue.put_nowait((time.time(), query, elapsed, rows, slow, error, params))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            except Exception as e:
+                self.errors += 1
+                self.last_error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(self, timestamp, query, elapsed, rows, slow, error, params):
+        entry = {
+            'ts': datetime.fromtimestamp(timestamp).isoformat(),
+            'query': query,
+            'elapsed_ms': round(elapsed * 1000, 3),
+            'rows': rows,
+        }
+        if params:
+            entry['params_hash'] = hashlib.blake2b(repr(params).encode(), digest_size=8).hexdigest()
+        if slow:
+            entry['slow'] = True
+        if error is not None:
+            entry['error'] = f"{type(error).__name__}: {error}"
+        stream = self.stream or sys.stdout
+        stream.write(json.dumps(entry, default=str) + "\n")
+        stream.flush()
+
+    def flush(self):
+        """Block until every queued record has been written."""
+        self._queue.join()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def get_query_logger():
+    """Return the process-wide query logger, starting it on first use."""
+    global _logger
+    if _logger is None:
+        with _logger_lock:
+            if _logger is None:
+                _logger = QueryLogger()
+                atexit.register(_logger.close)
+    return _logger
+
+
+def configure(**settings):
+    """Set stream, sample_rate or slow_threshold on the shared query logger."""
+    logger = get_query_logger()
+    for name, value in settings.items():
+        if name not in ('stream', 'sample_rate', 'slow_threshold'):
+            raise TypeError(f"unknown query logger setting: {name}")
+        setattr(logger, name, value)
@@ -0,0 +1,328 @@
+import bisect
+import weakref
+import itertools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#### in-process metrics for the decorator stack, exported in Prometheus text format
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class _Metric:
+    """
+    Base of Counter and Histogram.
+
+    Every thread updates its own shard (a dict of label values -> value),
+    so an increment takes no lock; the shards are only added up when the
+    metric is exported. A shard only takes the metric's lock the first time
+    it sees a label combination, which is also when the exporter could
+    otherwise catch the dict changing size. When a thread ends, its shard
+    is folded into a shared one for retired threads, so short-lived threads
+    do not leave a shard each behind.
+    """
+
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._shards = {}  # shard id -> shard of a live thread
+        self._retired = {}  # totals of the threads that have ended
+        self._ids = itertools.count()
+        self._local = threading.local()
+        self._children = {}
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            # Dropped with the rest of the thread's locals when the thread ends.
+            owner = self._local.owner = _ShardOwner()
+            shard_id = next(self._ids)
+            with self._lock:
+                self._shards[shard_id] = shard
+            weakref.finalize(owner, self._retire, shard_id)
+            return shard
+
+    def _retire(self, shard_id):
+        with self._lock:
+            shard = self._shards.pop(shard_id, None)
+            if shard is not None:
+                self._fold(self._retired, shard)
+
+    def labels(self, *values):
+        """
+        Return the child for these label values. Resolve it once, outside the
+        hot path, and keep it: updating a child skips the label lookup.
+        """
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._child(values))
+        return child
+
+    def _merged(self):
+        with self._lock:
+            shards = [dict(shard) for shard in self._shards.values()]
+            shards.append(self._copy(self._retired))
+        return shards
+
+    def _format_labels(self, values, extra=()):
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class _ShardOwner:
+    """Held in a thread's local storage only, so it is freed when the thread ends."""
+
+
+class _CounterChild:
+    __slots__ = ('_metric', '_key')
+
+    def __init__(self, metric, key):
+        self._metric = metric
+        self._key = key
+
+    def inc(self, amount=1):
+        shard = self._metric._shard()
+        try:
+            shard[self._key] += amount
+        except KeyError:
+            with self._metric._lock:
+                shard[self._key] = shard.get(self._key, 0) + amount
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _child(self, values):
+        return _CounterChild(self, values)
+
+    def inc(self, amount=1):
+        """Increment an unlabelled counter."""
+        self.labels().inc(amount)
+
+    @staticmethod
+    def _fold(into, shard):
+        for key, value in shard.items():
+            into[key] = into.get(key, 0) + value
+
+    @staticmethod
+    def _copy(shard):
+        return dict(shard)
+
+    def value(self, *values):
+        key = tuple(str(v) for v in values)
+        return sum(shard.get(key, 0) for shard in self._merged())
+
+    def _samples(self):
+        totals = {}
+        for shard in self._merged():
+            for key, value in shard.items():
+                totals[key] = totals.get(key, 0) + value
+        for key in sorted(totals):
+            yield f"{self.name}{self._format_labels(key)} {totals[key]}"
+
+
+class _HistogramChild:
+    __slots__ = ('_metric', '_key', '_buckets')
+
+    def __init__(self, metric, key):
+        self._metric = metric
+        self._key = key
+        self._buckets = metric.buckets
+
+    def observe(self, value):
+        shard = self._metric._shard()
+        counts = shard.get(self._key)
+        if counts is None:
+            # One slot per bucket plus +Inf, then the sum and the count.
+            counts = [0] * (len(self._buckets) + 1) + [0.0, 0]
+            with self._metric._lock:
+                shard[self._key] = counts
+        counts[bisect.bisect_left(self._buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _child(self, values):
+        return _HistogramChild(self, values)
+
+    def observe(self, value):
+        """Record a value in an unlabelled histogram."""
+        self.labels().observe(value)
+
+    @staticmethod
+    def _fold(into, shard):
+        for key, counts in shard.items():
+            total = into.setdefault(key, [0] * len(counts))
+            for i, n in enumerate(counts):
+                total[i] += n
+
+    @staticmethod
+    def _copy(shard):
+        return {key: list(counts) for key, counts in shard.items()}
+
+    def _samples(self):
+        totals = {}
+        for shard in self._merged():
+            for key, counts in shard.items():
+                total = totals.setdefault(key, [0] * len(counts))
+                for i, n in enumerate(list(counts)):
+                    total[i] += n
+        for key in sorted(totals):
+            total = totals[key]
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), total):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f"{self.name}_bucket{self._format_labels(key, [('le', le)])} {cumulative}"
+            yield f"{self.name}_sum{self._format_labels(key)} {total[-2]}"
+            yield f"{self.name}_count{self._format_labels(key)} {total[-1]}"
+
+
+class _Callback:
+    """Gauge whose samples are read from fn() -> {label values: value} at export time."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames, fn):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+
+    _format_labels = _Metric._format_labels
+    expose = _Metric.expose
+
+    def _samples(self):
+        try:
+            values = self.fn()
+        except Exception:
+            return
+        for key in sorted(values):
+            yield f"{self.name}{self._format_labels(key)} {values[key]}"
+
+
+class Registry:
+    """Named metrics, created on first use and exported together."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"{name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._get(Counter, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def gauge_callback(self, name, help, labelnames, fn):
+        """Register a gauge computed by fn() when metrics are exported."""
+        return self._get(_Callback, name, help, labelnames, fn)
+
+    def export_text(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def export_text():
+    return registry.export_text()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = registry
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.export_text().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=9464, host='127.0.0.1', registry=registry):
+    """
+    Serve /metrics on a background thread and return the server; call
+    shutdown() on it to stop. Binds to localhost unless told otherwise.
+    """
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, name="db-metrics", daemon=True)
+    thread.start()
+    return server
+
+
+#### metrics recorded by the decorators
+
+connections_opened = registry.counter(
+    'db_connections_opened_total', "SQLite connections opened")
+connections_closed = registry.counter(
+    'db_connections_closed_total', "SQLite connections closed")
+connection_seconds = registry.histogram(
+    'db_connection_hold_seconds', "Time a decorated call held its connection", ['function'])
+transactions = registry.counter(
+    'db_transactions_total', "Transactions by outcome (commit or rollback)",
+    ['function', 'outcome'])
+transaction_seconds = registry.histogram(
+    'db_transaction_seconds', "Duration of transactional calls", ['function'])
+retries = registry.counter(
+    'db_retries_total', "Retries after a retryable error", ['function'])
+retry_failures = registry.counter(
+    'db_retry_failures_total', "Calls that failed after their last attempt", ['function'])
+cache_requests = registry.counter(
+    'db_cache_requests_total', "Cached query calls by result (hit or miss)",
+    ['function', 'result'])
+query_seconds = registry.histogram(
+    'db_query_duration_seconds', "Duration of logged queries", ['function'])
+query_errors = registry.counter(
+    'db_query_errors_total', "Logged queries that raised", ['function'])
@@ -0,0 +1,200 @@
+import time
+import inspect
+import functools
+
+import db_pool
+import db_cache
+import db_metrics
+from db_explain import plans
+from db_logging import get_query_logger, row_count
+from db_retry import RetryStats, call_with_retry, is_retryable
+from db_stream import DEFAULT_ARRAYSIZE, open_stream
+from db_timeout import statement_timeout
+
+#### one decorator that does the work of the whole decorator stack in a single wrapper
+
+
+def _argument_locator(func):
+    """
+    Work out once where the query and its parameters are in a call.
+
+    Returns a function (args, kwargs) -> (query, params) for the arguments
+    the caller passes, i.e. without the injected connection. The query is
+    the `query` parameter, which func must have; params is the `params`
+    parameter if there is one, otherwise all remaining arguments.
+    """
+    parameters = list(inspect.signature(func).parameters.values())[1:]
+    names = [p.name for p in parameters]
+    if 'query' not in names:
+        raise ValueError(f"{func.__qualname__} has no `query` parameter; cache, log and "
+                         f"explain need the SQL string the function runs")
+    query_index = names.index('query')
+    query_default = parameters[query_index].default
+    params_index = names.index('params') if 'params' in names else None
+
+    def locate(args, kwargs):
+        if 'query' in kwargs:
+            query = kwargs['query']
+        elif len(args) > query_index:
+            query = args[query_index]
+        else:
+            query = query_default
+        if not isinstance(query, str):
+            raise TypeError(f"{func.__qualname__}: query must be an SQL string, "
+                            f"not {type(query).__name__}")
+        if params_index is not None:
+            if 'params' in kwargs:
+                return query, kwargs['params']
+            return query, args[params_index] if len(args) > params_index else ()
+        rest = args[:query_index] + args[query_index + 1:]
+        extra = tuple(sorted((k, v) for k, v in kwargs.items() if k != 'query'))
+        return query, rest + extra
+
+    return locate
+
+
+def db_operation(func=None, *, transactional=False, retries=1, delay=0.1, max_delay=30,
+                 deadline=None, retry_if=is_retryable, cache=None, log=False,
+                 sample_rate=None, slow_threshold=None, explain=False, stream=False,
+                 arraysize=DEFAULT_ARRAYSIZE, pooled=None, timeout=None):
+    """
+    Fused replacement for stacking log_queries, cache_query, with_db_connection,
+    retry_on_failure and transactional on a func(conn, ...).
+
+    All options are resolved when the function is decorated and the call
+    goes through a single wrapper, in this order:
+
+    - log: time the whole call and record it in the shared query logger
+      (sample_rate / slow_threshold / explain as in log_queries)
+    - cache: True for the shared query cache or a QueryCache instance; a hit
+      returns without touching the pool. Entries are keyed by the function
+      as well as the query and its parameters
+    - a pooled connection (or the open transaction's connection)
+    - retries / delay / max_delay / deadline / retry_if as in retry_on_failure
+    - timeout: give each attempt's statements that many seconds; a
+      statement still running then raises db_timeout.QueryTimeout
+    - transactional: run each attempt in db_pool.transaction()
+    - stream: func returns its cursor and the caller gets a RowStream that
+      fetches arraysize rows at a time and keeps the connection until it is
+      exhausted or closed (not combinable with cache or transactional)
+
+    cache, log and explain need the SQL the function runs, so func must
+    take it as a `query` parameter (a string); otherwise decorating raises
+    ValueError. Usable bare (@db_operation) or with options.
+    """
+    if func is None:
+        return functools.partial(
+            db_operation, transactional=transactional, retries=retries, delay=delay,
+            max_delay=max_delay, deadline=deadline, retry_if=retry_if, cache=cache,
+            log=log, sample_rate=sample_rate, slow_threshold=slow_threshold,
+            explain=explain, stream=stream, arraysize=arraysize, pooled=pooled,
+            timeout=timeout)
+
+    if retries < 1:
+        raise ValueError("retries must be at least 1")
+    if stream and (cache or transactional):
+        raise ValueError("stream=True cannot be combined with cache or transactional")
+    if cache is True:
+        cache = db_cache.default_cache
+    elif cache is False:
+        cache = None
+    locate = _argument_locator(func) if cache is not None or log or explain else None
+    query_log = get_query_logger() if log else None
+    name = func.__qualname__
+    stats = RetryStats(name) if retries > 1 else None
+    held = db_metrics.connection_seconds.labels(name)
+
+    if transactional:
+        committed = db_metrics.transactions.labels(name, 'commit')
+        rolled_back = db_metrics.transactions.labels(name, 'rollback')
+        duration = db_metrics.transaction_seconds.labels(name)
+
+        def attempt(conn, args, kwargs):
+            start = time.perf_counter()
+            try:
+                with db_pool.transaction(conn):
+                    result = func(conn, *args, **kwargs)
+            except BaseException:
+                rolled_back.inc()
+                raise
+            finally:
+                duration.observe(time.perf_counter() - start)
+            committed.inc()
+            return result
+    else:
+        def attempt(conn, args, kwargs):
+            return func(conn, *args, **kwargs)
+
+    if timeout is not None:
+        untimed = attempt
+
+        def attempt(conn, args, kwargs):
+            with statement_timeout(conn, timeout):
+                return untimed(conn, args, kwargs)
+
+    def call(conn, args, kwargs):
+        if stats is None:
+            return attempt(conn, args, kwargs)
+        return call_with_retry(attempt, (conn, args, kwargs), {}, retries, delay,
+                               max_delay, deadline, retry_if, stats)
+
+    if stream:
+        def run(args, kwargs):
+            return open_stream(lambda conn: call(conn, args, kwargs), arraysize, pooled)
+    else:
+        def run(args, kwargs):
+            with db_pool.connection(pooled, write=transactional) as conn:
+                start = time.perf_counter()
+                try:
+                    return call(conn, args, kwargs)
+                finally:
+                    held.observe(time.perf_counter() - start)
+
+    if cache is not None:
+        hits = db_metrics.cache_requests.labels(name, 'hit')
+        misses = db_metrics.cache_requests.labels(name, 'miss')
+    if log:
+        query_duration = db_metrics.query_seconds.labels(name)
+        query_errors = db_metrics.query_errors.labels(name)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if locate is None:
+            return run(args, kwargs)
+        query, params = locate(args, kwargs)
+        start = time.perf_counter()
+        try:
+            if cache is not None:
+                loaded = False
+
+                def load():
+                    nonlocal loaded
+                    loaded = True
+                    return run(args, kwargs)
+                # Keyed by function too: two functions may run the same SQL differently.
+                result = cache.get_or_load(query, (name, params), load)
+                (misses if loaded else hits).inc()
+            else:
+                result = run(args, kwargs)
+        except Exception as e:
+            if query_log is not None:
+                elapsed = time.perf_counter() - start
+                query_duration.observe(elapsed)
+                query_errors.inc()
+                query_log.record(query, elapsed, error=e, params=params,
+                                 sample_rate=sample_rate, slow_threshold=slow_threshold)
+            raise
+        elapsed = time.perf_counter() - start
+        if query_log is not None:
+            query_duration.observe(elapsed)
+            query_log.record(query, elapsed, row_count(result), params=params,
+                             sample_rate=sample_rate, slow_threshold=slow_threshold)
+        if explain:
+            plans.observe(query, params, elapsed)
+        return result
+
+    if stats is not None:
+        wrapper.retry_stats = stats
+    if transactional:
+        wrapper.db_write = True
+    return wrapper
@@ -0,0 +1,147 @@
+import os
+import queue
+import atexit
+import pickle
+import sqlite3
+import hashlib
+import threading
+
+import db_pool
+
+#### on-disk second level for QueryCache, so a restarted process starts with a warm cache
+
+
+def database_fingerprint(database):
+    """
+    Identify the current contents of a database file.
+
+    Every commit changes the main file or its -wal file, so their size and
+    modification time change too. Unlike PRAGMA data_version, which is
+    private to one connection, this stays meaningful across processes and
+    restarts.
+    """
+    try:
+        st = os.stat(database)
+    except OSError:
+        return None
+    try:
+        wal = os.stat(database + '-wal')
+        wal_state = (wal.st_mtime_ns, wal.st_size)
+    except OSError:
+        wal_state = (0, 0)
+    return f"{st.st_mtime_ns}:{st.st_size}:{wal_state[0]}:{wal_state[1]}"
+
+
+class PersistentStore:
+    """
+    Query results kept in a separate SQLite file.
+
+    Entries are keyed by a hash of the cache key and remember the database
+    fingerprint they were computed under; a lookup only returns an entry
+    whose fingerprint matches the database as it is now, so anything
+    written since (by this process or another) is never served. Nothing is
+    loaded at startup: QueryCache asks for a key the first time it misses
+    in memory. put() only queues the entry; a background thread writes it.
+    Entries it fails to write (an unpicklable value, a full disk) are
+    counted in errors, and the last exception is kept in last_error.
+    """
+
+    def __init__(self, path, database=None, max_queue=10000):
+        self.path = path
+        self.database = database
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+        self._reader = sqlite3.connect(path, check_same_thread=False)
+        self._reader.execute("PRAGMA journal_mode=WAL")
+        self._reader.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, fingerprint TEXT, value BLOB)")
+        self._reader.commit()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(max_queue)
+        self._thread = threading.Thread(target=self._run, name="cache-store", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _hash(key):
+        return hashlib.sha1(pickle.dumps(key, protocol=4)).hexdigest()
+
+    def fingerprint(self):
+        return database_fingerprint(self.database or db_pool.get_pool().database)
+
+    def get(self, key):
+        """
+        Return (found, value, fingerprint). The fingerprint is the current one
+        and should be passed to put() with the value computed after a miss.
+        """
+        fingerprint = self.fingerprint()
+        if fingerprint is None:
+            return False, None, None
+        with self._lock:
+            row = self._reader.execute(
+                "SELECT fingerprint, value FROM entries WHERE key = ?",
+                (self._hash(key),)).fetchone()
+        if row is None or row[0] != fingerprint:
+            return False, None, fingerprint
+        try:
+            return True, pickle.loads(row[1]), fingerprint
+        except Exception:
+            return False, None, fingerprint
+
+    def put(self, key, value, fingerprint):
+        if fingerprint is None:
+            return
+        try:
+            self._queue.put_nowait(('put', self._hash(key), fingerprint, value))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            while True:
+                item = self._queue.get()
+                try:
+                    if item is None:
+                        return
+                    self._write(conn, item)
+                except Exception as e:
+                    self.errors += 1
+                    self.last_error = e
+                finally:
+                    self._queue.task_done()
+        finally:
+            conn.close()
+
+    def _write(self, conn, item):
+        _, key, fingerprint, value = item
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO entries (key, fingerprint, value) VALUES (?, ?, ?)",
+                         (key, fingerprint, blob))
+
+    def prune(self):
+        """Delete entries computed under any other fingerprint than the current one."""
+        fingerprint = self.fingerprint()
+        with self._lock:
+            with self._reader:
+                self._reader.execute("DELETE FROM entries WHERE fingerprint IS NOT ?", (fingerprint,))
+
+    def flush(self):
+        """Block until every queued entry has been written."""
+        self._queue.join()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        with self._lock:
+            self._reader.close()
+
+
+def open_store(path, database=None):
+    """Open a PersistentStore that is flushed and closed when the process exits."""
+    store = PersistentStore(path, database)
+    atexit.register(store.close)
+    return store
@@ -0,0 +1,415 @@
+import os
+import time
+import pathlib
+import sqlite3
+import threading
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+import db_metrics
+from db_timeout import statement_timeout
+
+#### shared, thread-safe SQLite connection pool used by with_db_connection
+
+DEFAULT_DATABASE = 'users.db'
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out within the wait timeout."""
+
+
+class Connection(sqlite3.Connection):
+    """sqlite3.Connection that connect hooks can attach their own state to."""
+
+
+class ConnectionPool:
+    """
+    Bounded pool of SQLite connections.
+
+    Connections are created lazily up to max_size, handed out with acquire()
+    and given back with release(). Idle connections older than max_idle
+    seconds are closed instead of reused, and a connection that has been
+    idle for longer than ping_after seconds is health-checked with
+    ``SELECT 1`` before it is handed out again. With readonly=True the
+    connections are opened through a ``mode=ro`` URI and cannot write.
+    """
+
+    def __init__(self, database=DEFAULT_DATABASE, max_size=5, max_idle=300.0,
+                 timeout=5.0, ping_after=1.0, readonly=False, **connect_kwargs):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.database = database
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.readonly = readonly
+        self.connect_kwargs = connect_kwargs
+        self._idle = deque()  # (conn, returned_at), most recently returned on the right
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition(threading.Lock())
+
+    def _connect(self):
+        if self.readonly:
+            uri = pathlib.Path(self.database).absolute().as_uri() + '?mode=ro'
+            return connect(uri, uri=True, **self.connect_kwargs)
+        return connect(self.database, **self.connect_kwargs)
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn):
+        # Caller must hold the lock; frees a slot for a new connection.
+        self._size -= 1
+        self._cond.notify()
+        db_metrics.connections_closed.inc()
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def acquire(self, timeout=None):
+        """Check out a connection, waiting up to timeout seconds for a free slot."""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("connection pool is closed")
+                now = time.monotonic()
+                while self._idle:
+                    conn, returned_at = self._idle.pop()
+                    idle_for = now - returned_at
+                    if idle_for > self.max_idle:
+                        self._discard(conn)
+                        continue
+                    if idle_for > self.ping_after and not self._is_healthy(conn):
+                        self._discard(conn)
+                        continue
+                    return conn
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise PoolTimeout(
+                        f"no connection to '{self.database}' available "
+                        f"after {timeout}s (max_size={self.max_size})")
+                self._cond.wait(remaining)
+        # Open the new connection outside the lock so other threads keep moving.
+        try:
+            return self._connect()
+        except BaseException:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn):
+        """Return a connection to the pool, rolling back any open transaction."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            healthy = True
+        except sqlite3.Error:
+            healthy = False
+        _run_hooks(_release_hooks, conn)
+        with self._cond:
+            if self._closed or not healthy:
+                self._discard(conn)
+                return
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Close all idle connections; checked-out ones are closed on release."""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+            self._cond.notify_all()
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+
+_connect_hooks = []
+_release_hooks = []
+
+
+def _run_hooks(hooks, conn):
+    for hook in hooks:
+        hook(conn)
+
+
+def connect(database=None, **kwargs):
+    """
+    Open a connection outside any pool, usable from any thread, with the
+    connect hooks applied. Pass it to notify_released() after each unit of
+    work so release hooks see it too.
+    """
+    kwargs.setdefault('factory', Connection)
+    kwargs.setdefault('check_same_thread', False)
+    conn = sqlite3.connect(database or _settings['database'], **kwargs)
+    db_metrics.connections_opened.inc()
+    _run_hooks(_connect_hooks, conn)
+    return conn
+
+
+def notify_released(conn):
+    """Run the release hooks for a connection managed outside the pool."""
+    _run_hooks(_release_hooks, conn)
+
+
+def add_connect_hook(hook):
+    """
+    Call hook(conn) on every connection opened from now on.
+
+    The default pool is reset so that no pooled connection misses the hook.
+    """
+    _connect_hooks.append(hook)
+    configure()
+
+
+def add_release_hook(hook):
+    """Call hook(conn) whenever a connection is handed back after use."""
+    _release_hooks.append(hook)
+
+
+_settings = {
+    'database': DEFAULT_DATABASE,
+    'pooled': True,
+    'max_size': 5,
+    'max_idle': 300.0,
+    'timeout': 5.0,
+    'read_write_split': False,
+    'readers': None,
+    'query_timeout': None,
+}
+_pool = None
+_writer_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure(**settings):
+    """
+    Change the defaults used by connection() and get_pool().
+
+    Accepts database, pooled, max_size, max_idle, timeout, read_write_split,
+    readers and query_timeout. The current pools are closed so that the
+    next checkout picks up the settings.
+
+    With query_timeout set, every checkout through connection() gets that
+    many seconds for its statements (see db_timeout.statement_timeout), so
+    a runaway query raises QueryTimeout instead of holding its pool slot.
+    Each attempt of a retried call gets the full budget again, and each
+    fetch of a stream gets it on its own.
+
+    With read_write_split=True the database is switched to WAL mode, reads
+    are served by a pool of `readers` read-only connections (one per CPU by
+    default) and writes by a single writer connection, so readers keep
+    running while a write is in progress.
+    """
+    global _pool, _writer_pool
+    unknown = set(settings) - set(_settings)
+    if unknown:
+        raise TypeError(f"unknown pool settings: {', '.join(sorted(unknown))}")
+    with _pool_lock:
+        _settings.update(settings)
+        old = [_pool, _writer_pool]
+        _pool = _writer_pool = None
+    for pool in old:
+        if pool is not None:
+            pool.close()
+
+
+def get_setting(name):
+    """Current value of one of the settings accepted by configure()."""
+    return _settings[name]
+
+
+def _create_pools():
+    # Caller holds _pool_lock.
+    global _pool, _writer_pool
+    options = dict(max_idle=_settings['max_idle'], timeout=_settings['timeout'])
+    if not _settings['read_write_split']:
+        _pool = ConnectionPool(_settings['database'], max_size=_settings['max_size'], **options)
+        return
+    setup = sqlite3.connect(_settings['database'])
+    try:
+        setup.execute("PRAGMA journal_mode=WAL")
+    finally:
+        setup.close()
+    _writer_pool = ConnectionPool(_settings['database'], max_size=1, **options)
+    _pool = ConnectionPool(_settings['database'], readonly=True,
+                           max_size=_settings['readers'] or os.cpu_count() or 4, **options)
+
+
+def get_pool(write=False):
+    """
+    Return the process-wide default pool, creating it on first use.
+
+    When reads and writes are split, write=True returns the single-writer
+    pool and write=False the read-only pool; otherwise both get the same pool.
+    """
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _create_pools()
+    pool, writer = _pool, _writer_pool
+    if write and writer is not None:
+        return writer
+    return pool
+
+
+def is_write_operation(func):
+    """True for functions marked as writing (transactional ones are)."""
+    return getattr(func, 'db_write', False)
+
+
+_local = threading.local()
+
+
+def current_transaction():
+    """The connection of the transaction open on this thread, or None."""
+    return getattr(_local, 'conn', None)
+
+
+@contextmanager
+def transaction(conn):
+    """
+    Run the block as a transaction on conn.
+
+    The outermost transaction on a thread begins, commits or rolls back as
+    usual. A transaction opened on the same connection while one is already
+    running becomes a SAVEPOINT: it is released on success and rolled back
+    to on error, leaving the commit to the outer transaction.
+    """
+    depth = getattr(_local, 'depth', 0)
+    if depth and _local.conn is conn:
+        name = f"sp_{depth}"
+        conn.execute(f"SAVEPOINT {name}")
+        _local.depth = depth + 1
+        try:
+            yield conn
+        except BaseException:
+            conn.execute(f"ROLLBACK TO {name}")
+            conn.execute(f"RELEASE {name}")
+            raise
+        else:
+            conn.execute(f"RELEASE {name}")
+        finally:
+            _local.depth = depth
+        return
+    outer = current_transaction(), depth
+    if not conn.in_transaction:
+        # Begin explicitly so a nested SAVEPOINT never becomes the outermost transaction.
+        conn.execute("BEGIN")
+    _local.conn, _local.depth = conn, 1
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+    finally:
+        _local.conn, _local.depth = outer
+
+
+@contextmanager
+def transaction_scope(conn):
+    """
+    Treat the transaction already open on conn as this thread's outer
+    transaction, for code that manages BEGIN/COMMIT itself: transaction()
+    blocks inside use savepoints and connection() reuses conn.
+    """
+    outer = current_transaction(), getattr(_local, 'depth', 0)
+    _local.conn, _local.depth = conn, 1
+    try:
+        yield conn
+    finally:
+        _local.conn, _local.depth = outer
+
+
+def query_deadline(conn):
+    """
+    Apply the query_timeout setting to the statements run on conn in the
+    block (a no-op without one). Used per call by connection() and per
+    attempt by the retry helpers, where a new block restarts the clock.
+    """
+    seconds = _settings['query_timeout']
+    if seconds is None:
+        return nullcontext()
+    return statement_timeout(conn, seconds, default=True)
+
+
+@contextmanager
+def connection(pooled=None, write=False, deadline=True):
+    """
+    Yield a connection to the default database.
+
+    Inside a transaction the connection of that transaction is reused, so
+    nested calls take part in it. Otherwise, with pooling enabled (the
+    default) the connection is borrowed from the shared pool (the writer or
+    a read-only one, per `write`, when reads and writes are split); with
+    pooling disabled a fresh connection is opened and closed.
+
+    deadline=False leaves the block out of query_timeout, for callers such
+    as streams that apply it to each of their statements themselves.
+    """
+    conn = current_transaction()
+    if conn is not None:
+        yield conn
+        return
+    if pooled is None:
+        pooled = _settings['pooled']
+    limited = query_deadline if deadline else nullcontext
+    if pooled:
+        with get_pool(write).connection() as conn, limited(conn):
+            yield conn
+        return
+    conn = connect()
+    try:
+        with limited(conn):
+            yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        _run_hooks(_release_hooks, conn)
+        db_metrics.connections_closed.inc()
+        conn.close()
+
+
+def _pool_gauges():
+    pools = {('reader' if _writer_pool is not None else 'default'): _pool, 'writer': _writer_pool}
+    values = {}
+    for name, pool in pools.items():
+        if pool is not None:
+            values[(name, 'open')] = pool.size
+            values[(name, 'idle')] = pool.idle
+    return values
+
+
+db_metrics.registry.gauge_callback(
+    'db_pool_connections', "Connections in the shared pools", ['pool', 'state'], _pool_gauges)
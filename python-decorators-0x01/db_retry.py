@@ -0,0 +1,117 @@
+import time
+import random
+import sqlite3
+import threading
+from contextlib import nullcontext
+
+import db_pool
+import db_metrics
+from db_timeout import QueryTimeout
+
+#### retry policy shared by the retry decorators: error classification, backoff and metrics
+
+TRANSIENT_MESSAGES = ('database is locked', 'database table is locked', 'database is busy')
+
+
+def is_retryable(exc):
+    """
+    True for errors that may succeed when tried again: lock contention and
+    pool exhaustion. Programming errors, constraint violations and missing
+    tables never are, and neither is a QueryTimeout by default: a statement
+    that ran out of time would most likely do so again. Pass
+    retry_if=is_retryable_or_timeout to retry those as well.
+    """
+    if isinstance(exc, QueryTimeout):
+        return False
+    if isinstance(exc, db_pool.PoolTimeout):
+        return True
+    if isinstance(exc, sqlite3.OperationalError):
+        message = str(exc).lower()
+        return any(text in message for text in TRANSIENT_MESSAGES)
+    return False
+
+
+def is_retryable_or_timeout(exc):
+    """is_retryable(), also accepting statements stopped by their deadline."""
+    return isinstance(exc, QueryTimeout) or is_retryable(exc)
+
+
+def backoff_delay(attempt, base, max_delay):
+    """Full-jitter exponential backoff: uniform in [0, min(max_delay, base * 2**attempt)]."""
+    return random.uniform(0, min(max_delay, base * (2 ** attempt)))
+
+
+class RetryStats:
+    """
+    Counters kept by a retrying function, readable through snapshot().
+    With a name, retries and final failures are also counted in the
+    db_retries_total / db_retry_failures_total metrics under that name.
+    """
+
+    def __init__(self, name=None):
+        self._lock = threading.Lock()
+        self._retries = db_metrics.retries.labels(name) if name else None
+        self._failures = db_metrics.retry_failures.labels(name) if name else None
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.not_retryable = 0
+        self.deadline_exceeded = 0
+        self.total_delay = 0.0
+
+    def record_call(self):
+        with self._lock:
+            self.calls += 1
+
+    def record_retry(self, delay):
+        with self._lock:
+            self.retries += 1
+            self.total_delay += delay
+        if self._retries is not None:
+            self._retries.inc()
+
+    def record_failure(self, retryable, deadline_hit=False):
+        with self._lock:
+            self.failures += 1
+            if not retryable:
+                self.not_retryable += 1
+            if deadline_hit:
+                self.deadline_exceeded += 1
+        if self._failures is not None:
+            self._failures.inc()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'retries': self.retries,
+                'failures': self.failures,
+                'not_retryable': self.not_retryable,
+                'deadline_exceeded': self.deadline_exceeded,
+                'total_delay': self.total_delay,
+            }
+
+
+def call_with_retry(func, args, kwargs, retries, delay, max_delay, deadline, retry_if, stats):
+    """Call func(*args, **kwargs), retrying per the policy above and recording into stats."""
+    stats.record_call()
+    give_up_at = time.monotonic() + deadline if deadline is not None else None
+    # With a connection as first argument, each attempt gets a fresh query_timeout
+    # and a statement it stops reaches retry_if as QueryTimeout.
+    conn = args[0] if args and isinstance(args[0], sqlite3.Connection) else None
+    limited = db_pool.query_deadline if conn is not None else nullcontext
+    for attempt in range(retries):
+        try:
+            with limited(conn):
+                return func(*args, **kwargs)
+        except Exception as e:
+            retryable = retry_if(e)
+            if not retryable or attempt == retries - 1:
+                stats.record_failure(retryable)
+                raise
+            wait = backoff_delay(attempt, delay, max_delay)
+            if give_up_at is not None and time.monotonic() + wait > give_up_at:
+                stats.record_failure(retryable, deadline_hit=True)
+                raise
+            stats.record_retry(wait)
+            time.sleep(wait)
@@ -0,0 +1,194 @@
+import os
+import atexit
+import pathlib
+import sqlite3
+import operator
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import db_pool
+
+#### parallel aggregate scans: a table is split into rowid ranges scanned by a process pool
+
+# Ranges per worker, so that a slow range does not leave the other workers idle.
+PARTITIONS_PER_WORKER = 4
+
+
+class Aggregate:
+    """
+    A mergeable aggregate over the rows of a scan.
+
+    exprs are SQL aggregate expressions that each rowid range computes in
+    its worker (one expression, or a tuple of them whose values come back
+    as a tuple). combine(a, b) merges two of those partial values in the
+    parent and finish(value) turns the merged value into the result.
+    A range whose partial values are all NULL (as SUM or MIN are over no
+    rows) is skipped, so combine never sees them. Only exprs are sent to the workers,
+    so combine and finish may be lambdas.
+    """
+
+    def __init__(self, exprs, combine, finish=None):
+        self.exprs = exprs
+        self.combine = combine
+        self.finish = finish
+
+    def _columns(self):
+        return self.exprs if isinstance(self.exprs, tuple) else (self.exprs,)
+
+    def _partial(self, values):
+        if isinstance(self.exprs, tuple):
+            return tuple(values)
+        return values[0]
+
+
+def count(expr='*'):
+    return Aggregate(f"COUNT({expr})", operator.add)
+
+
+def total(expr):
+    return Aggregate(f"SUM({expr})", operator.add)
+
+
+def minimum(expr):
+    return Aggregate(f"MIN({expr})", min)
+
+
+def maximum(expr):
+    return Aggregate(f"MAX({expr})", max)
+
+
+def mean(expr):
+    return Aggregate((f"TOTAL({expr})", f"COUNT({expr})"),
+                     lambda a, b: (a[0] + b[0], a[1] + b[1]),
+                     lambda s: s[0] / s[1] if s[1] else None)
+
+
+def histogram(expr, edges):
+    """
+    Counts of expr in the bins between consecutive edges: [e0, e1), [e1, e2),
+    ..., with the last bin closed, as numpy.histogram does. Values outside
+    the edges are not counted.
+    """
+    edges = [float(e) for e in edges]
+    if len(edges) < 2 or edges != sorted(edges):
+        raise ValueError("histogram needs at least two edges in ascending order")
+    last = len(edges) - 2
+    exprs = tuple(
+        f"COUNT(CASE WHEN ({expr}) >= {lo!r} AND ({expr}) {'<=' if i == last else '<'} {hi!r} "
+        f"THEN 1 END)"
+        for i, (lo, hi) in enumerate(zip(edges, edges[1:])))
+    return Aggregate(exprs, lambda a, b: tuple(map(operator.add, a, b)), list)
+
+
+_connections = {}  # database -> read-only connection of this worker process
+
+
+def _scan_range(database, query, lo, hi, params):
+    conn = _connections.get(database)
+    if conn is None:
+        uri = pathlib.Path(database).absolute().as_uri() + '?mode=ro'
+        conn = _connections[database] = sqlite3.connect(uri, uri=True)
+    return conn.execute(query, (lo, hi, *params)).fetchone()
+
+
+def rowid_ranges(conn, table, partitions):
+    """Split the rowids of table into up to `partitions` half-open [lo, hi) ranges."""
+    lo, hi = conn.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {table}").fetchone()
+    if lo is None:
+        return []
+    span = hi - lo + 1
+    partitions = max(1, min(partitions, span))
+    bounds = [lo + span * i // partitions for i in range(partitions + 1)]
+    return list(zip(bounds, bounds[1:]))
+
+
+_executor = None
+_executor_workers = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(workers=None):
+    """The shared process pool for scans, (re)created when the worker count changes."""
+    global _executor, _executor_workers
+    workers = workers or os.cpu_count() or 1
+    with _executor_lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(workers)
+            _executor_workers = workers
+        return _executor
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+
+atexit.register(shutdown)
+
+
+def parallel_scan(table, aggregates, where=None, params=(), database=None,
+                  workers=None, partitions=None):
+    """
+    Compute aggregates over a whole table (or the rows matching where) on
+    several cores.
+
+    The table's rowid space is cut into ranges; each worker process scans
+    its ranges through its own read-only connection and returns the partial
+    value of every aggregate, and the partials are merged here with each
+    aggregate's combine function. aggregates maps result names to Aggregate
+    objects and a dict with the same names is returned:
+
+    parallel_scan('users', {'n': count(), 'age': mean('age'),
+                            'ages': histogram('age', range(0, 101, 10))})
+
+    Only tables with a rowid can be split (not WITHOUT ROWID tables).
+    """
+    database = database or db_pool.get_setting('database')
+    workers = workers or os.cpu_count() or 1
+    partitions = partitions or workers * PARTITIONS_PER_WORKER
+    names = list(aggregates)
+    columns = [aggregates[name]._columns() for name in names]
+    query = (f"SELECT {', '.join(expr for exprs in columns for expr in exprs)} "
+             f"FROM {table} WHERE rowid >= ? AND rowid < ?")
+    if where:
+        query += f" AND ({where})"
+
+    conn = sqlite3.connect(database)
+    try:
+        # An empty table still gets one (empty) range, so COUNT comes back as 0.
+        ranges = rowid_ranges(conn, table, partitions) or [(0, 0)]
+        if len(ranges) <= 1 or workers == 1:
+            # Not worth a round trip to other processes.
+            partials = [conn.execute(query, (lo, hi, *params)).fetchone() for lo, hi in ranges]
+        else:
+            executor = get_executor(workers)
+            futures = [executor.submit(_scan_range, database, query, lo, hi, tuple(params))
+                       for lo, hi in ranges]
+            partials = [future.result() for future in futures]
+    finally:
+        conn.close()
+
+    merged = dict.fromkeys(names)
+    for row in partials:
+        offset = 0
+        for name, exprs in zip(names, columns):
+            aggregate = aggregates[name]
+            values = row[offset:offset + len(exprs)]
+            offset += len(exprs)
+            if all(v is None for v in values):
+                continue
+            value = aggregate._partial(values)
+            merged[name] = value if merged[name] is None else aggregate.combine(merged[name], value)
+
+    results = {}
+    for name in names:
+        aggregate, value = aggregates[name], merged[name]
+        if value is not None and aggregate.finish is not None:
+            value = aggregate.finish(value)
+        results[name] = value
+    return results
@@ -0,0 +1,129 @@
+import sqlite3
+import functools
+from contextlib import ExitStack
+
+import db_pool
+
+#### streaming query results: rows are fetched lazily while the connection stays checked out
+
+DEFAULT_ARRAYSIZE = 500
+
+
+class RowStream:
+    """
+    Iterator over a cursor's rows, fetched arraysize at a time.
+
+    The connection the cursor belongs to stays checked out for as long as
+    the stream is open and is released when the rows run out, when close()
+    is called (or the with block ends), when a fetch fails or when the
+    stream is garbage collected, whichever comes first.
+
+    db_pool's query_timeout applies to each fetch on its own, so time the
+    consumer spends between fetches does not count against it.
+    """
+
+    def __init__(self, cursor, release, arraysize=DEFAULT_ARRAYSIZE):
+        self.cursor = cursor
+        self.arraysize = arraysize
+        self._release = release
+        self._rows = iter(())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        for row in self._rows:
+            return row
+        if self._release is None:
+            raise StopIteration
+        rows = self._fetch()
+        if not rows:
+            raise StopIteration
+        self._rows = iter(rows)
+        return next(self._rows)
+
+    def _fetch(self):
+        # Closes the stream once the rows run out or a fetch fails.
+        try:
+            with db_pool.query_deadline(self.cursor.connection):
+                rows = self.cursor.fetchmany(self.arraysize)
+        except BaseException:
+            self.close()
+            raise
+        if not rows:
+            self.close()
+        return rows
+
+    def batches(self):
+        """Yield the remaining rows as lists of up to arraysize rows."""
+        rows = list(self._rows)
+        self._rows = iter(())
+        if rows:
+            yield rows
+        while self._release is not None:
+            rows = self._fetch()
+            if not rows:
+                return
+            yield rows
+
+    def close(self):
+        release, self._release = self._release, None
+        if release is not None:
+            try:
+                self.cursor.close()
+            finally:
+                release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        if getattr(self, '_release', None) is not None:
+            self.close()
+
+
+def open_stream(call, arraysize=DEFAULT_ARRAYSIZE, pooled=None, write=False):
+    """
+    Check out a connection and call call(conn).
+
+    If it returns a cursor, hand it back as a RowStream that owns the
+    connection; any other result is returned as is, after the connection
+    has been released.
+    """
+    stack = ExitStack()
+    conn = stack.enter_context(db_pool.connection(pooled, write=write, deadline=False))
+    try:
+        with db_pool.query_deadline(conn):
+            result = call(conn)
+    except BaseException:
+        stack.close()
+        raise
+    if isinstance(result, sqlite3.Cursor):
+        return RowStream(result, stack.close, arraysize)
+    stack.close()
+    return result
+
+
+def streaming(func=None, *, arraysize=DEFAULT_ARRAYSIZE):
+    """
+    Streaming counterpart of with_db_connection: the decorated function
+    executes its query and returns the cursor instead of fetchall(); the
+    caller gets a RowStream over the rows.
+
+    @streaming
+    def fetch_all_users(conn, query):
+        cursor = conn.cursor()
+        cursor.execute(query)
+        return cursor
+    """
+    if func is None:
+        return functools.partial(streaming, arraysize=arraysize)
+    write = db_pool.is_write_operation(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return open_stream(lambda conn: func(conn, *args, **kwargs), arraysize, write=write)
+    return wrapper
@@ -0,0 +1,207 @@
+import time
+import asyncio
+import sqlite3
+import inspect
+import functools
+import threading
+import contextvars
+from contextlib import asynccontextmanager, contextmanager
+
+#### per-statement deadlines and cancellation through SQLite's progress handler
+
+# SQLite VM instructions between two deadline checks; small enough to stop
+# within a millisecond or so, large enough to cost next to nothing.
+PROGRESS_STEPS = 1000
+
+
+class QueryTimeout(TimeoutError):
+    """A statement was interrupted because it ran past its deadline."""
+
+
+class QueryCancelled(Exception):
+    """A statement was interrupted because its limit was cancelled."""
+
+
+class StatementLimit:
+    """
+    Deadline (and cancel switch) for the statements run on one connection
+    inside a statement_timeout() block. It is installed as the connection's
+    progress handler, so SQLite polls it while a statement runs and stops
+    the statement with an "interrupted" error once it returns non-zero.
+    With a task, the statement is also stopped as soon as that task is
+    cancelled, even while it is still waiting for the statement. A default
+    limit is one applied from db_pool's query_timeout setting rather than
+    asked for explicitly.
+    """
+
+    def __init__(self, conn, deadline, task=None, default=False):
+        self.conn = conn
+        self.deadline = deadline
+        self.task = task
+        self.default = default
+        self.expired = False
+        self.cancelled = False
+        self._active = True
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        if self.cancelled:
+            return 1
+        if self.task is not None and self.task.cancelling():
+            self.cancelled = True
+            return 1
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.expired = True
+            return 1
+        return 0
+
+    def cancel(self):
+        """
+        Stop the statement running in the block, from any thread. Once the
+        block has ended this does nothing, so a late cancel() can never hit
+        a statement of whoever uses the connection next.
+        """
+        with self._lock:
+            self.cancelled = True
+            if self._active and isinstance(self.conn, sqlite3.Connection):
+                self.conn.interrupt()
+
+    def _close(self):
+        with self._lock:
+            self._active = False
+
+    def _translate(self, exc):
+        """The QueryTimeout / QueryCancelled that exc stands for, or None."""
+        if not isinstance(exc, sqlite3.OperationalError) or 'interrupted' not in str(exc):
+            return None
+        if self.expired:
+            return QueryTimeout(f"statement exceeded its deadline on {self.conn!r}")
+        if self.cancelled:
+            return QueryCancelled("statement cancelled")
+        return None
+
+
+class ProgressSlot:
+    """
+    Progress handler installed once on a pooled aiosqlite connection
+    (see install_progress_slot()); it defers to the connection's current
+    StatementLimit, so entering a limit is an attribute assignment instead
+    of a round trip to aiosqlite's thread.
+    """
+
+    __slots__ = ('limit',)
+
+    def __init__(self):
+        self.limit = None
+
+    def __call__(self):
+        limit = self.limit
+        return limit() if limit is not None else 0
+
+
+async def install_progress_slot(conn):
+    conn.progress_slot = ProgressSlot()
+    await conn.set_progress_handler(conn.progress_slot, PROGRESS_STEPS)
+
+
+_limits = contextvars.ContextVar('db_statement_limits', default={})  # id(conn) -> StatementLimit
+
+
+def _enter(conn, seconds, task=None, default=False):
+    limits = _limits.get()
+    outer = limits.get(id(conn))
+    if outer is not None and not outer._active:
+        # Left behind by a block that was closed from another context.
+        outer = None
+    deadline = time.monotonic() + seconds if seconds is not None else None
+    if outer is not None and outer.deadline is not None and not (default and outer.default):
+        # A nested block can only shorten the deadline, never extend it; only
+        # a default limit inside another default one (a retry's next attempt)
+        # starts the clock afresh.
+        deadline = outer.deadline if deadline is None else min(deadline, outer.deadline)
+    limit = StatementLimit(conn, deadline, task, default)
+    _limits.set({**limits, id(conn): limit})
+    return limit, outer, limits
+
+
+@contextmanager
+def statement_timeout(conn, seconds, default=False):
+    """
+    Interrupt any statement on conn that is still running `seconds` after
+    the block was entered (None: no deadline, cancellation only), raising
+    QueryTimeout. Yields the StatementLimit, whose cancel() stops the
+    running statement with QueryCancelled.
+    """
+    limit, outer, limits = _enter(conn, seconds, default=default)
+    conn.set_progress_handler(limit, PROGRESS_STEPS)
+    try:
+        yield limit
+    except sqlite3.OperationalError as e:
+        translated = limit._translate(e)
+        if translated is None:
+            raise
+        raise translated from e
+    finally:
+        limit._close()
+        _limits.set(limits)
+        conn.set_progress_handler(outer, PROGRESS_STEPS if outer is not None else 0)
+
+
+@asynccontextmanager
+async def async_statement_timeout(conn, seconds):
+    """
+    statement_timeout() for an aiosqlite connection. If the task is
+    cancelled while a statement runs, the statement is interrupted as well
+    instead of running on in aiosqlite's thread (and holding up everything
+    queued behind it on that connection, such as closing its cursor).
+    """
+    limit, outer, limits = _enter(conn, seconds, asyncio.current_task())
+    slot = getattr(conn, 'progress_slot', None)
+    if slot is not None:
+        slot.limit = limit
+    else:
+        await conn.set_progress_handler(limit, PROGRESS_STEPS)
+    try:
+        yield limit
+    except sqlite3.OperationalError as e:
+        translated = limit._translate(e)
+        if translated is None:
+            raise
+        raise translated from e
+    except asyncio.CancelledError:
+        # The statement would otherwise keep running on aiosqlite's thread.
+        limit.cancelled = True
+        await conn.interrupt()
+        if slot is not None:
+            # Queued behind the statement, so this returns once it has stopped
+            # and the slot can no longer be handed to the next borrower too early.
+            await conn.set_progress_handler(slot, PROGRESS_STEPS)
+        raise
+    finally:
+        limit._close()
+        _limits.set(limits)
+        if slot is not None:
+            slot.limit = outer
+        else:
+            await conn.set_progress_handler(outer, PROGRESS_STEPS if outer is not None else 0)
+
+
+def with_timeout(seconds):
+    """
+    Give each call of a func(conn, ...) a statement deadline of `seconds`.
+    Works for plain functions on sqlite3 connections and for coroutine
+    functions on aiosqlite ones; place it under with_db_connection.
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(conn, *args, **kwargs):
+                async with async_statement_timeout(conn, seconds):
+                    return await func(conn, *args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapper(conn, *args, **kwargs):
+                with statement_timeout(conn, seconds):
+                    return func(conn, *args, **kwargs)
+        return wrapper
+    return decorator
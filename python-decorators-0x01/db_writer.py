@@ -0,0 +1,191 @@
+import time
+import queue
+import atexit
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+import db_pool
+import db_metrics
+
+#### single writer thread that applies queued mutations in group-committed batches
+
+
+class WriterClosed(Exception):
+    """Raised when a write is submitted to a writer that has been closed."""
+
+
+class WriteQueue:
+    """
+    Serialises writes through one dedicated thread.
+
+    By default each batch is written on a connection checked out with
+    db_pool.connection(write=True), so with read_write_split the queue
+    shares the single writer connection with transactional functions
+    instead of being a second writer. Given a database, the thread opens
+    and keeps its own connection to it instead.
+
+    submit() queues func(conn, *args, **kwargs) and returns a Future. The
+    writer takes up to max_batch queued mutations, waiting at most max_wait
+    seconds for the batch to fill, and runs them inside one transaction so
+    the whole batch pays for a single commit. Each mutation runs under its
+    own SAVEPOINT: if it raises, only its changes are rolled back and only
+    its future fails. Futures resolve after the batch has committed.
+    Mutations must not commit or roll back the connection themselves.
+
+    If the writer thread itself dies (a mutation raising KeyboardInterrupt
+    or SystemExit, or its connection failing to open), the queue is closed
+    and every write still waiting fails with WriterClosed instead of
+    hanging.
+    """
+
+    def __init__(self, database=None, max_batch=100, max_wait=0.002):
+        self.database = database
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.writes = 0
+        self._queue = queue.SimpleQueue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise WriterClosed("write queue is closed")
+            self._queue.put((future, func, args, kwargs))
+        return future
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Finish this batch first; the sentinel is seen on the next call.
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        batch = []
+        try:
+            own = db_pool.connect(self.database, isolation_level=None) if self.database else None
+            try:
+                while True:
+                    batch = self._next_batch()
+                    if batch is None:
+                        return
+                    if own is not None:
+                        try:
+                            self._apply(own, batch)
+                        finally:
+                            db_pool.notify_released(own)
+                        continue
+                    try:
+                        with db_pool.connection(write=True) as conn:
+                            self._apply(conn, batch)
+                    except Exception as e:
+                        # No connection to write with (e.g. PoolTimeout): fail this batch only.
+                        for future, _, _, _ in batch:
+                            if not future.done():
+                                future.set_exception(e)
+            finally:
+                if own is not None:
+                    db_metrics.connections_closed.inc()
+                    own.close()
+        except BaseException as e:
+            # The thread ends here; the error reaches callers through their futures.
+            self._abort(batch, e)
+
+    def _abort(self, batch, exc):
+        # The thread is going away, so nothing queued or in flight would ever be written.
+        with self._lock:
+            self._closed = True
+        pending = list(batch or ())
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                pending.append(item)
+        for future, _, _, _ in pending:
+            if not future.done():
+                error = WriterClosed(f"writer thread stopped: {exc!r}")
+                error.__cause__ = exc
+                future.set_exception(error)
+
+    def _apply(self, conn, batch):
+        batch = [item for item in batch if item[0].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            with db_pool.transaction_scope(conn):
+                for future, func, args, kwargs in batch:
+                    conn.execute("SAVEPOINT write_item")
+                    try:
+                        results.append((future, func(conn, *args, **kwargs), None))
+                        conn.execute("RELEASE write_item")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO write_item")
+                        conn.execute("RELEASE write_item")
+                        results.append((future, None, e))
+            conn.execute("COMMIT")
+        except BaseException as e:
+            if conn.in_transaction:
+                try:
+                    conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+            for future, _, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                # KeyboardInterrupt / SystemExit: stop the writer (see _run).
+                raise
+            return
+        self.batches += 1
+        self.writes += len(batch)
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def close(self):
+        """Stop accepting writes, finish everything already queued and stop the thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Return the process-wide write queue, starting its thread on first use."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = WriteQueue()
+                atexit.register(_writer.close)
+    return _writer
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""Shared fixture for the db_* unit tests: a fresh database file per test
+"""
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import db_pool
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """
+    Creates a temporary database with the tables in SCHEMA before every
+    test and makes it db_pool's default database; removes it afterwards.
+    """
+
+    SCHEMA = "CREATE TABLE items (id INTEGER PRIMARY KEY, value TEXT);"
+
+    def setUp(self):
+        fd, self.database = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        conn = sqlite3.connect(self.database)
+        conn.executescript(self.SCHEMA)
+        conn.close()
+        db_pool.configure(database=self.database)
+
+    def tearDown(self):
+        db_pool.get_pool().close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.database + suffix):
+                os.remove(self.database + suffix)
+
+    def query(self, sql, params=()):
+        """Committed rows, as seen from a separate connection."""
+        conn = sqlite3.connect(self.database)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def values(self):
+        """Committed values of the items table, sorted."""
+        return sorted(row[0] for row in self.query("SELECT value FROM items"))
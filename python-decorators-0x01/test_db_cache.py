@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""Unit tests for db_cache.QueryCache: invalidation by table, by writes
+made through db_pool and by commits from other connections, and
+single-flight loading of concurrent misses
+"""
+import asyncio
+import sqlite3
+import threading
+import time
+import unittest
+
+import db_pool
+import db_cache
+from db_cache import QueryCache
+from fixtures import DatabaseTestCase
+
+USERS = "SELECT name FROM users"
+ORDERS = "SELECT item FROM orders"
+TABLES = frozenset(('users',))
+
+
+class CacheTestCase(DatabaseTestCase):
+    """Adds users and orders tables and a registered cache for every test."""
+
+    SCHEMA = """
+        CREATE TABLE users (name TEXT);
+        CREATE TABLE orders (item TEXT);
+        INSERT INTO users VALUES ('alice');
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.cache = db_cache.register(QueryCache(maxsize=16, ttl=None, version_check_interval=60))
+
+    def tearDown(self):
+        db_cache._caches.remove(self.cache)
+        if self.cache._watch is not None:
+            self.cache._watch.close()
+        super().tearDown()
+
+    def load(self, query):
+        """get_or_load that reads the database, returning all rows."""
+        def loader():
+            with db_pool.connection() as conn:
+                return conn.execute(query).fetchall()
+        return self.cache.get_or_load(query, (), loader)
+
+    def cached(self, query):
+        return self.cache.get(QueryCache.make_key(query))[0]
+
+
+class TestTableTracking(unittest.TestCase):
+    """Which tables a statement reads or writes."""
+
+    def test_read_tables(self):
+        """Every table named after FROM or JOIN is a dependency."""
+        self.assertEqual(
+            db_cache.read_tables("SELECT * FROM users u JOIN orders o ON o.user = u.id"),
+            frozenset(('users', 'orders')))
+
+    def test_written_tables(self):
+        """Writes name their table; reads are None; unknown writes hit every table."""
+        self.assertEqual(db_cache.written_tables("INSERT INTO Users VALUES (1)"),
+                         frozenset(('users',)))
+        self.assertEqual(db_cache.written_tables("UPDATE orders SET item = 1"),
+                         frozenset(('orders',)))
+        self.assertIsNone(db_cache.written_tables(USERS))
+        self.assertEqual(db_cache.written_tables("WITH x AS (SELECT 1) DELETE FROM users"),
+                         frozenset((db_cache.ANY_TABLE,)))
+
+
+class TestInvalidate(CacheTestCase):
+    """invalidate() and writes through db_pool drop the entries they affect."""
+
+    def test_invalidate_drops_only_that_table(self):
+        """Entries reading other tables stay cached."""
+        self.load(USERS)
+        self.load(ORDERS)
+        self.cache.invalidate(frozenset(('users',)))
+        self.assertFalse(self.cached(USERS))
+        self.assertTrue(self.cached(ORDERS))
+
+    def test_invalidate_any_table_clears_everything(self):
+        """ANY_TABLE drops every entry."""
+        self.load(USERS)
+        self.load(ORDERS)
+        self.cache.invalidate(frozenset((db_cache.ANY_TABLE,)))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_committed_write_invalidates(self):
+        """A write committed on a pooled connection drops the entries of its table."""
+        self.assertEqual(self.load(USERS), [('alice',)])
+        with db_pool.connection() as conn:
+            with db_pool.transaction(conn):
+                conn.execute("INSERT INTO users VALUES ('bob')")
+            # Dropped at COMMIT already, not only once the connection is returned.
+            self.assertFalse(self.cached(USERS))
+        self.assertEqual(self.load(USERS), [('alice',), ('bob',)])
+
+    def test_pooled_write_keeps_other_tables(self):
+        """Our own commit is not taken for another process's: other tables stay cached."""
+        self.load(USERS)
+        self.load(ORDERS)
+        with db_pool.connection() as conn:
+            with db_pool.transaction(conn):
+                conn.execute("INSERT INTO users VALUES ('bob')")
+        self.assertFalse(self.cached(USERS))
+        self.assertTrue(self.cached(ORDERS))
+        self.cache.version_check_interval = 0
+        self.assertTrue(self.cached(ORDERS))
+
+    def test_unpooled_write_keeps_other_tables(self):
+        """The same holds for connections opened and closed per call."""
+        db_pool.configure(pooled=False)
+        try:
+            self.load(USERS)
+            self.load(ORDERS)
+            with db_pool.connection() as conn:
+                with db_pool.transaction(conn):
+                    conn.execute("INSERT INTO users VALUES ('bob')")
+            self.assertFalse(self.cached(USERS))
+            self.assertTrue(self.cached(ORDERS))
+        finally:
+            db_pool.configure(pooled=True)
+
+    def test_rolled_back_write_keeps_entries(self):
+        """A transaction that rolls back invalidates nothing."""
+        self.load(USERS)
+        with db_pool.connection() as conn:
+            with self.assertRaises(ValueError):
+                with db_pool.transaction(conn):
+                    conn.execute("INSERT INTO users VALUES ('bob')")
+                    raise ValueError
+        self.assertTrue(self.cached(USERS))
+        self.assertEqual(self.load(USERS), [('alice',)])
+
+    def test_write_during_load_is_not_cached(self):
+        """A result loaded while its table was written may be stale and is not stored."""
+        def loader():
+            rows = [('alice',)]
+            with db_pool.connection() as conn:
+                with db_pool.transaction(conn):
+                    conn.execute("INSERT INTO users VALUES ('bob')")
+            return rows
+        self.assertEqual(self.cache.get_or_load(USERS, (), loader), [('alice',)])
+        self.assertFalse(self.cached(USERS))
+        self.assertEqual(self.load(USERS), [('alice',), ('bob',)])
+
+
+class TestDataVersion(CacheTestCase):
+    """Commits made outside db_pool are found through PRAGMA data_version."""
+
+    def commit_elsewhere(self):
+        conn = sqlite3.connect(self.database)
+        try:
+            conn.execute("INSERT INTO orders VALUES ('book')")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def test_foreign_commit_clears_cache(self):
+        """Once the check interval has passed, another connection's commit clears everything."""
+        self.cache.version_check_interval = 0
+        self.load(USERS)
+        self.commit_elsewhere()
+        self.assertFalse(self.cached(USERS))
+
+    def test_foreign_commit_unseen_within_interval(self):
+        """Between checks, the cache keeps serving what it has."""
+        self.load(USERS)
+        self.commit_elsewhere()
+        self.assertTrue(self.cached(USERS))
+
+    def test_foreign_commit_not_hidden_by_own_write(self):
+        """A foreign commit landing before our own is not mistaken for it."""
+        self.load(USERS)
+        self.load(ORDERS)
+        with db_pool.connection() as conn:
+            self.commit_elsewhere()
+            with db_pool.transaction(conn):
+                conn.execute("INSERT INTO users VALUES ('bob')")
+        self.assertFalse(self.cached(ORDERS))
+        self.assertEqual(self.load(ORDERS), [('book',)])
+
+
+class TestStorage(CacheTestCase):
+    """How results are kept: compressed or not, within the byte budget."""
+
+    def test_unpicklable_result_is_cached_uncompressed(self):
+        """A result that cannot be compressed still returns, and is kept as it is."""
+        cache = QueryCache(maxsize=16, ttl=None, compress_threshold=100)
+
+        def loader():
+            with db_pool.connection() as conn:
+                conn.row_factory = sqlite3.Row
+                try:
+                    return conn.execute(USERS).fetchall() * 50
+                finally:
+                    conn.row_factory = None
+        rows = cache.get_or_load(USERS, (), loader)
+        self.assertEqual(rows[0]['name'], 'alice')
+        hit, value = cache.get(QueryCache.make_key(USERS))
+        self.assertTrue(hit)
+        self.assertIs(value, rows)
+
+    def test_byte_budget_evicts_least_recently_used(self):
+        """Entries are evicted oldest first until the stored bytes fit max_bytes."""
+        value = list(range(100))
+        size = db_cache.estimate_size(value)
+        cache = QueryCache(maxsize=None, ttl=None, max_bytes=size * 2 + size // 2)
+        keys = [QueryCache.make_key(USERS, (i,)) for i in range(3)]
+        for key in keys[:2]:
+            cache.put(key, value, TABLES)
+        cache.get(keys[0])
+        cache.put(keys[2], value, TABLES)
+        self.assertEqual([key in cache for key in keys], [True, False, True])
+        self.assertLessEqual(cache.bytes, cache.max_bytes)
+
+    def test_result_over_budget_is_rejected(self):
+        """A result larger than the whole budget is not stored and evicts nothing."""
+        cache = QueryCache(maxsize=None, ttl=None, max_bytes=1000)
+        small = QueryCache.make_key(USERS, (1,))
+        cache.put(small, [1], TABLES)
+        self.assertFalse(cache.put(QueryCache.make_key(USERS, (2,)), list(range(1000)), TABLES))
+        self.assertIn(small, cache)
+        self.assertEqual(cache.stats()['rejected'], 1)
+
+    def test_compressed_round_trip(self):
+        """A large result is stored compressed and read back equal."""
+        value = [(i, 'user%d' % (i % 10)) for i in range(2000)]
+        cache = QueryCache(maxsize=16, ttl=None, compress_threshold=1000)
+        key = QueryCache.make_key(USERS)
+        cache.put(key, value, TABLES)
+        self.assertLess(cache.bytes, db_cache.estimate_size(value) // 4)
+        hit, stored = cache.get(key)
+        self.assertTrue(hit)
+        self.assertEqual(stored, value)
+        self.assertIsNot(stored, value)
+
+    def test_small_result_is_not_compressed(self):
+        """Results under compress_threshold are kept as they are."""
+        value = [(1, 'alice')]
+        cache = QueryCache(maxsize=16, ttl=None, compress_threshold=100000)
+        key = QueryCache.make_key(USERS)
+        cache.put(key, value, TABLES)
+        self.assertIs(cache.get(key)[1], value)
+
+
+class TestCostAware(CacheTestCase):
+    """policy='gdsf' keeps what is expensive to recompute; min_cost skips cheap results."""
+
+    def put(self, cache, i, cost):
+        key = QueryCache.make_key(USERS, (i,))
+        cache.put(key, [i], TABLES, cost=cost)
+        return key
+
+    def test_cheapest_entry_is_evicted_first(self):
+        """The entry with the lowest hits * cost / size goes, not the oldest."""
+        cache = QueryCache(maxsize=2, ttl=None, policy='gdsf')
+        expensive = self.put(cache, 1, cost=1.0)
+        cheap = self.put(cache, 2, cost=0.001)
+        newest = self.put(cache, 3, cost=0.5)
+        self.assertIn(expensive, cache)
+        self.assertNotIn(cheap, cache)
+        self.assertIn(newest, cache)
+
+    def test_hits_raise_priority(self):
+        """A cheap entry that is read often outlives an unused dearer one."""
+        cache = QueryCache(maxsize=2, ttl=None, policy='gdsf')
+        popular = self.put(cache, 1, cost=0.01)
+        unused = self.put(cache, 2, cost=0.02)
+        for _ in range(10):
+            cache.get(popular)
+        self.put(cache, 3, cost=0.05)
+        self.assertIn(popular, cache)
+        self.assertNotIn(unused, cache)
+
+    def test_unused_entries_age_out(self):
+        """Evictions raise the floor, so a once-expensive entry left unread goes eventually."""
+        cache = QueryCache(maxsize=2, ttl=None, policy='gdsf')
+        old = self.put(cache, 0, cost=0.1)
+        for i in range(1, 50):
+            key = self.put(cache, i, cost=0.01)
+            cache.get(key)
+        self.assertNotIn(old, cache)
+
+    def test_min_cost_rejects_fast_results(self):
+        """Results whose query ran faster than min_cost are not cached."""
+        cache = QueryCache(maxsize=16, ttl=None, min_cost=0.01)
+        fast = self.put(cache, 1, cost=0.001)
+        slow = self.put(cache, 2, cost=0.1)
+        unknown = self.put(cache, 3, cost=None)
+        self.assertNotIn(fast, cache)
+        self.assertIn(slow, cache)
+        self.assertIn(unknown, cache)
+        self.assertEqual(cache.stats()['rejected'], 1)
+
+    def test_min_cost_through_get_or_load(self):
+        """get_or_load times the loader and only keeps slow enough results."""
+        cache = QueryCache(maxsize=16, ttl=None, min_cost=0.05)
+        cache.get_or_load(USERS, (1,), lambda: [1])
+
+        def slow():
+            time.sleep(0.06)
+            return [2]
+        cache.get_or_load(USERS, (2,), slow)
+        self.assertNotIn(QueryCache.make_key(USERS, (1,)), cache)
+        self.assertIn(QueryCache.make_key(USERS, (2,)), cache)
+
+
+class TestSingleFlight(CacheTestCase):
+    """Concurrent misses on one key run the loader once."""
+
+    def run_concurrently(self, query, loader, threads=8):
+        """
+        Call get_or_load from several threads while the first loader call
+        is held; return what each call returned or raised.
+        """
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def held():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return loader()
+        outcomes = [None] * threads
+
+        def worker(i):
+            try:
+                outcomes[i] = self.cache.get_or_load(query, (), held)
+            except Exception as e:
+                outcomes[i] = e
+        workers = [threading.Thread(target=worker, args=(0,))]
+        workers[0].start()
+        self.assertTrue(started.wait(5))
+        for i in range(1, threads):
+            workers.append(threading.Thread(target=worker, args=(i,)))
+            workers[-1].start()
+        # Let the waiters reach the in-flight load before it finishes.
+        while self.cache.stats()['coalesced'] < threads - 1:
+            time.sleep(0.001)
+        release.set()
+        for thread in workers:
+            thread.join(5)
+        return len(calls), outcomes
+
+    def test_concurrent_misses_load_once(self):
+        """Every caller gets the one result; only the first counts as a miss."""
+        calls, outcomes = self.run_concurrently(USERS, lambda: [('alice',)])
+        self.assertEqual(calls, 1)
+        self.assertEqual(outcomes, [[('alice',)]] * 8)
+        stats = self.cache.stats()
+        self.assertEqual((stats['misses'], stats['coalesced']), (1, 7))
+        self.assertTrue(self.cached(USERS))
+
+    def test_loader_error_reaches_every_waiter(self):
+        """A failing load is raised in every caller and leaves nothing cached."""
+        error = ValueError('boom')
+
+        def loader():
+            raise error
+        calls, outcomes = self.run_concurrently(USERS, loader)
+        self.assertEqual(calls, 1)
+        self.assertTrue(all(outcome is error for outcome in outcomes))
+        self.assertFalse(self.cached(USERS))
+        self.assertEqual(self.load(USERS), [('alice',)])
+
+    def test_different_keys_load_separately(self):
+        """Another key is not held up by an in-flight load."""
+        release = threading.Event()
+
+        def slow():
+            release.wait(5)
+            return 'slow'
+        thread = threading.Thread(target=self.cache.get_or_load, args=(USERS, (), slow))
+        thread.start()
+        try:
+            self.assertEqual(self.cache.get_or_load(ORDERS, (), lambda: 'fast'), 'fast')
+        finally:
+            release.set()
+            thread.join(5)
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+
+
+class TestSingleFlightAsync(CacheTestCase):
+    """get_or_load_async: one load per key, shared by every awaiting task."""
+
+    def test_cancelled_leader_does_not_cancel_waiters(self):
+        """The first caller timing out leaves the load running for the others."""
+        release = asyncio.Event()
+        calls = []
+
+        async def loader():
+            calls.append(1)
+            await release.wait()
+            return [('alice',)]
+
+        async def main():
+            leader = asyncio.create_task(self.cache.get_or_load_async(USERS, (), loader))
+            await asyncio.sleep(0)
+            waiter = asyncio.create_task(self.cache.get_or_load_async(USERS, (), loader))
+            await asyncio.sleep(0)
+            leader.cancel()
+            await asyncio.sleep(0)
+            release.set()
+            return leader, await waiter
+        leader, value = asyncio.run(main())
+        self.assertTrue(leader.cancelled())
+        self.assertEqual(value, [('alice',)])
+        self.assertEqual(calls, [1])
+        self.assertTrue(self.cached(USERS))
+
+    def test_loader_error_reaches_every_task(self):
+        """A failing load is raised in every awaiting task."""
+        async def loader():
+            await asyncio.sleep(0.01)
+            raise ValueError('boom')
+
+        async def main():
+            return await asyncio.gather(
+                *(self.cache.get_or_load_async(USERS, (), loader) for _ in range(3)),
+                return_exceptions=True)
+        outcomes = asyncio.run(main())
+        self.assertTrue(all(isinstance(outcome, ValueError) for outcome in outcomes))
+        self.assertEqual(self.cache.stats()['coalesced'], 2)
+        self.assertFalse(self.cached(USERS))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""Unit tests for db_pool: ConnectionPool checkouts, limits and discards,
+and transaction(), whose nested blocks become savepoints
+"""
+import threading
+import time
+import unittest
+
+import db_pool
+from db_pool import ConnectionPool, PoolTimeout
+from fixtures import DatabaseTestCase
+
+
+class TestConnectionPool(DatabaseTestCase):
+    """Checkout limits, reuse and discarding of pooled connections."""
+
+    def pool(self, **options):
+        pool = ConnectionPool(self.database, **options)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_reuses_released_connection(self):
+        """A released connection is handed out again instead of a new one."""
+        pool = self.pool(max_size=2)
+        conn = pool.acquire()
+        pool.release(conn)
+        self.assertIs(pool.acquire(), conn)
+        self.assertEqual(pool.size, 1)
+
+    def test_max_size_blocks_until_release(self):
+        """Past max_size, acquire() waits for a connection to come back."""
+        pool = self.pool(max_size=1)
+        conn = pool.acquire()
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(pool.acquire(timeout=5)))
+        waiter.start()
+        time.sleep(0.05)
+        self.assertEqual(got, [])
+        pool.release(conn)
+        waiter.join(5)
+        self.assertEqual(got, [conn])
+        self.assertEqual(pool.size, 1)
+
+    def test_pool_timeout(self):
+        """acquire() gives up with PoolTimeout when nothing is released in time."""
+        pool = self.pool(max_size=1)
+        pool.acquire()
+        start = time.monotonic()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(timeout=0.05)
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_max_idle_discards_stale_connection(self):
+        """A connection idle for longer than max_idle is closed, not reused."""
+        pool = self.pool(max_size=1, max_idle=0.01)
+        conn = pool.acquire()
+        pool.release(conn)
+        time.sleep(0.02)
+        fresh = pool.acquire()
+        self.assertIsNot(fresh, conn)
+        self.assertEqual(pool.size, 1)
+
+    def test_unhealthy_connection_is_discarded(self):
+        """A connection that fails its health check is replaced."""
+        pool = self.pool(max_size=1, ping_after=0)
+        conn = pool.acquire()
+        pool.release(conn)
+        conn.close()
+        time.sleep(0.01)
+        fresh = pool.acquire()
+        self.assertIsNot(fresh, conn)
+        self.assertEqual(fresh.execute("SELECT 1").fetchone(), (1,))
+        self.assertEqual(pool.size, 1)
+
+    def test_release_rolls_back_open_transaction(self):
+        """Uncommitted work is rolled back when the connection is returned."""
+        pool = self.pool(max_size=1)
+        conn = pool.acquire()
+        conn.execute("INSERT INTO items (value) VALUES ('lost')")
+        self.assertTrue(conn.in_transaction)
+        pool.release(conn)
+        self.assertFalse(conn.in_transaction)
+        self.assertEqual(self.values(), [])
+
+    def test_closed_pool_refuses_checkouts(self):
+        """After close(), acquire() raises PoolTimeout at once."""
+        pool = self.pool()
+        pool.close()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+
+
+class TestTransactionNesting(DatabaseTestCase):
+    """Commits and rollbacks of nested transaction() blocks."""
+
+    @staticmethod
+    def insert(conn, value):
+        conn.execute("INSERT INTO items (value) VALUES (?)", (value,))
+
+    def test_outer_commit(self):
+        """A single block commits on success."""
+        with db_pool.connection() as conn:
+            with db_pool.transaction(conn):
+                self.insert(conn, 'a')
+        self.assertEqual(self.values(), ['a'])
+
+    def test_outer_rollback(self):
+        """A single block rolls back when it raises."""
+        with db_pool.connection() as conn:
+            with self.assertRaises(ValueError):
+                with db_pool.transaction(conn):
+                    self.insert(conn, 'a')
+                    raise ValueError
+        self.assertEqual(self.values(), [])
+
+    def test_inner_failure_rolls_back_only_the_savepoint(self):
+        """A failing nested block undoes its own writes; the outer one still commits."""
+        with db_pool.connection() as conn:
+            with db_pool.transaction(conn):
+                self.insert(conn, 'outer')
+                with self.assertRaises(ValueError):
+                    with db_pool.transaction(conn):
+                        self.insert(conn, 'inner')
+                        raise ValueError
+                self.insert(conn, 'after')
+        self.assertEqual(self.values(), ['after', 'outer'])
+
+    def test_inner_success_waits_for_outer_commit(self):
+        """A nested block that succeeds is not committed before the outer block."""
+        with db_pool.connection() as conn:
+            with db_pool.transaction(conn):
+                with db_pool.transaction(conn):
+                    self.insert(conn, 'inner')
+                self.assertEqual(self.values(), [])
+        self.assertEqual(self.values(), ['inner'])
+
+    def test_outer_failure_discards_released_savepoints(self):
+        """When the outer block fails, writes of nested blocks that succeeded go too."""
+        with db_pool.connection() as conn:
+            with self.assertRaises(ValueError):
+                with db_pool.transaction(conn):
+                    with db_pool.transaction(conn):
+                        self.insert(conn, 'inner')
+                    raise ValueError
+        self.assertEqual(self.values(), [])
+
+    def test_three_levels(self):
+        """Savepoints nest to any depth; only the failing level is undone."""
+        with db_pool.connection() as conn:
+            with db_pool.transaction(conn):
+                self.insert(conn, '1')
+                with db_pool.transaction(conn):
+                    self.insert(conn, '2')
+                    with self.assertRaises(ValueError):
+                        with db_pool.transaction(conn):
+                            self.insert(conn, '3')
+                            raise ValueError
+        self.assertEqual(self.values(), ['1', '2'])
+
+    def test_nested_connection_reuses_transaction(self):
+        """connection() inside a transaction yields the transaction's connection."""
+        with db_pool.connection() as conn:
+            with db_pool.transaction(conn):
+                with db_pool.connection() as nested:
+                    self.assertIs(nested, conn)
+                self.assertIs(db_pool.current_transaction(), conn)
+            self.assertIsNone(db_pool.current_transaction())
+
+
+if __name__ == '__main__':
+    unittest.main()
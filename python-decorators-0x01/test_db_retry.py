@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Unit tests for db_retry: which errors are retried, backoff bounds and the
+retry deadline
+"""
+import sqlite3
+import unittest
+from unittest.mock import patch
+
+import db_async
+from db_operation import db_operation
+from db_pool import PoolTimeout
+from db_retry import (RetryStats, backoff_delay, call_with_retry, is_retryable,
+                      is_retryable_or_timeout)
+from db_timeout import QueryTimeout
+
+
+class TestIsRetryable(unittest.TestCase):
+    """Lock contention and pool exhaustion are retried; nothing else is."""
+
+    def test_transient_errors(self):
+        """Locked or busy databases and an exhausted pool may succeed later."""
+        for exc in (sqlite3.OperationalError("database is locked"),
+                    sqlite3.OperationalError("database table is locked"),
+                    sqlite3.OperationalError("Database is busy"),
+                    PoolTimeout("no connection")):
+            self.assertTrue(is_retryable(exc), exc)
+
+    def test_permanent_errors(self):
+        """Programming errors, constraints and missing tables fail at once."""
+        for exc in (sqlite3.OperationalError("no such table: users"),
+                    sqlite3.IntegrityError("UNIQUE constraint failed: users.id"),
+                    sqlite3.ProgrammingError("Cannot operate on a closed database."),
+                    ValueError("bad value")):
+            self.assertFalse(is_retryable(exc), exc)
+
+    def test_timeouts_only_when_asked(self):
+        """QueryTimeout is retried by is_retryable_or_timeout only."""
+        exc = QueryTimeout("statement exceeded its deadline")
+        self.assertFalse(is_retryable(exc))
+        self.assertTrue(is_retryable_or_timeout(exc))
+        self.assertTrue(is_retryable_or_timeout(sqlite3.OperationalError("database is locked")))
+
+
+class TestBackoff(unittest.TestCase):
+    """Full jitter: uniform between 0 and the capped exponential step."""
+
+    def test_bounds(self):
+        """Every delay lies in [0, min(max_delay, base * 2**attempt)]."""
+        for attempt in range(10):
+            cap = min(5.0, 0.1 * 2 ** attempt)
+            for _ in range(100):
+                self.assertTrue(0 <= backoff_delay(attempt, 0.1, 5.0) <= cap)
+
+    def test_draws_over_full_range(self):
+        """The draw spans the whole range, so competing callers spread out."""
+        with patch('db_retry.random.uniform', return_value=0.0) as uniform:
+            backoff_delay(3, 0.1, 5.0)
+            uniform.assert_called_once_with(0, 0.8)
+            backoff_delay(10, 0.1, 5.0)
+            uniform.assert_called_with(0, 5.0)
+
+
+class TestCallWithRetry(unittest.TestCase):
+    """Attempts, give-up rules and counters of call_with_retry()."""
+
+    def call(self, func, retries=3, delay=0.1, max_delay=1.0, deadline=None):
+        self.stats = RetryStats()
+        with patch('db_retry.time.sleep') as sleep, \
+                patch('db_retry.random.uniform', side_effect=lambda low, high: high):
+            try:
+                return call_with_retry(func, (), {}, retries, delay, max_delay, deadline,
+                                       is_retryable, self.stats)
+            finally:
+                self.sleeps = [c.args[0] for c in sleep.call_args_list]
+
+    def failing(self, errors, result='ok'):
+        """A function raising each of errors in turn, then returning result."""
+        errors = list(errors)
+        self.attempts = 0
+
+        def func():
+            self.attempts += 1
+            if errors:
+                raise errors.pop(0)
+            return result
+        return func
+
+    def test_succeeds_after_transient_errors(self):
+        """Retryable errors are retried with growing sleeps until a call succeeds."""
+        locked = sqlite3.OperationalError("database is locked")
+        self.assertEqual(self.call(self.failing([locked, locked])), 'ok')
+        self.assertEqual(self.attempts, 3)
+        self.assertEqual(self.sleeps, [0.1, 0.2])
+        self.assertEqual(self.stats.snapshot()['retries'], 2)
+
+    def test_gives_up_after_retries_attempts(self):
+        """The last error is raised once `retries` attempts have failed."""
+        locked = sqlite3.OperationalError("database is locked")
+        with self.assertRaises(sqlite3.OperationalError):
+            self.call(self.failing([locked] * 5), retries=3)
+        self.assertEqual(self.attempts, 3)
+        self.assertEqual(self.stats.snapshot()['failures'], 1)
+
+    def test_permanent_error_is_not_retried(self):
+        """A non-retryable error is raised from the first attempt."""
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.call(self.failing([sqlite3.IntegrityError("UNIQUE constraint failed")]))
+        self.assertEqual(self.attempts, 1)
+        self.assertEqual(self.sleeps, [])
+        self.assertEqual(self.stats.snapshot()['not_retryable'], 1)
+
+    def test_deadline_stops_retries(self):
+        """No retry starts whose sleep would end past the deadline."""
+        locked = sqlite3.OperationalError("database is locked")
+        with self.assertRaises(sqlite3.OperationalError):
+            self.call(self.failing([locked] * 5), retries=5, delay=0.1, deadline=0.15)
+        self.assertEqual(self.sleeps, [0.1])
+        self.assertEqual(self.attempts, 2)
+        self.assertEqual(self.stats.snapshot()['deadline_exceeded'], 1)
+
+    def test_retries_below_one_rejected(self):
+        """Retry decorators refuse to be set up to never call the function."""
+        with self.assertRaises(ValueError):
+            db_operation(lambda conn, query: None, retries=0)
+        with self.assertRaises(ValueError):
+            db_async.retry_on_failure(retries=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Unit tests for db_timeout: statement deadlines, how nested limits combine,
+cancellation, and the per-attempt budget of the retry helpers
+"""
+import sqlite3
+import threading
+import time
+import unittest
+
+import db_pool
+from db_retry import RetryStats, call_with_retry
+from db_timeout import QueryCancelled, QueryTimeout, statement_timeout
+from fixtures import DatabaseTestCase
+
+# Counts to ? one row at a time: about half a second per million on a laptop.
+COUNT_TO = ("WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < ?) "
+            "SELECT count(*) FROM c")
+RUNAWAY = 100000000
+
+
+class TimeoutTestCase(unittest.TestCase):
+    """An in-memory connection per test."""
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:', check_same_thread=False)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def count_to(self, n):
+        return self.conn.execute(COUNT_TO, (n,)).fetchone()[0]
+
+
+class TestStatementTimeout(TimeoutTestCase):
+    """statement_timeout() stops statements and says why."""
+
+    def test_runaway_statement_raises_query_timeout(self):
+        """A statement still running at the deadline stops with QueryTimeout."""
+        start = time.monotonic()
+        with self.assertRaises(QueryTimeout) as caught:
+            with statement_timeout(self.conn, 0.05):
+                self.count_to(RUNAWAY)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertIsInstance(caught.exception.__cause__, sqlite3.OperationalError)
+
+    def test_fast_statement_is_untouched(self):
+        """Statements that finish in time return normally."""
+        with statement_timeout(self.conn, 5) as limit:
+            self.assertEqual(self.count_to(10000), 10000)
+        self.assertFalse(limit.expired)
+
+    def test_other_errors_are_not_translated(self):
+        """Only interruptions are turned into QueryTimeout / QueryCancelled."""
+        with self.assertRaises(sqlite3.OperationalError) as caught:
+            with statement_timeout(self.conn, 5):
+                self.conn.execute("SELECT * FROM missing")
+        self.assertNotIsInstance(caught.exception, (QueryTimeout, QueryCancelled))
+
+    def test_handler_removed_after_block(self):
+        """Once the block ends, statements run without a deadline again."""
+        with statement_timeout(self.conn, 0.01):
+            pass
+        time.sleep(0.02)
+        self.assertEqual(self.count_to(100000), 100000)
+
+
+class TestNestedLimits(TimeoutTestCase):
+    """A nested block can only shorten the deadline, except default-in-default."""
+
+    def test_explicit_inner_cannot_extend(self):
+        """A longer explicit limit inside keeps the outer deadline."""
+        with self.assertRaises(QueryTimeout):
+            with statement_timeout(self.conn, 0.05) as outer:
+                with statement_timeout(self.conn, 10) as inner:
+                    self.assertEqual(inner.deadline, outer.deadline)
+                    self.count_to(RUNAWAY)
+
+    def test_explicit_inner_can_shorten(self):
+        """A shorter explicit limit inside wins."""
+        with statement_timeout(self.conn, 10) as outer:
+            with self.assertRaises(QueryTimeout):
+                with statement_timeout(self.conn, 0.05) as inner:
+                    self.assertLess(inner.deadline, outer.deadline)
+                    self.count_to(RUNAWAY)
+
+    def test_default_inside_explicit_keeps_deadline(self):
+        """A default limit does not extend an explicit one around it."""
+        with statement_timeout(self.conn, 0.05) as outer:
+            with statement_timeout(self.conn, 10, default=True) as inner:
+                self.assertEqual(inner.deadline, outer.deadline)
+
+    def test_default_inside_default_restarts_clock(self):
+        """A default limit inside another default one starts counting afresh."""
+        with statement_timeout(self.conn, 0.1, default=True) as outer:
+            time.sleep(0.08)
+            with statement_timeout(self.conn, 0.1, default=True) as inner:
+                self.assertGreater(inner.deadline, outer.deadline)
+                time.sleep(0.05)
+                self.assertEqual(self.count_to(10000), 10000)
+
+    def test_outer_limit_restored(self):
+        """After a nested block, the outer deadline applies again."""
+        with self.assertRaises(QueryTimeout):
+            with statement_timeout(self.conn, 0.05):
+                with statement_timeout(self.conn, None):
+                    pass
+                self.count_to(RUNAWAY)
+
+
+class TestCancel(TimeoutTestCase):
+    """cancel() stops the running statement, but only inside its block."""
+
+    def test_cancel_from_another_thread(self):
+        """The running statement stops with QueryCancelled."""
+        with self.assertRaises(QueryCancelled):
+            with statement_timeout(self.conn, None) as limit:
+                threading.Timer(0.05, limit.cancel).start()
+                self.count_to(RUNAWAY)
+
+    def test_late_cancel_does_nothing(self):
+        """cancel() after the block cannot interrupt the next user's statement."""
+        with statement_timeout(self.conn, None) as limit:
+            pass
+        timer = threading.Timer(0.02, limit.cancel)
+        timer.start()
+        self.assertEqual(self.count_to(200000), 200000)
+        timer.join()
+
+
+class TestRetryBudget(DatabaseTestCase):
+    """With query_timeout set, every retry attempt gets the whole budget."""
+
+    def setUp(self):
+        super().setUp()
+        db_pool.configure(query_timeout=0.2)
+
+    def tearDown(self):
+        db_pool.configure(query_timeout=None)
+        super().tearDown()
+
+    def retry(self, func, retry_if):
+        with db_pool.connection() as conn:
+            return call_with_retry(func, (conn,), {}, 3, 0.001, 0.001, None,
+                                   retry_if, RetryStats())
+
+    def test_each_attempt_gets_full_budget(self):
+        """Attempts that together run past query_timeout still succeed one by one."""
+        attempts = []
+
+        def func(conn):
+            attempts.append(1)
+            time.sleep(0.15)
+            if len(attempts) == 1:
+                raise sqlite3.OperationalError("database is locked")
+            return conn.execute(COUNT_TO, (20000,)).fetchone()[0]
+        self.assertEqual(self.retry(func, lambda e: True), 20000)
+        self.assertEqual(len(attempts), 2)
+
+    def test_timed_out_attempt_reaches_retry_if(self):
+        """A statement stopped by query_timeout is seen by retry_if as QueryTimeout."""
+        seen = []
+
+        def func(conn):
+            if not seen:
+                conn.execute(COUNT_TO, (RUNAWAY,)).fetchone()
+            return 'ok'
+
+        def retry_if(e):
+            seen.append(e)
+            return isinstance(e, QueryTimeout)
+        self.assertEqual(self.retry(func, retry_if), 'ok')
+        self.assertEqual(len(seen), 1)
+        self.assertIsInstance(seen[0], QueryTimeout)
+
+
+if __name__ == '__main__':
+    unittest.main()
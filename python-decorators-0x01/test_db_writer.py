@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Unit tests for db_writer.WriteQueue: group commits, failure isolation
+and what happens to queued writes when the writer thread dies
+"""
+import os
+import tempfile
+import threading
+import unittest
+
+from db_writer import WriteQueue, WriterClosed
+from fixtures import DatabaseTestCase
+
+
+def insert(conn, value):
+    """Mutation used by the tests: add one row."""
+    conn.execute("INSERT INTO items (value) VALUES (?)", (value,))
+    return value
+
+
+def fail(conn, value):
+    """Mutation that writes a row and then raises."""
+    conn.execute("INSERT INTO items (value) VALUES (?)", (value,))
+    raise ValueError(value)
+
+
+class WriterTestCase(DatabaseTestCase):
+    """Adds a way to keep the writer thread busy while writes queue up."""
+
+    def hold_writer(self, writer):
+        """
+        Submit a write that blocks until the returned event is set, and
+        wait until the writer thread is inside it.
+        """
+        started, release = threading.Event(), threading.Event()
+
+        def blocker(conn):
+            started.set()
+            release.wait(5)
+            return insert(conn, 'first')
+        future = writer.submit(blocker)
+        self.assertTrue(started.wait(5))
+        return future, release
+
+
+class TestGroupCommit(WriterTestCase):
+    """Writes queued while the writer is busy are committed together."""
+
+    def test_queued_writes_share_one_batch(self):
+        """Everything queued behind a running batch goes into the next one."""
+        writer = WriteQueue(max_batch=100, max_wait=0.01)
+        try:
+            first, release = self.hold_writer(writer)
+            futures = [writer.submit(insert, str(i)) for i in range(50)]
+            release.set()
+            self.assertEqual([f.result(5) for f in futures], [str(i) for i in range(50)])
+            self.assertEqual(first.result(5), 'first')
+        finally:
+            writer.close()
+        self.assertEqual(writer.batches, 2)
+        self.assertEqual(writer.writes, 51)
+        self.assertEqual(len(self.values()), 51)
+
+    def test_max_batch_splits_batches(self):
+        """No batch holds more than max_batch writes."""
+        writer = WriteQueue(max_batch=10, max_wait=0.01)
+        try:
+            first, release = self.hold_writer(writer)
+            futures = [writer.submit(insert, str(i)) for i in range(25)]
+            release.set()
+            for future in futures + [first]:
+                future.result(5)
+        finally:
+            writer.close()
+        self.assertEqual(writer.batches, 4)
+
+    def test_own_database_connection(self):
+        """A queue given a database writes through its own connection."""
+        writer = WriteQueue(database=self.database)
+        try:
+            self.assertEqual(writer.submit(insert, 'x').result(5), 'x')
+        finally:
+            writer.close()
+        self.assertEqual(self.values(), ['x'])
+
+
+class TestFailureIsolation(WriterTestCase):
+    """A failing write only fails its own future and undoes its own changes."""
+
+    def test_failed_write_is_rolled_back_alone(self):
+        """The rest of the batch commits; the failing write leaves no row."""
+        writer = WriteQueue(max_wait=0.01)
+        try:
+            first, release = self.hold_writer(writer)
+            ok1 = writer.submit(insert, 'a')
+            bad = writer.submit(fail, 'b')
+            ok2 = writer.submit(insert, 'c')
+            release.set()
+            self.assertEqual(ok1.result(5), 'a')
+            self.assertEqual(ok2.result(5), 'c')
+            with self.assertRaises(ValueError):
+                bad.result(5)
+            first.result(5)
+        finally:
+            writer.close()
+        self.assertEqual(self.values(), ['a', 'c', 'first'])
+
+    def test_submit_after_close(self):
+        """A closed queue refuses new writes."""
+        writer = WriteQueue()
+        writer.close()
+        with self.assertRaises(WriterClosed):
+            writer.submit(insert, 'x')
+
+
+class TestWriterThreadDeath(WriterTestCase):
+    """Writes never hang when the writer thread stops unexpectedly."""
+
+    def test_base_exception_fails_outstanding_writes(self):
+        """SystemExit in a write fails its batch, the queued writes and later submits."""
+        writer = WriteQueue(max_wait=0.01)
+        started, release = threading.Event(), threading.Event()
+
+        def exit_writer(conn):
+            insert(conn, 'lost')
+            started.set()
+            release.wait(5)
+            raise SystemExit
+        dying = writer.submit(exit_writer)
+        self.assertTrue(started.wait(5))
+        queued = writer.submit(insert, 'queued')
+        release.set()
+        self.assertIsInstance(dying.exception(5), SystemExit)
+        self.assertIsInstance(queued.exception(5), WriterClosed)
+        writer._thread.join(5)
+        self.assertFalse(writer._thread.is_alive())
+        with self.assertRaises(WriterClosed):
+            writer.submit(insert, 'later')
+        self.assertEqual(self.values(), [])
+
+    def test_connection_failure_fails_outstanding_writes(self):
+        """A writer that cannot open its connection fails what was queued."""
+        missing = os.path.join(tempfile.gettempdir(), 'no-such-dir', 'x.db')
+        writer = WriteQueue(database=missing)
+        writer._thread.join(5)
+        with self.assertRaises(WriterClosed):
+            writer.submit(insert, 'x')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,75 +1,42 @@
-import mysql.connector
 from mysql.connector import Error
 
-# --- Database Configuration (Updated with your details) ---
-DB_CONFIG = {
-    'host': '127.0.0.1',
-    'user': 'kokoscripts',
-    'password': 'your_actual_password', # Replace with your actual password
-    'database': 'ALX_prodev'
-}
-
-def connect_to_prodev():
-    """
-    Connects to the ALX_prodev database in MySQL.
-    Returns a connection object to ALX_prodev if successful, None otherwise.
-    """
-    try:
-        conn = mysql.connector.connect(
-            host=DB_CONFIG['host'],
-            user=DB_CONFIG['user'],
-            password=DB_CONFIG['password'],
-            database=DB_CONFIG['database']
-        )
-        if conn.is_connected():
-            pass # Suppress connection message for cleaner generator output
-        return conn
-    except Error as e:
-        print(f"Error connecting to database '{DB_CONFIG['database']}': {e}")
-        return None
+from db_pool import connection
 
 def stream_users_in_batches(batch_size):
     """
     A generator function that fetches rows from the user_data table in batches.
-    It connects to the ALX_prodev database and yields lists of user dictionaries.
-    Ensures that the database connection and cursor are properly closed.
+    It borrows a connection from the shared pool and yields lists of user dictionaries.
+    Ensures that the cursor is closed and the connection given back to the pool.
 
     Args:
         batch_size (int): The number of rows to include in each batch.
     """
-    conn = None
-    cursor = None
     try:
-        conn = connect_to_prodev()
-        if conn:
+        with connection() as conn:
             # Use buffered=True to fetch all results into memory if necessary,
             # or use unbuffered=True for very large datasets where memory is a concern.
             # For simplicity and to fit the single loop per function, we'll use buffered.
             # If unbuffered is used, the cursor itself acts as the generator.
             cursor = conn.cursor(dictionary=True)
-            query = "SELECT user_id, name, email, age FROM user_data;"
-            cursor.execute(query)
+            try:
+                query = "SELECT user_id, name, email, age FROM user_data;"
+                cursor.execute(query)
 
-            batch = []
-            # Loop 1: Iterates through all rows fetched by the cursor
-            for row in cursor:
-                batch.append(row)
-                if len(batch) >= batch_size:
-                    yield batch
-                    batch = [] # Reset batch after yielding
+                batch = []
+                # Loop 1: Iterates through all rows fetched by the cursor
+                for row in cursor:
+                    batch.append(row)
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = [] # Reset batch after yielding
 
-            # Yield any remaining rows that didn't form a full batch
-            if batch:
-                yield batch
-        else:
-            print("Could not establish database connection for streaming batches.")
+                # Yield any remaining rows that didn't form a full batch
+                if batch:
+                    yield batch
+            finally:
+                cursor.close()
     except Error as e:
         print(f"Error during batch streaming: {e}")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
 
 def batch_processing(batch_size):
     """
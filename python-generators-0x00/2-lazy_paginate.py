@@ -1,32 +1,6 @@
-import mysql.connector
 from mysql.connector import Error
 
-# --- Database Configuration (Using your provided details) ---
-DB_CONFIG = {
-    'host': '127.0.0.1',
-    'user': 'kokoscripts',
-    'password': 'your_actual_password', # IMPORTANT: Replace with your actual password
-    'database': 'ALX_prodev'
-}
-
-def connect_to_prodev():
-    """
-    Connects to the ALX_prodev database in MySQL.
-    Returns a connection object to ALX_prodev if successful, None otherwise.
-    """
-    try:
-        conn = mysql.connector.connect(
-            host=DB_CONFIG['host'],
-            user=DB_CONFIG['user'],
-            password=DB_CONFIG['password'],
-            database=DB_CONFIG['database']
-        )
-        if conn.is_connected():
-            pass # Suppress connection message for cleaner output
-        return conn
-    except Error as e:
-        print(f"Error connecting to database '{DB_CONFIG['database']}': {e}")
-        return None
+from db_pool import connection
 
 def paginate_users(page_size, offset):
     """
@@ -41,25 +15,22 @@ def paginate_users(page_size, offset):
               Returns an empty list if no users are found for the given page/offset,
               or if a database error occurs.
     """
-    conn = None
-    cursor = None
     users_on_page = []
     try:
-        conn = connect_to_prodev()
-        if conn:
+        # Each page borrows an already open connection from the shared pool
+        # instead of connecting (and authenticating) again.
+        with connection() as conn:
             cursor = conn.cursor(dictionary=True) # Get rows as dictionaries
-            # SQL query to fetch a page of users using LIMIT and OFFSET
-            # Changed to SELECT * to match the requested pattern
-            query = f"SELECT * FROM user_data LIMIT {page_size} OFFSET {offset};"
-            cursor.execute(query)
-            users_on_page = cursor.fetchall() # Fetch all results for the current page
+            try:
+                # SQL query to fetch a page of users using LIMIT and OFFSET
+                # Changed to SELECT * to match the requested pattern
+                query = f"SELECT * FROM user_data LIMIT {page_size} OFFSET {offset};"
+                cursor.execute(query)
+                users_on_page = cursor.fetchall() # Fetch all results for the current page
+            finally:
+                cursor.close()
     except Error as e:
         print(f"Error fetching page (size={page_size}, offset={offset}): {e}")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
     return users_on_page
 
 def lazy_paginate(page_size):
@@ -0,0 +1,113 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+from mysql.connector import Error
+from mysql.connector.pooling import MySQLConnectionPool, PoolError
+
+#### one MySQL connection pool for ALX_prodev, shared by every generator in this directory
+
+# Settings come from these environment variables (with these defaults).
+ENVIRONMENT = {
+    'host': ('PRODEV_DB_HOST', '127.0.0.1'),
+    'port': ('PRODEV_DB_PORT', '3306'),
+    'user': ('PRODEV_DB_USER', 'root'),
+    'password': ('PRODEV_DB_PASSWORD', ''),
+    'database': ('PRODEV_DB_NAME', 'ALX_prodev'),
+    'pool_size': ('PRODEV_DB_POOL_SIZE', '5'),
+    'pool_timeout': ('PRODEV_DB_POOL_TIMEOUT', '10'),
+}
+
+
+def get_config():
+    """Connection and pool settings read from the environment."""
+    config = {key: os.environ.get(var, default) for key, (var, default) in ENVIRONMENT.items()}
+    config['port'] = int(config['port'])
+    config['pool_size'] = int(config['pool_size'])
+    config['pool_timeout'] = float(config['pool_timeout'])
+    return config
+
+
+class ProdevPool(MySQLConnectionPool):
+    """
+    MySQLConnectionPool whose checkouts wait for a connection to come back
+    instead of failing at once when all of them are in use.
+
+    What the pool already does is kept: all pool_size connections are
+    opened up front, each is health-checked (pinged, and reconnected if
+    the server dropped it) when it is checked out, and its session is
+    reset when it is given back, so no temporary tables, variables or open
+    transactions leak to the next user. Rows a stream left unread when its
+    consumer stopped early are discarded when its cursor is closed.
+    """
+
+    def __init__(self, pool_size=5, timeout=10.0, **config):
+        self.timeout = timeout
+        self._returned = threading.Condition()
+        super().__init__(pool_size=pool_size, pool_name='prodev', pool_reset_session=True,
+                         consume_results=True, **config)
+
+    def add_connection(self, cnx=None):
+        super().add_connection(cnx)
+        with self._returned:
+            self._returned.notify()
+
+    def get_connection(self, timeout=None):
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        with self._returned:
+            while True:
+                try:
+                    return super().get_connection()
+                except PoolError:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolError(f"no connection available after waiting "
+                                        f"(pool_size={self.pool_size})") from None
+                    self._returned.wait(remaining)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the shared pool, creating it (and its connections) on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            config = get_config()
+            _pool = ProdevPool(config.pop('pool_size'), config.pop('pool_timeout'), **config)
+        return _pool
+
+
+def release(conn):
+    """Give a pooled connection back to the pool."""
+    try:
+        conn.close()
+    except Error:
+        # Its session could not be reset, but it is back in the pool all the
+        # same; the health check reconnects it on its next checkout if broken.
+        pass
+
+
+@contextmanager
+def connection(timeout=None):
+    """Check out a pooled connection for the duration of the block."""
+    conn = get_pool().get_connection(timeout)
+    try:
+        yield conn
+    finally:
+        release(conn)
+
+
+def connect_to_prodev():
+    """
+    Returns a pooled connection to the ALX_prodev database, or None if
+    none could be had. Its close() gives it back to the pool.
+    """
+    try:
+        return get_pool().get_connection()
+    except Error as e:
+        print(f"Error connecting to database '{get_config()['database']}': {e}")
+        return None
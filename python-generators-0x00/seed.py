@@ -1,31 +1,6 @@
-import mysql.connector
 from mysql.connector import Error
 
-DB_CONFIG = {
-    'host': '127.0.0.1',
-    'user': 'kokoscripts',
-    'password': 'mmekekon98...', # Added a comma here
-    'database': 'ALX_prodev'
-}
-
-def connect_to_prodev():
-    """
-    Connects to the ALX_prodev database in MySQL.
-    Returns a connection object to ALX_prodev if successful, None otherwise.
-    """
-    try:
-        conn = mysql.connector.connect(
-            host=DB_CONFIG['host'],
-            user=DB_CONFIG['user'],
-            password=DB_CONFIG['password'],
-            database=DB_CONFIG['database']
-        )
-        if conn.is_connected():
-            print(f"Successfully connected to database '{DB_CONFIG['database']}'.")
-        return conn
-    except Error as e:
-        print(f"Error connecting to database '{DB_CONFIG['database']}': {e}")
-        return None
+from db_pool import connect_to_prodev
 
 if __name__ == "__main__":
     # Example usage:
@@ -46,6 +21,6 @@ if __name__ == "__main__":
             print(f"Error fetching data: {e}")
         finally:
             db_connection.close()
-            print("Database connection closed.")
+            print("Database connection returned to the pool.")
     else:
         print("Failed to establish a connection to the ALX_prodev database.")